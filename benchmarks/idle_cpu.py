@@ -0,0 +1,75 @@
+'''
+idle_cpu:
+
+Measures the CPU used by the dashboard's acquisition stack while it is connected to the Quail Emulator and nothing else is
+happening: the data process (serial reads, parsing, command thread) and the GUI-side work (draining the data queue every
+update interval, as GraphPanes does, and the record thread writing to a scratch file). No Tk window is opened.
+
+Run from the repository root (Linux only, the data process's CPU time is read from /proc):
+
+    python -m benchmarks.idle_cpu --duration 10
+
+Prints one JSON object with the CPU usage of each process, in percent of one core.
+'''
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from lib.quail_serial import quail
+
+UPDATE_INTERVAL = 0.05 # time (sec) between GUI polls of the data queue, matching GraphPanes.update_interval
+
+def process_cpu_time(pid):
+    ''' Returns the user + system CPU time (sec) used so far by the process with the given pid. '''
+    with open("/proc/{}/stat".format(pid)) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12]))/os.sysconf('SC_CLK_TCK') # utime and stime, in clock ticks
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measure idle CPU usage of the acquisition stack with the emulator connected.")
+    parser.add_argument("--duration", type = float, default = 10.0, help = "measurement time, in seconds")
+    parser.add_argument("--transport", default = 'queue', choices = ['queue', 'shm'])
+    parser.add_argument("--protocol", default = 'csv', choices = ['csv', 'binary'])
+    parser.add_argument("--rate", type = float, default = 1.0, help = "emulator replay speed multiplier")
+    args = parser.parse_args()
+
+    q = quail(None, COM_Port = -1, transport = args.transport, protocol = args.protocol, emulator_options = {'rate': args.rate})
+    q.start_collection()
+    with tempfile.TemporaryDirectory() as directory:
+        q.start_recording("idle_cpu", directory = directory)
+        time.sleep(1.0) # let the data process settle
+        data_cpu_start = process_cpu_time(q.data_process.pid)
+        gui_cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        samples = 0
+        while time.perf_counter() - wall_start < args.duration:
+            while not q.data_queue.empty():
+                block = q.data_queue.get()
+                if isinstance(block, np.ndarray): # a non-array item only signals a serial port change
+                    samples += len(block)
+            time.sleep(UPDATE_INTERVAL)
+        wall = time.perf_counter() - wall_start
+        data_cpu = process_cpu_time(q.data_process.pid) - data_cpu_start
+        gui_cpu = time.process_time() - gui_cpu_start
+        q.stop_collection()
+
+    json.dump({
+        "benchmark": "idle_cpu",
+        "transport": args.transport,
+        "protocol": args.protocol,
+        "rate": args.rate,
+        "duration_s": round(wall, 3),
+        "samples": samples,
+        "data_process_cpu_pct": round(100*data_cpu/wall, 1),
+        "gui_process_cpu_pct": round(100*gui_cpu/wall, 1),
+    }, sys.stdout)
+    print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+'''
+throughput:
+
+End-to-end throughput and latency benchmark of the acquisition stack. For each emulator rate in turn, the Quail Emulator is
+started in a process of its own behind a pseudo-terminal (see PtyEmulator.py) and connected through quail as a serial device
+(data process running data_worker), and the GUI side is driven the way the dashboard drives it: every update interval
+GraphPanes.frame runs update_data (dequeue, unit conversion, trimming) and a ChannelPane's animate step, whose artists are then
+drawn on an offscreen Agg canvas. No Tk window is opened.
+
+For each rate it reports:
+    lines_per_sec   : samples that reached the plotting buffer per second, against offered_per_sec sent by the emulator
+    samples_lost    : lines/frames rejected or missed by the serial parser
+    display_coalesced : samples dropped or min/max-decimated from the display path because the GUI fell behind
+    latency p50/p99 : time from a sample becoming readable on the (emulated) serial port to it being in the plotting buffer
+    frame p50/p99   : time taken by update_data and by the whole animate + draw step
+    CPU             : of the data process and of the GUI process, in percent of one core, and separately of the emulator
+    trace_ms        : with --trace, the per-stage p50/p99 latencies from the LatencyTracer
+
+The emulator's output is synthetic (SyntheticTelemetry) unless --file is given, in which case the emulator's csv file is
+replayed (about 28 samples/sec at rate 1). The emulator runs in its own process so that the data process's CPU is only the
+acquisition stack's: generating and encoding the stream (and pacing it) costs about as much as reading it. The emulator only
+sleeps between samples (spin_margin = 0, see QuailEmulator), so on a machine with few cores its pacing does not take CPU from
+the processes being measured. Each result states this setup under "emulator". Run from the repository root (Linux only: the
+emulator needs a pty and is forked, and the CPU times are read from /proc):
+
+    python -m benchmarks.throughput --rates 1 10 100 --duration 10
+    python -m benchmarks.throughput --protocol binary --transport shm --sample-rate 5000 --convert
+    python -m benchmarks.throughput --channels 32 --rates 1 5
+
+Prints one JSON object per rate, one per line, so runs can be compared with earlier results.
+'''
+
+import argparse
+import json
+import multiprocessing as mp
+import sys
+import time
+
+import numpy as np
+import matplotlib.figure as figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from lib.quail_serial import quail
+from lib.PtyEmulator import PtyEmulator
+from lib.GraphPanes import GraphPanes
+from lib.ChannelPane import ChannelPane
+from lib.ChannelSchema import ChannelSchema
+from benchmarks.idle_cpu import process_cpu_time
+
+WARMUP = 1.0 # time (sec) after collection starts that is left out of the statistics, while the data process starts up
+CONVERT_UNITS = {'psi': 'kPa', 'lbf': 'N'} # display units used with --convert, so the unit conversion does real work
+EMULATOR_SPIN_MARGIN = 0.0 # the emulator only sleeps between samples, leaving the CPU to the processes being measured
+
+class TimedGraphPanes(GraphPanes):
+    ''' Headless GraphPanes that records how long update_data takes and the latency of every sample it adds to the buffer. '''
+    def __init__(self, quail, emulator):
+        super().__init__(None, quail)
+        self.emulator = emulator # the QuailEmulator streaming to the data process (in its own process), whose clock gives each sample's due time
+        self.recording = False # set once the warmup is over
+        self.window_start = 0.0 # perf_counter time at which the measured window starts
+        self.samples = 0 # samples added to the buffer while recording that were due inside the measured window
+        self.latencies = [] # arrays of per-sample latencies (sec)
+        self.update_times = [] # duration (sec) of each update_data call
+
+    def update_data(self):
+        time_data = self.time_data
+        last_time = time_data[-1, 0]
+        start = time.perf_counter()
+        super().update_data()
+        end = time.perf_counter()
+        if not self.recording:
+            return
+        time_data = self.time_data
+        new_times = time_data[np.searchsorted(time_data[:, 0], last_time, side = 'right'):, 0]
+        due = self.emulator.start_time + new_times/self.emulator.rate # perf_counter time at which each sample became readable
+        self.samples += int(np.count_nonzero(due >= self.window_start)) # not the backlog of samples due during the warmup
+        self.latencies.append(end - due)
+        self.update_times.append(end - start)
+
+class OffscreenChannelPane(FigureCanvasAgg):
+    ''' ChannelPane drawn on an offscreen Agg canvas: the same axes and animate step, registered with GraphPanes but without Tk's timer. '''
+    setup_axes = ChannelPane.setup_axes
+    animate = ChannelPane.animate
+
+    def __init__(self, graphpanes):
+        self.graphpanes = graphpanes
+        self.num_data_channels = np.size(self.graphpanes.ch_offsets)
+        self.fig = figure.Figure()
+        super().__init__(self.fig)
+        self.setup_axes()
+        self.draw()
+        self.graphpanes.register(self, self.animate)
+
+def file_samples(file_times, t0, t1):
+    ''' Returns the number of lines of a file replayed in a loop (see QuailEmulator) whose time is within [t0, t1). '''
+    period = file_times[-1]
+    def lines_before(t):
+        return int(t // period)*len(file_times) + int(np.searchsorted(file_times, t % period))
+    return lines_before(t1) - lines_before(t0)
+
+def percentiles(values):
+    ''' Returns the p50 and p99 of values in milliseconds, or None if there are none. '''
+    if len(values) == 0:
+        return None, None
+    p50, p99 = np.percentile(values, [50, 99])
+    return round(1000*p50, 3), round(1000*p99, 3)
+
+def run(rate, args):
+    ''' Runs the benchmark at one emulator rate and returns its results as a dict. '''
+    synthetic = None
+    if not args.file:
+        synthetic = {'num_channels': args.channels, 'sample_rate': args.sample_rate, 'seed': args.seed}
+        schema = ChannelSchema(['CH' + str(j + 1) for j in range(args.channels)], ['psi']*args.channels)
+    else:
+        schema = None # the emulator's file has the six channels of the default channel definition file
+    pty = PtyEmulator(protocol = args.protocol, rate = rate, synthetic = synthetic, spin_margin = EMULATOR_SPIN_MARGIN)
+    emulator = pty.emulator # the emulator process gets a copy of this emulator, with the same start time
+    emulator_process = mp.get_context('fork').Process(name = "Quail_EmulatorProcess", target = pty.run, daemon = True) # inherits the pty
+    emulator_process.start()
+    q = quail(None, COM_Port = pty.port, transport = args.transport, protocol = args.protocol, trace = args.trace, schema = schema)
+    graphpanes = TimedGraphPanes(q, emulator)
+    if args.convert:
+        graphpanes.disp_units = [CONVERT_UNITS.get(unit, unit) for unit in graphpanes.ch_units]
+        graphpanes.update_conversions()
+    OffscreenChannelPane(graphpanes) # registers itself with graphpanes, which draws it on every frame
+    interval = graphpanes.update_interval/1000
+
+    q.start_collection()
+    start = time.perf_counter()
+    while time.perf_counter() - start < WARMUP:
+        graphpanes.frame()
+        time.sleep(interval)
+    graphpanes.recording = True
+    lost_start = q.samples_lost.value
+    coalesced_start = q.display_coalesced.value
+    data_cpu_start = process_cpu_time(q.data_process.pid)
+    emulator_cpu_start = process_cpu_time(emulator_process.pid)
+    gui_cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    graphpanes.window_start = wall_start
+    frame_times = []
+    next_frame = wall_start
+    while time.perf_counter() - wall_start < args.duration:
+        frame_start = time.perf_counter()
+        graphpanes.frame()
+        frame_times.append(time.perf_counter() - frame_start)
+        next_frame += interval
+        time.sleep(max(0.0, next_frame - time.perf_counter())) # keep the update interval, as Tk's timer would (skipping no frames)
+    wall = time.perf_counter() - wall_start
+    if args.file: # the file's rate varies, so count the lines it sent during the measured window
+        offered = file_samples(emulator.file_times, (wall_start - emulator.start_time)*rate, (wall_start + wall - emulator.start_time)*rate)/wall
+    else:
+        offered = rate*args.sample_rate
+    data_cpu = process_cpu_time(q.data_process.pid) - data_cpu_start
+    emulator_cpu = process_cpu_time(emulator_process.pid) - emulator_cpu_start
+    gui_cpu = time.process_time() - gui_cpu_start
+    lost = q.samples_lost.value - lost_start
+    q.kill.set()
+    while q.data_process.is_alive(): # the data process cannot exit while blocks it queued are waiting to be read, so drain them
+        while not q.data_queue.empty():
+            q.data_queue.get()
+        q.data_process.join(interval)
+    q.stop_collection()
+    emulator_process.terminate()
+    emulator_process.join()
+    pty.close()
+
+    latencies = np.concatenate(graphpanes.latencies) if graphpanes.latencies else []
+    latency_p50, latency_p99 = percentiles(latencies)
+    update_p50, update_p99 = percentiles(graphpanes.update_times)
+    frame_p50, frame_p99 = percentiles(frame_times)
+    return {
+        "benchmark": "throughput",
+        "transport": args.transport,
+        "protocol": args.protocol,
+        "source": "file" if args.file else "synthetic",
+        "convert": args.convert,
+        "rate": rate,
+        "channels": len(q.schema),
+        "duration_s": round(wall, 3),
+        "offered_per_sec": round(offered, 1),
+        "lines_per_sec": round(graphpanes.samples/wall, 1),
+        "samples": graphpanes.samples,
+        "samples_lost": lost,
+        "display_coalesced": q.display_coalesced.value - coalesced_start,
+        "latency_p50_ms": latency_p50,
+        "latency_p99_ms": latency_p99,
+        "update_data_p50_ms": update_p50,
+        "update_data_p99_ms": update_p99,
+        "frame_p50_ms": frame_p50,
+        "frame_p99_ms": frame_p99,
+        "frames": len(frame_times),
+        "data_process_cpu_pct": round(100*data_cpu/wall, 1),
+        "gui_process_cpu_pct": round(100*gui_cpu/wall, 1),
+        "trace_ms": graphpanes.tracer.summary() if graphpanes.tracer is not None else None,
+        "emulator": {"process": "separate, PtyEmulator", "pacing": "sleep", "spin_margin_s": EMULATOR_SPIN_MARGIN,
+                     "cpu_pct": round(100*emulator_cpu/wall, 1)},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measure throughput and latency of the acquisition stack at increasing emulator rates.")
+    parser.add_argument("--rates", type = float, nargs = '+', default = [1.0, 10.0, 100.0], help = "emulator replay speed multipliers to run, in order")
+    parser.add_argument("--duration", type = float, default = 10.0, help = "measurement time per rate, in seconds")
+    parser.add_argument("--transport", default = 'queue', choices = ['queue', 'shm'])
+    parser.add_argument("--protocol", default = 'csv', choices = ['csv', 'binary'])
+    parser.add_argument("--channels", type = int, default = 6, help = "number of synthetic data channels")
+    parser.add_argument("--sample-rate", type = float, default = 1000.0, help = "synthetic samples per second at rate 1")
+    parser.add_argument("--seed", type = int, default = 0, help = "synthetic data seed")
+    parser.add_argument("--file", action = 'store_true', help = "replay the emulator's csv file instead of synthetic data")
+    parser.add_argument("--convert", action = 'store_true', help = "display pressures in kPa and forces in N, so every block is unit-converted")
+    parser.add_argument("--trace", action = 'store_true', help = "also trace per-stage latency (see lib/LatencyTrace.py), reported as trace_ms")
+    args = parser.parse_args()
+
+    for rate in args.rates:
+        json.dump(run(rate, args), sys.stdout)
+        print(flush = True)
+
+if __name__ == '__main__':
+    main()
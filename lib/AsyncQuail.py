@@ -0,0 +1,297 @@
+'''
+AsyncQuail:
+
+An asyncio acquisition engine, selectable in place of quail (MainWindow.QUAIL_ENGINE = 'asyncio'). The GUI side is the same
+(data_queue/SharedRingBuffer, write_command, start/stop_recording, record_stats, connection_status), but the data process runs
+one event loop instead of a blocking read loop plus a polling cmd thread, and recording happens in the data process instead of a
+record thread in the GUI process.
+
+Everything in the data process is driven by the event loop:
+
+    serial reads     : the serial port's file descriptor is registered with loop.add_reader and read without blocking when it
+                       becomes readable (the in-process QuailEmulator has no descriptor, so it is polled every BLOCK_MAX_AGE)
+    commands         : write_command sends commands over a pipe whose descriptor is also registered with add_reader, so a command
+                       is written to Quail as soon as it arrives rather than on the next poll of a queue; commands that arrive
+                       while Quail is disconnected are held, in order, and written once it is reconnected
+    recording        : the record file is written as blocks arrive; a timer coroutine flushes (and optionally fsyncs) it
+    transport        : full blocks are handed to the GUI as they are parsed; a timer coroutine sends blocks that have waited
+                       BLOCK_MAX_AGE and retries samples held back from a GUI that has fallen behind
+    health           : a timer coroutine publishes samples_lost and the write statistics, and reopens a port that has been silent
+                       for SILENCE_TIMEOUT (some USB adapters stop delivering data without reporting an error when unplugged)
+    supervisor       : checks for shutdown and for a new COM Port every WORKER_POLL_TIMEOUT
+
+Connecting and reconnecting use the same ConnectionManager (with backoff) as quail.
+
+AsyncQuail is POSIX only: Windows event loops cannot watch pipes or serial ports with add_reader (the Proactor loop does not
+implement it and the selector loop only accepts sockets), so constructing it elsewhere raises RuntimeError. Use quail there.
+'''
+
+import asyncio
+import collections
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+import serial
+
+from lib.quail_serial import quail, format_lines, BLOCK_MAX_ROWS, BLOCK_MAX_AGE, WORKER_POLL_TIMEOUT
+from lib.RecordWriter import RecordWriter
+from lib.ColumnarRecording import ColumnarRecordWriter, column_names
+
+HEALTH_INTERVAL = 1.0 # time (sec) between health checks
+SILENCE_TIMEOUT = 5.0 # time (sec) without any bytes from an open port after which it is reopened
+RECORD_STOP_TIMEOUT = 5.0 # maximum time (sec) stop_recording waits for the data process to close the record file
+
+class AsyncQuail(quail):
+    def __init__(self, mainwindow, *args, **kwargs):
+        if os.name != 'posix':
+            raise RuntimeError("the asyncio acquisition engine needs loop.add_reader on pipes and serial ports, which Windows event loops do not support; use the 'thread' engine")
+        super().__init__(mainwindow, *args, **kwargs)
+        self.command_reader, self.command_writer = mp.Pipe(duplex = False) # commands from the GUI, replaces command_queue
+        self.control_reader, self.control_writer = mp.Pipe(duplex = False) # recording start/stop requests from the GUI
+        self.record_closed = mp.Event() # set by the data process once the record file has been closed
+        self.record_bytes = mp.Value('l', 0) # bytes written to the current/last record file
+        self.record_rate = mp.Value('d', 0.0) # bytes written per second, see RecordWriter
+
+    def __getstate__(self):
+        return super().__getstate__() + (self.command_reader, self.control_reader, self.record_closed, self.record_bytes, self.record_rate, self.record_flush_interval, self.record_fsync_interval)
+
+    def __setstate__(self, state):
+        super().__setstate__(state[:-7])
+        self.command_reader, self.control_reader, self.record_closed, self.record_bytes, self.record_rate, self.record_flush_interval, self.record_fsync_interval = state[-7:]
+
+    ### GUI side ###
+
+    def write_command(self, command):
+        try:
+            self.command_writer.send(int(command))
+        except (TypeError, ValueError):
+            print("Quail object recieved non-integer command, " + str(command))
+
+    def start_recording(self, filename, directory=None):
+        self.filename = self.record_filename(filename, directory)
+        self.record_closed.clear()
+        self.record_bytes.value, self.record_rate.value = 0, 0.0
+        self.control_writer.send(('start', self.filename)) # the data process opens the file and records from its next block
+        self.recording.set()
+
+    def stop_recording(self):
+        self.recording.clear()
+        self.control_writer.send(('stop', None))
+        if self.data_process.is_alive():
+            self.record_closed.wait(RECORD_STOP_TIMEOUT) # wait for the data process to finish the file
+
+    def record_stats(self):
+        if self.filename is None:
+            return None
+        return {'bytes_written': self.record_bytes.value, 'bytes_per_sec': self.record_rate.value, 'backlog': 0, 'dropped': self.record_dropped.value}
+
+    ### Data process ###
+
+    def data_worker(self):
+        asyncio.run(self.run_engine())
+
+    async def run_engine(self):
+        self.loop = asyncio.get_running_loop()
+        self.parser = self.new_parser() # splits the raw serial bytes into lines/frames and converts them to samples
+        self.publisher = self.start_publisher() # TelemetryServer fanning blocks out to other viewers, or None
+        self.block, self.block_lines, self.block_rows = [], [], 0 # samples waiting to be sent to the GUI as one block
+        self.block_start = 0 # perf_counter time when the oldest sample in block was read
+        self.lost_before = 0 # samples lost by parsers replaced after a serial port change
+        self.display_backlog = None # samples held back because the GUI has fallen behind, sent ahead of the next block
+        self.record_writer, self.record_file = None, None # writer and open file of the current recording
+        self.readable = asyncio.Event() # set when the serial port has bytes to read, or when it has been replaced
+        self.reader_fd = None # serial port file descriptor registered with the loop, if any
+        self.last_data = time.perf_counter() # perf_counter time bytes were last read
+        self.pending_commands = collections.deque() # commands not yet written to Quail, oldest first
+        self.loop.add_reader(self.command_reader.fileno(), self.on_command)
+        self.loop.add_reader(self.control_reader.fileno(), self.on_control)
+        tasks = [asyncio.create_task(coroutine) for coroutine in (self.serial_reader(), self.transport_timer(), self.record_timer(), self.health_timer())]
+
+        while not self.kill.is_set(): # supervisor: wait for shutdown, handle a new COM Port
+            await asyncio.sleep(WORKER_POLL_TIMEOUT)
+            if self.COM_queue.full():
+                self.COM_Port = self.COM_queue.get()
+                self.disconnect()
+                self.connection.reset() # connect to the new port right away
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+        self.loop.remove_reader(self.command_reader.fileno())
+        self.loop.remove_reader(self.control_reader.fileno())
+        self.on_command() # write any commands still waiting
+        if self.pending_commands:
+            print("Quail was not connected, {} command(s) were never sent: {}".format(len(self.pending_commands), list(self.pending_commands)))
+        self.send_block()
+        self.close_record()
+        self.record_closed.set() # release a stop_recording waiting for a data process that has stopped
+        if self.publisher is not None:
+            self.publisher.close()
+        print(self.parser.report())
+
+    async def serial_reader(self):
+        ''' Connects (with backoff) and reads the serial port whenever it is readable, reconnecting when it is lost. '''
+        while True:
+            if self.serial is None:
+                self.serial = self.connection.connect(self.COM_Port)
+                if self.serial is None:
+                    await asyncio.sleep(self.connection.wait_time())
+                    continue
+                self.new_connection()
+                self.send_commands() # commands that arrived while Quail was disconnected
+            self.reader_fd = None
+            try:
+                fd = self.serial.fileno()
+                self.serial.timeout = 0 # reads return what is waiting instead of blocking the loop
+                self.loop.add_reader(fd, self.readable.set)
+                self.reader_fd = fd
+            except (AttributeError, serial.SerialException): # the emulator has no file descriptor
+                pass
+            self.last_data = time.perf_counter()
+            port = self.serial
+            while self.serial is port:
+                if self.reader_fd is not None:
+                    await self.readable.wait()
+                    self.readable.clear()
+                else:
+                    await asyncio.sleep(BLOCK_MAX_AGE)
+                if self.serial is port:
+                    self.read_serial()
+
+    def read_serial(self):
+        ''' Reads and parses everything waiting on the serial port, sending the block once it is full or the port is caught up. '''
+        try:
+            waiting = self.serial.in_waiting
+            if waiting == 0 and self.reader_fd is None:
+                return # nothing due from the emulator yet, don't block on it
+            chunk = self.serial.read(max(1, waiting))
+            waiting = self.serial.in_waiting
+        except (serial.SerialException, OSError): # the port went away (e.g. Quail was unplugged), reconnect
+            self.disconnect()
+            return
+        read_time = time.perf_counter()
+        if chunk:
+            self.last_data = read_time
+        val_array, val_lines = self.parser.feed(chunk)
+        if len(val_array) > 0:
+            if self.block_rows == 0:
+                self.block_start = read_time
+            self.block.append(val_array)
+            if val_lines is None and self.record_file is not None and self.record_format == 'csv':
+                val_lines = format_lines(val_array) # binary frames carry no text, so format the samples for the record file
+            self.block_lines.append(val_lines or '')
+            self.block_rows += len(val_array)
+        if self.block_rows >= BLOCK_MAX_ROWS or waiting == 0:
+            self.send_block()
+
+    def send_block(self):
+        ''' Hands the waiting samples to the GUI (ahead of any held-back samples' retry) and to the record file. '''
+        if self.block_rows == 0:
+            return
+        block = np.concatenate(self.block, axis = 0)
+        if self.trace_queue is not None:
+            self.trace_queue.put((block[-1, 0], self.block_start, time.perf_counter()))
+        self.display_backlog = self.put_display(block if self.display_backlog is None else np.concatenate((self.display_backlog, block), axis = 0))
+        if self.record_file is not None and self.recording.is_set():
+            self.record_writer.write(self.record_file, [block if self.record_format == 'columnar' else ''.join(self.block_lines)])
+        if self.publisher is not None:
+            self.publisher.publish(block)
+        self.block, self.block_lines, self.block_rows = [], [], 0
+        self.samples_lost.value = self.lost_before + self.parser.lost()
+
+    def new_connection(self):
+        ''' Starts over after connecting to a new serial port: a fresh parser, and a reset for the GUI. '''
+        if any(self.parser.rejected.values()): # a flapping link reconnects often, only report the old port's losses
+            print(self.parser.report())
+        self.lost_before += self.parser.lost()
+        self.parser = self.new_parser() # drop any partial line from the old serial port
+        self.block, self.block_lines, self.block_rows = [], [], 0 # samples from the old serial port are no longer wanted
+        self.display_backlog = None
+        self.request_reset() # the GUI should clear old data (new serial port), without blocking the loop
+        if self.publisher is not None:
+            self.publisher.reset()
+
+    def disconnect(self):
+        ''' Closes the serial port so serial_reader reconnects. '''
+        if self.serial is None:
+            return
+        if self.reader_fd is not None:
+            self.loop.remove_reader(self.reader_fd)
+            self.reader_fd = None
+        self.connection.lost(self.serial)
+        self.serial = None
+        self.readable.set() # wake serial_reader
+
+    def on_command(self):
+        ''' Writes every command waiting in the command pipe to Quail (called by the loop when the pipe is readable). '''
+        while self.command_reader.poll():
+            self.pending_commands.append(self.command_reader.recv())
+        self.send_commands()
+
+    def send_commands(self):
+        ''' Writes the held commands to Quail in order. If Quail is not connected, or the write fails, the rest are kept for the
+            next connection. '''
+        while self.pending_commands and self.serial is not None:
+            try:
+                self.serial.write((str(self.pending_commands[0]) + '\r\n').encode()) #convert unicode string to utf-8 and send through serial
+                self.serial.flush() #waits for output to be written to ensure the message gets through
+            except (serial.SerialException, OSError):
+                self.disconnect()
+                return
+            self.pending_commands.popleft()
+
+    def on_control(self):
+        ''' Starts or stops recording as requested by the GUI (called by the loop when the control pipe is readable). '''
+        while self.control_reader.poll():
+            request, filename = self.control_reader.recv()
+            self.close_record() # a new recording also ends the last one
+            if request == 'start':
+                self.record_closed.clear() # only the stop of this recording may release stop_recording
+                if self.record_format == 'columnar':
+                    self.record_writer = ColumnarRecordWriter(filename, None, self.recording, column_names(self.schema.names))
+                else:
+                    self.record_writer = RecordWriter(filename, None, self.recording)
+                self.record_file = self.record_writer.open()
+            else:
+                self.record_closed.set() # the file is complete, stop_recording may return
+
+    def close_record(self):
+        ''' Finishes and closes the record file, if one is open. '''
+        if self.record_file is not None:
+            self.record_writer.close(self.record_file)
+            self.record_file.close()
+            self.record_bytes.value = self.record_writer.bytes_written
+            self.record_writer, self.record_file = None, None
+
+    async def transport_timer(self):
+        ''' Sends blocks that have waited BLOCK_MAX_AGE and retries held-back samples. '''
+        while True:
+            await asyncio.sleep(BLOCK_MAX_AGE)
+            if self.block_rows > 0 and time.perf_counter() - self.block_start >= BLOCK_MAX_AGE:
+                self.send_block()
+            elif (self.display_backlog is not None or self.reset_pending) and self.block_rows == 0:
+                self.display_backlog = self.put_display(self.display_backlog)
+
+    async def record_timer(self):
+        ''' Flushes the record file every record_flush_interval, and fsyncs it every record_fsync_interval if that is set. '''
+        last_fsync = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.record_flush_interval)
+            if self.record_file is None:
+                continue
+            self.record_writer.flush(self.record_file)
+            if self.record_fsync_interval is not None and time.perf_counter() - last_fsync >= self.record_fsync_interval:
+                os.fsync(self.record_file.fileno())
+                last_fsync = time.perf_counter()
+            self.record_bytes.value, self.record_rate.value = self.record_writer.bytes_written, self.record_writer.bytes_per_sec
+
+    async def health_timer(self):
+        ''' Publishes the loss and write statistics, and reopens a port that has gone silent. '''
+        while True:
+            await asyncio.sleep(HEALTH_INTERVAL)
+            self.samples_lost.value = self.lost_before + self.parser.lost()
+            if self.record_file is not None:
+                self.record_bytes.value, self.record_rate.value = self.record_writer.bytes_written, self.record_writer.bytes_per_sec
+            if self.serial is not None and time.perf_counter() - self.last_data > SILENCE_TIMEOUT:
+                self.disconnect()
@@ -7,11 +7,11 @@ import tkinter as tk
 import tkinter.ttk as ttk
 import numpy as np
 import matplotlib.figure as figure
-import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
 decs = 1 # number of decimal places to which the written output is rounded
+MAX_PLOT_ROWS = 8 # maximum number of channel plots stacked in one column, more channels are laid out in more columns
 
 class ChannelPane(FigureCanvasTkAgg):
     def __init__(self, graphpanes, mainframe):
@@ -21,7 +21,14 @@ class ChannelPane(FigureCanvasTkAgg):
         self.fig = figure.Figure()
         super().__init__(self.fig, master=mainframe) 
         self.plot_canvas = self.get_tk_widget()
+        self.setup_axes()
+        self.draw()
+        self.plot_canvas.configure(background = "black")
+
+        self.graphpanes.register(self, self.animate) # drawn on every frame of the GraphPanes' clock
 
+    def setup_axes(self):
+        ''' Creates one subplot per channel, with its line, value readout and min/max labels. Uses only self.fig, so it works on any canvas. '''
         self.ch_axes = []
         self.ch_lines = [""]*self.num_data_channels
         self.ch_text = []
@@ -29,10 +36,12 @@ class ChannelPane(FigureCanvasTkAgg):
         self.ch_max = []
         self.fig.subplots_adjust(left=0.05, right=0.95, hspace = 0.35)
 
-        self.plot_width = graphpanes.plot_width
+        self.plot_width = self.graphpanes.plot_width
 
+        num_cols = -(-self.num_data_channels // MAX_PLOT_ROWS) # ceiling division
+        num_rows = -(-self.num_data_channels // num_cols)
         for i in range(self.num_data_channels):
-            self.ch_axes.append(self.fig.add_subplot(self.num_data_channels,1,i+1))
+            self.ch_axes.append(self.fig.add_subplot(num_rows, num_cols, (i % num_rows)*num_cols + i//num_rows + 1)) # fill each column top to bottom
             self.ch_text.append(self.ch_axes[i].text(self.plot_width*.1, 0, str(round(self.graphpanes.ch_data[-1][i],decs))+" "+str(self.graphpanes.disp_units[i]),fontsize=12, ha = "right", va = "bottom") )
             self.ch_text[i].set_color(self.graphpanes.ch_colors[i])
 
@@ -46,33 +55,27 @@ class ChannelPane(FigureCanvasTkAgg):
             self.ch_axes[i].tick_params(axis = 'x', labelsize=8)
             self.ch_axes[i].set_yticklabels([])
             self.ch_lines[i], = self.ch_axes[i].plot([0],[0],self.graphpanes.ch_colors[i]) 
-        
-        self.draw()
-        self.plot_canvas.configure(background = "black")
-
-        self.ani = animation.FuncAnimation(  self.fig, self.animate, interval=self.graphpanes.update_interval, blit=True)
-
-    def kill(self):
-        self.ani.event_source.stop()
+        self.status_text = self.ch_axes[0].text(0.99, 0.95, "", transform = self.ch_axes[0].transAxes, fontsize=8, ha = "right", va = "top") # latency/backpressure overlay
 
-    def animate(self, ind):
-        self.graphpanes.update_data() # get most recent Quail data
-        # Update plots
-        for i in range(self.num_data_channels):
-            data_to_consider = self.graphpanes.ch_data[-(int)(self.graphpanes.consider_range*self.graphpanes.elements_on_screen):,i]
-            lims = ( 0, max(data_to_consider) + 1E-10 )
-            self.ch_max[i].remove() # remove old labels
-            self.ch_min[i].remove()
-            if self.graphpanes.plot_width != self.plot_width: #if user has adjusted the plot width
+    def animate(self):
+        ''' Updates the plots from the arrays GraphPanes computed for this frame, and returns the artists to redraw. '''
+        bottoms, tops = self.graphpanes.y_limits() # y-limits of every channel, shared with the FocusPane
+        if self.graphpanes.plot_width != self.plot_width: #if user has adjusted the plot width (or the channel names/units)
+            for i in range(self.num_data_channels):
                 self.ch_axes[i].set_title(self.graphpanes.ch_names[i],fontsize = 10)
                 self.ch_axes[i].set_xlim((-self.graphpanes.plot_width, self.graphpanes.plot_width*0.1))
                 self.ch_axes[i].set_xticks([-self.graphpanes.plot_width, 0])
                 self.ch_axes[i].set_ylabel(str(self.graphpanes.disp_units[i]))
-                self.draw()
+            self.graphpanes.redraw(self) # one full redraw, once the returned artists are excluded from it
+        for i in range(self.num_data_channels):
+            lims = ( bottoms[i], tops[i] )
             self.ch_text[i].set_text(str(round(self.graphpanes.ch_data[-1,i],decs))+" "+str(self.graphpanes.disp_units[i]))
             self.ch_text[i].set_position((self.graphpanes.plot_width*.1, 0))
-            self.ch_lines[i].set_data(self.graphpanes.time_data - self.graphpanes.curr_time, ( self.graphpanes.ch_data[:,i] + self.graphpanes.ch_offsets[0,i] )/(lims[1] - lims[0]))
-            self.ch_max[i] = self.ch_axes[i].text(-self.graphpanes.plot_width, 1.02, str(int(lims[1])),fontsize=8, ha = "left", va = "top")
-            self.ch_min[i] = self.ch_axes[i].text(-self.graphpanes.plot_width, lims[0], str(int(lims[0])),fontsize=8, ha = "left", va = "bottom")
+            self.ch_lines[i].set_data(self.graphpanes.plot_x[:,i], self.graphpanes.plot_y[:,i])
+            self.ch_max[i].set_text(str(int(lims[1])))
+            self.ch_max[i].set_position((-self.graphpanes.plot_width, 1.02))
+            self.ch_min[i].set_text(str(int(lims[0])))
+            self.ch_min[i].set_position((-self.graphpanes.plot_width, 0))
         self.plot_width = self.graphpanes.plot_width
-        return self.ch_lines + self.ch_text + self.ch_max + self.ch_min
+        self.status_text.set_text(self.graphpanes.status_text())
+        return self.ch_lines + self.ch_text + self.ch_max + self.ch_min + [self.status_text]
@@ -0,0 +1,115 @@
+'''
+ChannelSchema:
+
+Describes the data channels Quail sends, so the parsers, buffers and panes size themselves from it instead of assuming six
+channels. Each channel has:
+
+    name     : display title of the channel
+    unit     : unit Quail sends the channel in (see units.py)
+    dtype    : numpy dtype of the channel in a binary frame (e.g. '<f4', '<i2'); CSV values are always parsed as floats
+    position : index of the channel among the channel fields on the wire (0 is the field after time), so the dashboard can
+               show a subset of the wire channels, or show them in a different order
+
+A schema is loaded from a channel definition file (lib/Quail_Channel_Defs.csv: a header line, then one line of
+name,unit,dtype,position per channel, where dtype and position may be left blank), or taken from a header line announced on
+the serial port, e.g.
+
+    time (sec),Nitrous Supply Pressure [psi],Load Cell [lbf],TC1 [C],last_command,zerocheck
+
+where every field between time and last_command is a channel, with its unit in square brackets (unitless if none is given).
+'''
+
+import csv
+import re
+import time
+import numpy as np
+
+DEFAULT_FILE = 'lib/Quail_Channel_Defs.csv' # default channel definition file
+DEFAULT_DTYPE = '<f4' # wire dtype of channels that do not give one
+PROBE_TIMEOUT = 2.0 # maximum time (sec) probe waits for a header line
+HEADER_PATTERN = re.compile(r'\s*(.*?)\s*(?:\[(.*)\])?\s*$') # 'name [unit]' -> name, unit
+
+class ChannelSchema:
+    def __init__(self, names, units = None, dtypes = None, positions = None):
+        self.names = list(names) # display titles of the channels
+        n = len(self.names)
+        self.units = list(units) if units is not None else ['unitless']*n # units Quail sends each channel in
+        self.dtypes = [np.dtype(d or DEFAULT_DTYPE).str for d in dtypes] if dtypes is not None else [DEFAULT_DTYPE]*n # binary frame dtype of each channel
+        self.positions = np.arange(n) if positions is None else np.asarray(positions, dtype = np.int64) # wire position of each channel
+        if not (len(self.units) == len(self.dtypes) == len(self.positions) == n):
+            raise ValueError("channel schema needs one unit, dtype and position per channel")
+        if n == 0 or np.any(self.positions < 0) or len(np.unique(self.positions)) != n:
+            raise ValueError("channel schema needs at least one channel, at distinct non-negative wire positions")
+        self.wire_width = int(self.positions.max()) + 1 # number of channel fields on the wire
+        wire_dtypes = [DEFAULT_DTYPE]*self.wire_width # wire positions the schema does not use are assumed to be DEFAULT_DTYPE
+        for position, dtype in zip(self.positions, self.dtypes):
+            wire_dtypes[position] = dtype
+        self.wire_dtypes = wire_dtypes # dtype of each channel field on the wire, in wire order
+
+    def __len__(self):
+        return len(self.names)
+
+    def __eq__(self, other):
+        return isinstance(other, ChannelSchema) and (self.names, self.units, self.dtypes) == (other.names, other.units, other.dtypes) \
+            and np.array_equal(self.positions, other.positions)
+
+    def columns(self):
+        ''' Returns the column indices that pick time, the schema's channels (in schema order) and last_command out of a parsed
+            wire row (time, wire channels, last_command), or None if the wire row is already in that layout. '''
+        if self.wire_width == len(self) and np.array_equal(self.positions, np.arange(len(self))):
+            return None
+        return np.concatenate(([0], 1 + self.positions, [1 + self.wire_width]))
+
+    def header(self):
+        ''' Returns the header line (without line ending) that announces this schema. '''
+        fields = ['time (sec)'] + [name + ' [' + unit + ']' for name, unit in zip(self.names, self.units)] + ['last_command', 'zerocheck']
+        return ','.join(fields)
+
+    def save(self, filename = DEFAULT_FILE):
+        ''' Writes the schema as a channel definition file. '''
+        with open(filename, 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'unit', 'dtype', 'position'])
+            writer.writerows(zip(self.names, self.units, self.dtypes, self.positions.tolist()))
+
+def load(filename = DEFAULT_FILE):
+    ''' Returns the schema read from a channel definition file. '''
+    with open(filename, newline = '') as f:
+        rows = [row for row in csv.DictReader(f, skipinitialspace = True) if row.get('name')]
+    positions = [row.get('position') for row in rows]
+    return ChannelSchema([row['name'] for row in rows], [row.get('unit') or 'unitless' for row in rows], [row.get('dtype') for row in rows],
+                         None if not any(positions) else [int(p) if p else k for k, p in enumerate(positions)])
+
+def is_header(line):
+    ''' Returns True if a serial line (bytes or str) is a header line rather than data. '''
+    if isinstance(line, (bytes, bytearray)):
+        line = line.decode(errors = 'replace')
+    return line.strip().casefold().startswith('time')
+
+def from_header(line):
+    ''' Returns the schema announced by a header line (bytes or str). Every field after time, up to last_command, is a channel. '''
+    if isinstance(line, (bytes, bytearray)):
+        line = line.decode(errors = 'replace')
+    fields = line.strip().strip(',').split(',')[1:]
+    names, units = [], []
+    for field in fields:
+        if field.strip().casefold() in ('last_command', 'command', 'zerocheck'):
+            break
+        name, unit = HEADER_PATTERN.match(field).groups()
+        names.append(name)
+        units.append(unit.strip() if unit else 'unitless')
+    return ChannelSchema(names, units)
+
+def probe(serial_port, timeout = PROBE_TIMEOUT):
+    ''' Reads from an open serial port (or the emulator) for up to timeout seconds, waiting for Quail to announce its channels
+        in a header line. Returns the announced schema, or None if no header line arrived. The data read is discarded. '''
+    pending = bytearray()
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        pending += serial_port.read(max(1, serial_port.in_waiting))
+        lines = pending.split(b'\n')
+        for line in lines[:-1]:
+            if is_header(line):
+                return from_header(line)
+        pending = bytearray(lines[-1])
+    return None
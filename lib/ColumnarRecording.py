@@ -0,0 +1,176 @@
+'''
+ColumnarRecording:
+
+An optional recording format that stores Quail data as typed columns instead of CSV text, so a long test can be loaded for
+analysis by memory-mapping the file rather than parsing millions of lines. The file is laid out as (all little-endian):
+
+    header : b'QUAILCOL' | version (uint32) | JSON length (uint32) | JSON {"columns": [...], "dtypes": [...]} padded to 8 bytes
+    chunks : b'CHNK' | rows (uint32) | one contiguous array per column, each padded to 8 bytes
+    footer : index of (t_start, t_end, offset, rows) per chunk | JSON {"notes": [...]} padded with spaces to 8 bytes |
+             index offset (uint64) | number of chunks (uint64) | b'QUAILEND'
+
+The columns are time, one per data channel (named after the channel schema) and last_command. Time is assumed to increase through the file (a new serial
+connection that restarts Quail's clock should start a new recording). If a recording was cut short and has no footer, the
+reader rebuilds the index by walking the chunk headers. Notes (see RecordWriter.note) are kept in the footer, so a recording
+cut short loses them along with the index; files written before notes were added have no JSON in the footer.
+
+ColumnarRecordWriter plugs into quail's record thread in place of RecordWriter; it expects the record queue to carry
+(n, time + channels + last_command) arrays. ColumnarRecording is the reader.
+'''
+
+import json
+import struct
+import numpy as np
+
+from lib.RecordWriter import RecordWriter, WRITE_BUFFER_SIZE
+
+MAGIC = b'QUAILCOL'
+END_MAGIC = b'QUAILEND'
+CHUNK_MAGIC = b'CHNK'
+VERSION = 1
+CHUNK_ROWS = 1 << 16 # number of rows buffered before a chunk is written (a flush writes a smaller chunk)
+# Every flush (RecordWriter's flush_interval, 1 s by default) writes the pending rows as a chunk even if it is short of CHUNK_ROWS,
+# so a crash loses at most flush_interval of data. The cost is that below CHUNK_ROWS/flush_interval samples per second (65 kHz)
+# chunks hold only about rate*flush_interval rows: the file has more chunk headers and index entries (40 bytes per chunk), and
+# windows span more chunks, so fewer of them come back as views. Raise flush_interval for fewer, larger chunks.
+INDEX_DTYPE = np.dtype([('t_start', '<f8'), ('t_end', '<f8'), ('offset', '<u8'), ('rows', '<u8')])
+TRAILER = struct.Struct('<QQ8s') # index offset, number of chunks, END_MAGIC
+
+def _padding(num_bytes):
+    ''' Returns the number of bytes needed to pad num_bytes up to a multiple of 8. '''
+    return -num_bytes % 8
+
+def column_names(channels):
+    ''' Returns the column names of a recording of the given channel names (see ChannelSchema.names), or of that many channels
+        named CH1, CH2, ... if given a number. A name that is already taken gets a ' (2)', ' (3)', ... suffix, since the reader
+        returns columns by name. '''
+    if isinstance(channels, int):
+        channels = ['CH' + str(i + 1) for i in range(channels)]
+    names = []
+    for name in ['time'] + list(channels) + ['last_command']:
+        unique, k = name, 1
+        while unique in names:
+            k += 1
+            unique = name + ' (' + str(k) + ')'
+        names.append(unique)
+    return names
+
+class ColumnarRecordWriter(RecordWriter):
+    def __init__(self, filename, record_queue, recording, columns, flush_interval = 1.0, fsync_interval = None, dropped = None):
+        super().__init__(filename, record_queue, recording, flush_interval = flush_interval, fsync_interval = fsync_interval, dropped = dropped)
+        self.columns = columns # column names, in the order of the columns of each queued array
+        self.dtypes = ['<f8']*(len(columns) - 1) + ['<i4'] # last_command is stored as an integer
+        self.pending = [] # arrays received since the last chunk was written
+        self.pending_rows = 0
+        self.index = [] # (t_start, t_end, offset, rows) of each chunk written so far
+        self.notes = [] # notes written into the footer
+
+    def open(self):
+        f = open(self.filename, "wb", buffering = WRITE_BUFFER_SIZE)
+        header = json.dumps({'columns': self.columns, 'dtypes': self.dtypes}).encode()
+        f.write(MAGIC + struct.pack('<II', VERSION, len(header)) + header + b'\0'*_padding(len(header)))
+        return f
+
+    def _write(self, f, batch):
+        self.pending += batch
+        self.pending_rows += sum(len(block) for block in batch)
+        if self.pending_rows >= CHUNK_ROWS:
+            return self._write_chunk(f)
+        return 0
+
+    def _flush(self, f):
+        num_bytes = self._write_chunk(f)
+        f.flush()
+        return num_bytes
+
+    def _note(self, f, text):
+        self.notes.append(text)
+        return 0
+
+    def _close(self, f):
+        num_bytes = self._flush(f)
+        index = np.array(self.index, dtype = INDEX_DTYPE)
+        footer = json.dumps({'notes': self.notes}).encode()
+        footer += b' '*_padding(len(footer))
+        f.write(index.tobytes() + footer + TRAILER.pack(f.tell(), len(index), END_MAGIC))
+        return num_bytes + index.nbytes + len(footer) + TRAILER.size
+
+    def _write_chunk(self, f):
+        ''' Writes the pending rows as one chunk and returns the number of bytes written. '''
+        if self.pending_rows == 0:
+            return 0
+        rows = np.concatenate(self.pending, axis = 0)
+        self.pending, self.pending_rows = [], 0
+        offset = f.tell()
+        parts = [CHUNK_MAGIC + struct.pack('<I', len(rows))]
+        for j, dtype in enumerate(self.dtypes):
+            column = np.ascontiguousarray(rows[:, j], dtype = dtype).tobytes()
+            parts += [column, b'\0'*_padding(len(column))]
+        data = b''.join(parts)
+        f.write(data)
+        self.index.append((rows[0, 0], rows[-1, 0], offset, len(rows)))
+        return len(data)
+
+class ColumnarRecording:
+    ''' Read-only, memory-mapped view of a columnar recording. '''
+    def __init__(self, filename):
+        self.mmap = np.memmap(filename, dtype = np.uint8, mode = 'r')
+        if bytes(self.mmap[:8]) != MAGIC:
+            raise ValueError(filename + " is not a columnar Quail recording")
+        version, header_len = struct.unpack('<II', bytes(self.mmap[8:16]))
+        header = json.loads(bytes(self.mmap[16:16 + header_len]))
+        self.columns = header['columns'] # column names
+        self.dtypes = [np.dtype(d) for d in header['dtypes']] # column dtypes
+        self.data_start = 16 + header_len + _padding(header_len) # offset of the first chunk
+        if len(self.mmap) >= self.data_start + TRAILER.size and bytes(self.mmap[-8:]) == END_MAGIC:
+            index_offset, num_chunks, _ = TRAILER.unpack(bytes(self.mmap[-TRAILER.size:]))
+            self.index = np.frombuffer(self.mmap, dtype = INDEX_DTYPE, count = num_chunks, offset = index_offset)
+            footer = bytes(self.mmap[index_offset + self.index.nbytes:-TRAILER.size]).strip()
+            self.notes = json.loads(footer)['notes'] if footer else [] # notes written when the recording was closed
+        else:
+            self.index = self._scan() # no footer, the recording was not closed cleanly
+            self.notes = []
+
+    def _scan(self):
+        ''' Rebuilds the chunk index by walking the chunk headers from the start of the data. '''
+        index = []
+        offset = self.data_start
+        while offset + 8 <= len(self.mmap) and bytes(self.mmap[offset:offset + 4]) == CHUNK_MAGIC:
+            rows = struct.unpack('<I', bytes(self.mmap[offset + 4:offset + 8]))[0]
+            size = 8 + sum(rows*d.itemsize + _padding(rows*d.itemsize) for d in self.dtypes)
+            if offset + size > len(self.mmap):
+                break # the last chunk was only partly written
+            time = np.frombuffer(self.mmap, dtype = self.dtypes[0], count = rows, offset = offset + 8)
+            index.append((time[0], time[-1], offset, rows))
+            offset += size
+        return np.array(index, dtype = INDEX_DTYPE)
+
+    def __len__(self):
+        return int(self.index['rows'].sum())
+
+    def chunk(self, k):
+        ''' Returns a dict of column name -> numpy view of chunk k. '''
+        offset = int(self.index['offset'][k]) + 8
+        rows = int(self.index['rows'][k])
+        views = {}
+        for name, dtype in zip(self.columns, self.dtypes):
+            views[name] = np.frombuffer(self.mmap, dtype = dtype, count = rows, offset = offset)
+            offset += rows*dtype.itemsize + _padding(rows*dtype.itemsize)
+        return views
+
+    def window(self, t0 = -np.inf, t1 = np.inf):
+        ''' Returns a dict of column name -> array of the rows with t0 <= time <= t1. Windows that fall within one chunk are
+            returned as views into the mapped file; windows spanning several chunks are concatenated. '''
+        first = np.searchsorted(self.index['t_end'], t0, side = 'left') # first chunk that ends at or after t0
+        last = np.searchsorted(self.index['t_start'], t1, side = 'right') # one past the last chunk that starts at or before t1
+        pieces = []
+        for k in range(first, last):
+            views = self.chunk(k)
+            lo = np.searchsorted(views['time'], t0, side = 'left')
+            hi = np.searchsorted(views['time'], t1, side = 'right')
+            pieces.append({name: view[lo:hi] for name, view in views.items()})
+        if len(pieces) == 1:
+            return pieces[0]
+        if not pieces:
+            return {name: np.empty(0, dtype = dtype) for name, dtype in zip(self.columns, self.dtypes)}
+        return {name: np.concatenate([piece[name] for piece in pieces]) for name in self.columns}
@@ -0,0 +1,121 @@
+'''
+ConnectionManager:
+
+Opens Quail's serial port for the data process and keeps it open. A failed open is retried with exponential backoff (starting
+at BACKOFF_INITIAL and doubling up to BACKOFF_MAX seconds between attempts) instead of in a tight loop, and the caller is never
+blocked waiting for the next attempt: connect() returns None until the attempt is due, so the data process keeps checking for a
+new COM Port or for shutdown in between.
+
+The COM_Port setting may be AUTO_PORT ('auto'), in which case the port is found with serial.tools.list_ports on every attempt:
+the first USB serial port whose (VID, PID) is in usb_ids (any USB serial port if usb_ids is empty). Together with lost(), which
+the data process calls when reading from an open port fails (e.g. the cable was pulled), this gives hot-plug reconnect: the board
+is picked up again on whatever device it comes back as, without restarting the data process.
+
+The connection state, the port in use and the number of failed attempts are shared values, readable from the GUI process
+(see status_text).
+'''
+
+import multiprocessing as mp
+import time
+import serial
+import serial.tools.list_ports
+
+from lib.QuailEmulator import QuailEmulator
+
+AUTO_PORT = 'auto' # COM_Port setting that discovers the port by USB VID/PID
+QUAIL_USB_IDS = [] # (VID, PID) pairs of Quail's USB serial adapter, used by AUTO_PORT discovery (empty accepts any USB serial port)
+BACKOFF_INITIAL = 0.1 # time (sec) before the first retry of a failed connection
+BACKOFF_MAX = 5.0 # maximum time (sec) between connection attempts
+BACKOFF_FACTOR = 2.0 # growth of the time between attempts after each failure
+PORT_NAME_LENGTH = 256 # maximum length of the shared port name
+STATES = ['disconnected', 'connecting', 'connected'] # values of the shared connection state, by index
+
+def port_name(COM_Port):
+    ''' Returns the serial device name for a COM_Port setting: an integer n means 'COMn', while a string (e.g. '/dev/ttyACM0' or
+        the '/dev/pts/N' of the pty emulator in PtyEmulator.py) is used as-is. '''
+    if isinstance(COM_Port, str):
+        return COM_Port
+    return 'COM{}'.format(COM_Port)
+
+def is_emulator_port(COM_Port):
+    ''' Returns True if COM_Port requests the in-process Quail Emulator (an un-realistic, negative COM Port number). '''
+    return not isinstance(COM_Port, str) and COM_Port < 0
+
+def discover(usb_ids = QUAIL_USB_IDS):
+    ''' Returns the device name of the first USB serial port matching one of usb_ids ((VID, PID) pairs, any USB port if empty),
+        or None if there is none. '''
+    for port in sorted(serial.tools.list_ports.comports(), key = lambda port: port.device):
+        if port.vid is None:
+            continue # not a USB device (e.g. a built-in /dev/ttyS* port)
+        if not usb_ids or (port.vid, port.pid) in usb_ids:
+            return port.device
+    return None
+
+class ConnectionManager:
+    def __init__(self, timeout, protocol = 'csv', emulator_options = None, usb_ids = QUAIL_USB_IDS):
+        self.timeout = timeout # read timeout of the opened port (sec)
+        self.protocol = protocol # serial format sent by Quail, passed to the QuailEmulator
+        self.emulator_options = emulator_options or {} # extra keyword arguments for the QuailEmulator
+        self.usb_ids = list(usb_ids) # (VID, PID) pairs accepted by AUTO_PORT discovery
+        self.state = mp.Value('i', 0) # index into STATES
+        self.retries = mp.Value('l', 0) # failed attempts since the last successful connection
+        self.connections = mp.Value('l', 0) # number of successful connections (more than one means the port was reconnected)
+        self.port = mp.Array('c', PORT_NAME_LENGTH) # device name of the port in use, or of the last one tried
+        self.delay = BACKOFF_INITIAL # time (sec) to wait after the next failed attempt
+        self.next_attempt = 0.0 # perf_counter time at which the next attempt is due
+
+    def connect(self, COM_Port):
+        ''' Attempts to open COM_Port if an attempt is due. Returns the open serial port (or QuailEmulator), or None if the
+            attempt failed or is not due yet (see wait_time). '''
+        now = time.perf_counter()
+        if now < self.next_attempt:
+            return None
+        self.state.value = STATES.index('connecting')
+        if is_emulator_port(COM_Port): # an un-realistic COM_Port request connects you to the Quail Emulator
+            name = port_name(COM_Port)
+            port = QuailEmulator(name, timeout = self.timeout, protocol = self.protocol, **self.emulator_options)
+        else:
+            name = discover(self.usb_ids) if COM_Port == AUTO_PORT else port_name(COM_Port)
+            try:
+                port = serial.Serial(name, timeout = self.timeout) if name is not None else None
+            except (serial.SerialException, OSError, ValueError):
+                port = None
+        self.port.value = (name or AUTO_PORT).encode()[:PORT_NAME_LENGTH - 1]
+        if port is None:
+            self.retries.value += 1
+            self.next_attempt = now + self.delay
+            self.delay = min(self.delay*BACKOFF_FACTOR, BACKOFF_MAX)
+            self.state.value = STATES.index('disconnected')
+            return None
+        self.reset()
+        self.connections.value += 1
+        self.state.value = STATES.index('connected')
+        return port
+
+    def wait_time(self):
+        ''' Returns the time (sec) until the next connection attempt is due. '''
+        return max(0.0, self.next_attempt - time.perf_counter())
+
+    def reset(self):
+        ''' Makes the next attempt due immediately, with the backoff started over (e.g. for a new COM Port setting). '''
+        self.retries.value = 0
+        self.delay = BACKOFF_INITIAL
+        self.next_attempt = 0.0
+
+    def lost(self, port):
+        ''' Closes a port that has failed (e.g. was unplugged), so the next connect() starts reconnecting right away. '''
+        try:
+            port.close()
+        except (serial.SerialException, OSError):
+            pass
+        self.reset()
+        self.state.value = STATES.index('disconnected')
+
+    def status_text(self):
+        ''' Returns a short description of the connection, e.g. 'connected to /dev/ttyACM0' or 'reconnecting to COM11 (3 retries)'. '''
+        state = STATES[self.state.value]
+        name = self.port.value.decode(errors = 'replace')
+        if state == 'connected':
+            return "connected to " + name
+        verb = "reconnecting to " if self.connections.value > 0 else "connecting to "
+        return verb + name + " ({} retries)".format(self.retries.value)
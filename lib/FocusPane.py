@@ -9,7 +9,6 @@ import tkinter as tk
 import tkinter.ttk as ttk
 import numpy as np
 import matplotlib.figure as figure
-import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
@@ -38,9 +37,9 @@ class FocusPane(ttk.Frame):
         self.focus1 = tk.StringVar(self)
         self.focus1.set(graphpanes.ch_names[0])
         self.focus2 = tk.StringVar(self)
-        self.focus2.set(graphpanes.ch_names[1])
+        self.focus2.set(graphpanes.ch_names[min(1, self.num_data_channels - 1)])
         self.focus1_drop = ttk.OptionMenu(self,self.focus1, graphpanes.ch_names[0], *tuple(self.graphpanes.ch_names))
-        self.focus2_drop = ttk.OptionMenu(self,self.focus2, graphpanes.ch_names[1], *tuple(self.graphpanes.ch_names))
+        self.focus2_drop = ttk.OptionMenu(self,self.focus2, self.focus2.get(), *tuple(self.graphpanes.ch_names))
         self.focus1_label = ttk.Label(self,text = "Upper Figure Channel: ",justify=tk.RIGHT)
         self.focus2_label = ttk.Label(self,text = "  Lower Figure Channel: ",justify=tk.RIGHT)
         self.focus1_label.grid(row = 0, column = 0, rowspan = 1, columnspan = 1, sticky= 'nsew')
@@ -69,36 +68,34 @@ class FocusPane(ttk.Frame):
         self.plot_canvas.grid(row = 1, column = 0, rowspan = 10, columnspan = 4, sticky = 'nsew')
         self.rowconfigure(10, weight = 1)
 
-        self.ani = animation.FuncAnimation(  self.fig, self.animate, interval=self.graphpanes.update_interval, blit=True)
+        self.graphpanes.register(self.canvas, self.animate) # drawn on every frame of the GraphPanes' clock
 
-    def kill(self):
-        self.ani.event_source.stop()
-
-    def animate(self, ind):
-        self.graphpanes.update_data() # get most recent Quail data
+    def animate(self):
+        ''' Updates the plots from the arrays GraphPanes computed for this frame, and returns the artists to redraw. '''
         focus = [0, 0]
         focus[0] = self.graphpanes.ch_names.index(self.focus1.get())
         focus[1] = self.graphpanes.ch_names.index(self.focus2.get())
 
         # Update plots
-        for i in range(2):
-            data_to_consider = self.graphpanes.ch_data[-(int)(self.graphpanes.consider_range*self.graphpanes.elements_on_screen):,focus[i]]
-            lims = ( 0, max(data_to_consider) + 1E-10 )
-            self.ch_max[i].remove() # remove old labels
-            self.ch_min[i].remove()
-            self.ch_titles[i].remove()
-            if self.graphpanes.plot_width != self.plot_width: #if user has adjusted the plot width
+        bottoms, tops = self.graphpanes.y_limits() # y-limits of every channel, shared with the ChannelPane
+        if self.graphpanes.plot_width != self.plot_width: #if user has adjusted the plot width (or the channel names/units)
+            for i in range(2):
                 self.ch_axes[i].set_xlim((-self.graphpanes.plot_width, self.graphpanes.plot_width*0.1))
                 self.ch_axes[i].set_xticks([-self.graphpanes.plot_width, 0])
                 self.ch_axes[i].set_ylabel(str(self.graphpanes.disp_units[i]))
-                self.canvas.draw()
-            self.ch_titles[i] = self.ch_axes[i].text(-self.graphpanes.plot_width/2,1.0,str(self.graphpanes.ch_names[focus[i]]),fontsize=14, ha = "center", va = "top")
+            self.graphpanes.redraw(self.canvas) # one full redraw, once the returned artists are excluded from it
+        for i in range(2):
+            lims = ( bottoms[focus[i]], tops[focus[i]] )
+            self.ch_titles[i].set_text(str(self.graphpanes.ch_names[focus[i]]))
+            self.ch_titles[i].set_position((-self.graphpanes.plot_width/2, 1.0))
             self.ch_text[i].set_text(str(round(self.graphpanes.ch_data[-1,i],decs))+" "+str(self.graphpanes.disp_units[focus[i]]))
             self.ch_text[i].set_color(self.graphpanes.ch_colors[focus[i]])
             self.ch_text[i].set_position((self.graphpanes.plot_width*.1, 0))
-            self.ch_lines[i].set_data(self.graphpanes.time_data - self.graphpanes.curr_time, (self.graphpanes.ch_data[:,focus[i]] + self.graphpanes.ch_offsets[0,focus[i]] )/(lims[1] - lims[0]))
+            self.ch_lines[i].set_data(self.graphpanes.plot_x[:,focus[i]], self.graphpanes.plot_y[:,focus[i]])
             self.ch_lines[i].set_color(self.graphpanes.ch_colors[focus[i]])
-            self.ch_max[i] = self.ch_axes[i].text(-self.graphpanes.plot_width, 1.02, str(int(lims[1])),fontsize=8, ha = "left", va = "top")
-            self.ch_min[i] = self.ch_axes[i].text(-self.graphpanes.plot_width, lims[0], str(int(lims[0])),fontsize=8, ha = "left", va = "bottom")
+            self.ch_max[i].set_text(str(int(lims[1])))
+            self.ch_max[i].set_position((-self.graphpanes.plot_width, 1.02))
+            self.ch_min[i].set_text(str(int(lims[0])))
+            self.ch_min[i].set_position((-self.graphpanes.plot_width, 0))
         self.plot_width = self.graphpanes.plot_width
         return self.ch_lines + self.ch_text + self.ch_max + self.ch_min + self.ch_titles
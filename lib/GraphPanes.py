@@ -2,117 +2,216 @@ import tkinter as tk
 import tkinter.ttk as ttk
 import tkinter.simpledialog as dialog
 import time
-import matplotlib.animation as animation
 import matplotlib.style as plotstyle
 import numpy as np
 import lib.units as units
+import lib.decimate as decimate
 
 from lib.FocusPane import FocusPane
 from lib.ChannelPane import ChannelPane
+from lib.SampleBuffer import SampleBuffer
+from lib.LatencyTrace import LatencyTracer
 
 INITIAL_DATA_WIDTH = 10.0 # the initial number of seconds displayed on the plots
 MAX_DATA_WIDTH = 30.0 # the maximum number of seconds that can be displayed on the plots
 MIN_DATA_WIDTH = 1.0  # the minimum number of seconds that can be displayed on the plots
+MAX_DATA_POINTS = 300000 # the maximum number of samples kept locally (MAX_DATA_WIDTH seconds at 10 kHz)
 
-initial_ch_names = ["Nitrous Supply Pressure", "CC Manifold Pressure", "Fuel Tank Pressure","Ox Tank Pressure","Ox Manifold Pressure","Load Cell"]
-initial_ch_units = ["psi","psi","psi","psi","psi","lbf"]
+CH_COLORS = ["#a83232", "#faa352", "#9630c2","#c230a0","#a561ff","#3124b5"] # colors used on the plots, repeated if there are more channels
 
 
-## TODO: Add more colors for plotting/mod op
-##       Scale based only on data that is in-frame (track last index removed from data)
-##       
 class GraphPanes:
     ''' GraphPanes is an owner class for the FocusPane and ChannelPane objects, which plot Quail data live. To allow for data to not be
         duplicated between these two plotting classes, the GraphPanes object owns the Quail data that is stored locally. '''
     def __init__(self, mainframe, quail):
-        self.mainframe = mainframe # the primary frame of the MainWindow
+        self.mainframe = mainframe # the primary frame of the MainWindow, or None to keep the data without drawing any panes
         self.quail = quail  # the quail object associated with the MainWindow
 
         self.plot_width = INITIAL_DATA_WIDTH # the width of the graphs, in secs
         self.ch_offsets = np.zeros((1, quail.num_data_channels)) # channel offsets (used for taring or biasing data in the y-direction), same unit as the data
-        self.time_data = np.zeros((1, 1)) # the time data, in seconds
-        self.ch_data = np.zeros((1, quail.num_data_channels)) # the channel data, with units determined by ch_units
-        self.last_command = tk.IntVar() # the Tk var that stores the most recent command that Quail saw
+        self.buffer = SampleBuffer(MAX_DATA_POINTS, quail.num_data_channels) # preallocated history of the time data (in seconds) and channel data (units determined by ch_units)
+        self.buffer.append(np.zeros(1), np.zeros((1, quail.num_data_channels))) # start with a single zero sample so the panes always have a point to draw
+        self.last_command = tk.IntVar(tk.Tcl() if mainframe is None else None) # the Tk var that stores the most recent command that Quail saw (held by a bare Tcl interpreter when there is no window)
         self.last_command.set(0) # by default, this is set to zero
+        self.tracer = None if quail.trace_queue is None else LatencyTracer(quail.trace_queue) # stamps each block on its way to the screen, if quail is tracing
 
         self.reference_time = 0 # perf_counter time when last data point was used
         self.curr_time = 0 # time of most recent data point + elapsed time since then
 
-        self.ch_names = initial_ch_names # display titles of plots
-        if len(self.ch_names) < self.quail.num_data_channels:
-            self.ch_names += ['']*(self.quail.num_data_channels - len(self.ch_names))
-        self.ch_units = initial_ch_units # units of the data stored in ch_data, set by what Quail sends over serial
-        if len(self.ch_units) < self.quail.num_data_channels:
-            self.ch_units += ['unitless']*(self.quail.num_data_channels - len(self.ch_units))
+        self.ch_names = list(quail.schema.names) # display titles of plots, from the channel schema
+        self.ch_units = list(quail.schema.units) # units of the data stored in ch_data, set by what Quail sends over serial
         self.disp_units = self.ch_units.copy() # units displayed on the plots - must be convertible to the corresponding unit in ch_units
-        self.ch_colors = ["#a83232", "#faa352", "#9630c2","#c230a0","#a561ff","#3124b5"] # colors used on the plots
-        if len(self.ch_colors) < self.quail.num_data_channels:
-            self.ch_colors += self.ch_colors[0:(self.quail.num_data_channels - len(self.ch_names))]
+        self.update_conversions()
+        self.ch_colors = [CH_COLORS[i % len(CH_COLORS)] for i in range(self.quail.num_data_channels)] # colors used on the plots
         self.update_interval = 50 # time (ms) between polling/animation updates
         
-        self.consider_range = 1.0 # the percentage of data elements on screen to be considered for y-axis scaling
-        self.elements_on_screen = 1 # the number of elements displayed onscreen at the moment
+        self.consider_range = 1.0 # the fraction of the plot width (newest first) considered for y-axis scaling
+        self.include_zero = True # if True, the y-axis of every plot includes zero; otherwise it spans the data's min to max
+        self.limits = None # (bottoms, tops) y-limits of every channel, computed at most once per update_data, see y_limits
+        self.panes = [] # (canvas, animate) of every pane drawn on each frame, see register
+        self.backgrounds = {} # canvas -> its figure without the animated artists, restored before they are redrawn
+        self.after_id = None # Tk timer of the next frame
+        self.plot_x = np.zeros((1, quail.num_data_channels)) # time (relative to curr_time) of the points drawn for every channel, see frame
+        self.plot_y = np.zeros((1, quail.num_data_channels)) # height (0 to 1 between the y-limits) of the points drawn for every channel
 
         plotstyle.use('dark_background') # set all plots to dark mode
 
+        if mainframe is None: # headless (e.g. benchmarks/throughput.py): no panes are drawn, and update_data is called directly
+            self.focuspane = None
+            self.channelpane = None
+            return
         self.focuspane = FocusPane(self, mainframe) # the FocusPane that shows zoomed-in graphs
         self.channelpane = ChannelPane(self, mainframe) # the ChannelPane that shows all channels
+        self.after_id = mainframe.after(self.update_interval, self.tick) # one frame clock for every pane
+
+    @property
+    def time_data(self):
+        ''' (n, 1) view of the local time data, in seconds. '''
+        return self.buffer.time
+
+    @property
+    def ch_data(self):
+        ''' (n, num_data_channels) view of the local channel data, with units determined by disp_units. '''
+        return self.buffer.data
 
     def update_data(self):
         ''' Updates the local data for plotting by dequeuing from Quail, clearing data beyond the scope of the local range,
             and calculating the time since the last Quail data packet. '''
-        # Get any new data waiting in Quail's data queue
-        i = 0
+        # Get any new blocks of data waiting in Quail's data queue
+        new_blocks = []
         while not(self.quail.data_queue.empty()) :
-            new_data = self.quail.data_queue.get()
-            try:
-                new_data[0] # the data must be an iterable to be valid
-            except:
-                self.reset_plots() # if item recieved is not an iterable, clear the plots (a hacky way to clear the plots)
+            new_block = self.quail.data_queue.get()
+            if not isinstance(new_block, np.ndarray):
+                self.reset_plots() # if item recieved is not a block of data, clear the plots (a hacky way to clear the plots)
+                new_blocks = [] # anything dequeued before the reset belongs to the old connection
                 continue
-            self.time_data = np.append(self.time_data, np.asarray([[new_data[0]]]), axis = 0) 
-            if i == 0:
-                raw_data = np.asarray([new_data[1:-1]])
-            else:
-                raw_data = np.append(raw_data, np.asarray([new_data[1:-1]]), axis = 0)
-            self.last_command.set(new_data[-1])
-            self.reference_time = time.perf_counter() # update reference time
-            i += 1
+            if self.tracer is not None:
+                self.tracer.block_dequeued(new_block[-1, 0])
+            new_blocks.append(new_block)
         # Convert raw data from channel unit to display unit
-        if i > 0:
-            converted_data = np.zeros_like(raw_data)
-            for j in range(self.quail.num_data_channels):
-                converted_data[:, j] = units.convert(raw_data[:, j], self.ch_units[j], self.disp_units[j])
-            self.ch_data = np.append(self.ch_data, converted_data, axis = 0)
-
-            # Update the number of elements on screen
-            self.elements_on_screen += i
-            while ( self.curr_time - self.time_data[-self.elements_on_screen,:] ) > self.plot_width and self.elements_on_screen > 1:
-                self.elements_on_screen -= 1
+        if new_blocks:
+            new_rows = np.concatenate(new_blocks, axis = 0)
+            new_rows = new_rows[np.searchsorted(new_rows[:, 0], new_rows[-1, 0] - MAX_DATA_WIDTH):] # after a stall, only the newest MAX_DATA_WIDTH can be shown
+            raw_data = new_rows[:, 1:-1]
+            self.last_command.set(int(new_rows[-1, -1]))
+            self.reference_time = time.perf_counter() # update reference time
+            if self.unit_scales is not None: # one broadcast multiply-add converts every channel
+                raw_data = raw_data*self.unit_scales + self.unit_offsets
+            self.buffer.append(new_rows[:, 0], raw_data)
+            if self.tracer is not None:
+                self.tracer.blocks_converted()
 
         # Clear any data that goes beyond the maximum width that can be displayed onscreen
-        while self.time_data[-1,0] -  self.time_data[0,0] > MAX_DATA_WIDTH and np.size(self.time_data) > 1:
-            self.time_data = self.time_data[1:, :]
-            self.ch_data = self.ch_data[1:, :]
-        self.elements_on_screen = min(self.elements_on_screen, np.size(self.time_data) )
+        self.buffer.discard_before(self.time_data[-1,0] - MAX_DATA_WIDTH)
         # Update curr_time to be time of most recent data point + elapsed time since then
-        self.curr_time = self.time_data[-1,:] + time.perf_counter() - self.reference_time
+        self.curr_time = self.time_data[-1,0] + time.perf_counter() - self.reference_time
+        self.limits = None # recomputed when a pane next asks for them
+
+    def register(self, canvas, animate):
+        ''' Adds a pane to be drawn on every frame. animate() updates the pane's artists from the frame's shared arrays (plot_x,
+            plot_y, y_limits) and returns them; they are then blitted onto canvas, as a blitting FuncAnimation would. '''
+        self.panes.append((canvas, animate))
+        self.backgrounds[canvas] = None
+        canvas.mpl_connect('draw_event', lambda event: self.capture_background(canvas)) # full redraws (resizing, new axis labels)
+
+    def redraw(self, canvas):
+        ''' Asks for a full redraw of a registered pane's canvas (e.g. after its axes changed), done by frame once the artists
+            its animate returned are marked animated, so they are not baked into the captured background. '''
+        self.backgrounds[canvas] = None
+
+    def capture_background(self, canvas):
+        self.backgrounds[canvas] = canvas.copy_from_bbox(canvas.figure.bbox)
+
+    def tick(self):
+        ''' Draws a frame and schedules the next one, every update_interval ms. '''
+        self.frame()
+        self.after_id = self.mainframe.after(self.update_interval, self.tick)
+
+    def frame(self):
+        ''' Pulls new data from Quail once, computes what the panes draw once for every channel (the visible rows decimated to the
+            widest axes, offset and scaled to the y-limits), then animates and blits every registered pane. '''
+        self.update_data()
+        if not self.panes:
+            return
+        bottoms, tops = self.y_limits()
+        widest = max((axes for canvas, _ in self.panes for axes in canvas.figure.axes), key = lambda axes: axes.bbox.width)
+        plot_rows = self.plot_rows(self.visible(), slice(None), widest) # narrower axes get a few more points than pixels
+        self.plot_x = self.time_data[plot_rows, 0] - self.curr_time
+        self.plot_y = (self.ch_data[plot_rows, np.arange(plot_rows.shape[1])] + self.ch_offsets - bottoms)/(tops - bottoms)
+        for canvas, animate in self.panes:
+            artists = animate()
+            for artist in artists:
+                artist.set_animated(True) # left out of full redraws, so the background never holds a stale one
+            if self.backgrounds[canvas] is None:
+                canvas.draw() # first frame or redraw requested, captures the background
+            canvas.restore_region(self.backgrounds[canvas])
+            for artist in artists:
+                canvas.figure.draw_artist(artist)
+            canvas.blit(canvas.figure.bbox)
+        if self.tracer is not None:
+            self.tracer.blocks_drawn()
+
+    def visible(self, fraction = 1.0):
+        ''' Returns the slice of the local data on screen: the rows within the newest fraction of the plot width (e.g. consider_range,
+            for y-axis scaling), plus the row just before them so the plotted lines reach the left edge. '''
+        first, _ = self.buffer.index_range(self.curr_time - fraction*self.plot_width)
+        return slice(max(first - 1, 0), len(self.buffer))
+
+    def plot_rows(self, rows, columns, axes):
+        ''' Returns the indices into the local data of the rows to draw of the given channel columns (a slice or list) on axes,
+            shaped (m, number of columns): the visible rows M4-decimated to the axes' pixel width, see decimate.m4. '''
+        xlim = axes.get_xlim()
+        seconds_per_pixel = (xlim[1] - xlim[0])/max(axes.bbox.width, 1)
+        return rows.start + decimate.m4(self.time_data[rows, 0], self.ch_data[rows, columns], seconds_per_pixel)
+
+    def y_limits(self):
+        ''' Returns the (bottoms, tops) y-limits of every channel, offsets included: the min and max over the newest consider_range
+            of the plot width (widened to include zero if include_zero is set). Uses the buffer's min/max summaries, and is
+            computed once per update_data for both panes. '''
+        if self.limits is None:
+            rows = self.visible(self.consider_range)
+            bottoms, tops = self.buffer.extrema(rows.start, rows.stop)
+            bottoms, tops = bottoms + self.ch_offsets[0], tops + self.ch_offsets[0]
+            if self.include_zero:
+                bottoms, tops = np.minimum(bottoms, 0), np.maximum(tops, 0)
+            self.limits = (bottoms, np.maximum(tops, bottoms + 1E-10))
+        return self.limits
+
+    def update_conversions(self):
+        ''' Compiles the conversion of every channel from its channel unit to its display unit into per-channel scales and offsets
+            (see units.compile_conversions), which update_data applies to each batch. Must be called whenever ch_units or
+            disp_units change. '''
+        self.unit_scales, self.unit_offsets = units.compile_conversions(self.ch_units, self.disp_units)
+        if np.all(self.unit_scales == 1) and np.all(self.unit_offsets == 0):
+            self.unit_scales = self.unit_offsets = None # every channel is displayed in its own unit, nothing to convert
+
+    def status_text(self):
+        ''' Returns the one-line status shown over the channel plots: the serial connection, the traced latency, if tracing, and
+            the number of samples the data process has coalesced because the display fell behind, if any. '''
+        status = [self.quail.connection_status()]
+        if self.tracer is not None:
+            status.append(self.tracer.overlay_text())
+        coalesced = self.quail.display_coalesced.value
+        if coalesced > 0:
+            status.append("coalesced {} samples ({})".format(coalesced, self.quail.display_policy))
+        return " | ".join(status)
 
     def kill(self):
-        ''' Function that ends the animation loop for each plotting pane, to prevent an attempt to refresh a non-existent plot. '''
-        self.focuspane.kill()
-        self.channelpane.kill()
+        ''' Function that ends the frame clock, to prevent an attempt to refresh a non-existent plot.
+            If latency is being traced, prints the trace summary and dumps it to LatencyTrace.DUMP_FILE. '''
+        if self.after_id is not None:
+            self.mainframe.after_cancel(self.after_id)
+            self.after_id = None
+        if self.tracer is not None:
+            print(self.tracer.report())
+            self.tracer.dump()
 
     def set_plot_width(self):
         ''' Opens dialog to set the width of the plot, in seconds. The value is constrained between a max and min value
             defined at the top of the screen. '''
         time_on_screen = dialog.askfloat("Change Plot Width", "Enter new time-width of plot in seconds:")
         if time_on_screen != None : 
-            self.plot_width = max( min( time_on_screen, MAX_DATA_WIDTH), MIN_DATA_WIDTH )
-        
-        self.elements_on_screen = 1
-        while ( self.curr_time - self.time_data[-self.elements_on_screen-1,:] ) < self.plot_width and self.elements_on_screen > 1 and self.elements_on_screen < np.size(self.time_data):
-                self.elements_on_screen += 1
+            self.plot_width = max( min( time_on_screen, MAX_DATA_WIDTH), MIN_DATA_WIDTH ) # the panes find the rows on screen with visible()
 
     def scale_recent(self):
         ''' Adjusts what percentage of the local data available contributes to the y-axis scaling, to 25%. '''
@@ -122,21 +221,34 @@ class GraphPanes:
         ''' Adjusts what percentage of the local data available contributes to the y-axis scaling, to 100%. '''
         self.consider_range = 1.0
 
+    def scale_from_zero(self):
+        ''' Scales the y-axis of every plot from zero (or from the data's minimum, if negative) to the data's maximum. '''
+        self.include_zero = True
+        self.limits = None
+
+    def scale_min_max(self):
+        ''' Scales the y-axis of every plot from the data's minimum to its maximum. '''
+        self.include_zero = False
+        self.limits = None
+
     def tare_ch(self, ch_index):
         ''' Tares the Ch. (ch_index + 1) based on the most recent channel data. 
             Note this is equivalent to setting the offset to the negative of the ch data '''
         self.ch_offsets[0, ch_index] = - self.ch_data[-1, ch_index]
+        self.limits = None
 
     def untare_all(self):
         ''' Untares all the plots. '''
         self.ch_offsets = np.zeros_like(self.ch_offsets)
+        self.limits = None
 
     def reset_plots(self):
         ''' Clears time and channel data and untares the plots. '''
-        self.time_data = np.zeros((1, 1))
-        self.ch_data = np.zeros((1, self.quail.num_data_channels))
-        self.elements_on_screen = 1
+        self.buffer.clear()
+        self.buffer.append(np.zeros(1), np.zeros((1, self.quail.num_data_channels)))
         self.untare_all()
+        if self.tracer is not None:
+            self.tracer.reset()
 
     def set_offsets(self):
         ''' Opens dialog to adjust channel offsets. '''
@@ -209,14 +321,15 @@ class GraphPanes:
 
         def update_units(new_chunits, new_dispunits):
             ''' Child function that is called upon the Update button press. '''
+            # Convert old data to the new display units, all channels at once
+            new_disp_units = [var.get() for var in new_dispunits]
+            self.buffer.rescale(*units.compile_conversions(self.disp_units, new_disp_units))
+            # Update units in lists
             for i in range(self.quail.num_data_channels):
-                # If disp unit has changed, convert old data to the new display unit
-                new_disp_unit = new_dispunits[i].get()
-                if new_disp_unit.casefold() != self.disp_units[i].casefold():
-                    self.ch_data[:,i] = units.convert(self.ch_data[:,i], self.disp_units[i], new_disp_unit)
-                # Update units in lists
                 self.ch_units[i] = new_chunits[i].get()
-                self.disp_units[i] = new_disp_unit
+                self.disp_units[i] = new_disp_units[i]
+            self.update_conversions() # recompile the conversions of new data for the new units
+            self.limits = None
                 
             # Force channelpane & focuspane to redraw full plots to update plot axis labels on next animation
             self.focuspane.plot_width = 0
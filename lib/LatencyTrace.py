@@ -0,0 +1,120 @@
+'''
+LatencyTrace:
+
+Optional tracing of how stale the plotted data is. Each block of samples is stamped with the host's monotonic clock
+(time.perf_counter, which is shared between processes) at five stages:
+
+    read    : the data process read the block's first sample from the serial port
+    enqueue : the data process handed the block to the data queue
+    dequeue : GraphPanes.update_data took the block off the data queue
+    convert : update_data finished converting the block to display units
+    drawn   : a ChannelPane/FocusPane animation frame drew the block
+
+The data process sends (last sample time, read, enqueue) for each block over a separate trace queue. The GUI matches these
+records to the blocks it dequeues by their last sample time (so it works with either transport, even when the shared-memory
+ring merges blocks), adds the later stamps and keeps the most recent WINDOW blocks in a rolling buffer. From that buffer it
+produces per-stage histograms and percentiles, a one-line overlay for the ChannelPane and a JSON dump on exit.
+'''
+
+import collections
+import json
+import queue
+import time
+import numpy as np
+
+STAGES = ['read', 'enqueue', 'dequeue', 'convert', 'drawn'] # stages stamped for each block, in order
+WINDOW = 10000 # number of most recent blocks kept in the rolling histogram
+BIN_EDGES = np.logspace(-4, 1, 51) # histogram bin edges (sec), from 0.1 ms to 10 s with 10 bins per decade
+DUMP_FILE = 'latency_trace.json' # file the trace is written to when the dashboard closes
+OVERLAY_INTERVAL = 1.0 # minimum time (sec) between recomputations of the overlay's percentiles
+
+class LatencyTracer:
+    def __init__(self, trace_queue):
+        self.trace_queue = trace_queue # queue of (last sample time, read, enqueue) records sent by the data process
+        self.pending = collections.deque() # records received for blocks that have not been dequeued yet, oldest first
+        self.dequeued = [] # [read, enqueue, dequeue] stamps of blocks dequeued but not yet converted
+        self.converted = [] # [read, enqueue, dequeue, convert] stamps of blocks waiting to be drawn
+        self.stamps = np.full((WINDOW, len(STAGES)), np.nan) # rolling buffer of the stamps of fully traced blocks
+        self.count = 0 # total number of fully traced blocks
+        self.overlay = "latency: waiting for data" # overlay text, recomputed at most every OVERLAY_INTERVAL
+        self.overlay_count = 0 # count when the overlay was last computed
+        self.overlay_time = 0.0 # perf_counter time when the overlay was last computed
+
+    def block_dequeued(self, last_time):
+        ''' Stamps the blocks whose samples up to last_time (data time, sec) were just taken off the data queue. '''
+        now = time.perf_counter()
+        while True:
+            try:
+                self.pending.append(self.trace_queue.get_nowait())
+            except queue.Empty:
+                break
+        while self.pending and self.pending[0][0] <= last_time:
+            _, read, enqueue = self.pending.popleft()
+            self.dequeued.append([read, enqueue, now])
+
+    def blocks_converted(self):
+        ''' Stamps the dequeued blocks as converted to display units. '''
+        now = time.perf_counter()
+        self.converted += [stamps + [now] for stamps in self.dequeued]
+        self.dequeued = []
+
+    def blocks_drawn(self):
+        ''' Stamps the converted blocks as drawn and adds them to the rolling buffer. '''
+        if not self.converted:
+            return
+        now = time.perf_counter()
+        for stamps in self.converted:
+            self.stamps[self.count % WINDOW] = stamps + [now]
+            self.count += 1
+        self.converted = []
+
+    def reset(self):
+        ''' Forgets blocks in flight, e.g. when the plots are cleared for a new serial connection. '''
+        self.pending.clear()
+        self.dequeued = []
+        self.converted = []
+
+    def intervals(self):
+        ''' Returns a dict of interval name -> array of durations (sec) over the rolling window: the time between each pair of
+            consecutive stages, and 'total' from serial read to drawn. '''
+        stamps = self.stamps[:min(self.count, WINDOW)]
+        names = [STAGES[k] + '_to_' + STAGES[k + 1] for k in range(len(STAGES) - 1)]
+        durations = dict(zip(names, np.diff(stamps, axis = 1).T))
+        durations['total'] = stamps[:, -1] - stamps[:, 0]
+        return durations
+
+    def summary(self):
+        ''' Returns a dict of interval name -> (p50, p99) in milliseconds, or None before any block has been traced. '''
+        if self.count == 0:
+            return None
+        return {name: tuple(np.round(1000*np.percentile(values, [50, 99]), 3)) for name, values in self.intervals().items()}
+
+    def overlay_text(self):
+        ''' Returns the one-line status shown over the plots. Called every frame, so the percentiles are only recomputed once
+            OVERLAY_INTERVAL has passed and new blocks have been traced. '''
+        now = time.perf_counter()
+        if self.count != self.overlay_count and now - self.overlay_time >= OVERLAY_INTERVAL:
+            stamps = self.stamps[:min(self.count, WINDOW)]
+            p50, p99 = 1000*np.percentile(stamps[:, -1] - stamps[:, 0], [50, 99])
+            self.overlay = "read to screen: p50 {:.0f} ms | p99 {:.0f} ms".format(p50, p99)
+            self.overlay_count, self.overlay_time = self.count, now
+        return self.overlay
+
+    def report(self):
+        ''' Returns a one-line summary of the traced latencies. '''
+        summary = self.summary()
+        if summary is None:
+            return "Latency trace: no blocks traced"
+        return "Latency trace (ms, p50/p99): " + ", ".join(name + " = " + str(p50) + "/" + str(p99) for name, (p50, p99) in summary.items())
+
+    def dump(self, filename = DUMP_FILE):
+        ''' Writes the histograms and percentiles of the rolling window to filename as JSON. '''
+        summary = self.summary() or {}
+        with open(filename, "w") as f:
+            json.dump({
+                'blocks_traced': self.count,
+                'window': min(self.count, WINDOW),
+                'bin_edges_s': BIN_EDGES.tolist(),
+                'histograms': {name: np.histogram(values, BIN_EDGES)[0].tolist() for name, values in self.intervals().items()},
+                'percentiles_ms': {name: {'p50': p50, 'p99': p99} for name, (p50, p99) in summary.items()},
+            }, f, indent = 1)
@@ -26,6 +26,18 @@ from lib.RecordingPane import RecordingPane
 
 ### Import serial module that handles Quail reading & data collection ###
 from lib.quail_serial import quail
+from lib.MultiQuail import MultiQuail
+from lib.AsyncQuail import AsyncQuail
+from lib.TelemetryClient import TelemetryClient
+
+QUAIL_TRANSPORT = 'queue' # how the data process hands samples to the GUI: 'queue' (multiprocessing Queue) or 'shm' (shared-memory ring)
+QUAIL_PROTOCOL = 'csv' # serial format sent by Quail: 'csv' (text lines) or 'binary' (CRC-checked frames)
+QUAIL_PROBE_SCHEMA = False # if True, wait briefly on startup for Quail to announce its channels in a header line (else use lib/Quail_Channel_Defs.csv)
+QUAIL_ENGINE = 'thread' # acquisition engine: 'thread' (quail, blocking reads and a cmd thread) or 'asyncio' (AsyncQuail, one event loop, POSIX only)
+QUAIL_BOARDS = None # list of board settings (see MultiQuail.py) to acquire from several Quails at once, e.g. [{'name': 'Stand', 'COM_Port': 11}, {'name': 'Tank', 'COM_Port': 12}]
+QUAIL_PUBLISH = None # address (Unix socket path or 'host:port') on which to publish the data to other viewers, see TelemetryServer.py
+QUAIL_SUBSCRIBE = None # address of another dashboard's published data to view, instead of connecting to Quail (read-only, see TelemetryClient.py)
+QUAIL_TRACE = False # if True, trace the latency of each block from serial read to screen (overlay on the channel plots, dumped on exit)
 
 class MainWindow(tk.Tk):
     def __init__(self):
@@ -37,7 +49,13 @@ class MainWindow(tk.Tk):
         self.mainframe.pack(fill=tk.BOTH, expand=1) 
 
         # create Quail object that collects and records serial data
-        self.quail = quail(self)
+        if QUAIL_SUBSCRIBE:
+            self.quail = TelemetryClient(self, QUAIL_SUBSCRIBE, transport=QUAIL_TRANSPORT)
+        elif QUAIL_BOARDS:
+            self.quail = MultiQuail(self, [dict({'protocol': QUAIL_PROTOCOL, 'probe_schema': QUAIL_PROBE_SCHEMA}, **board) for board in QUAIL_BOARDS], transport=QUAIL_TRANSPORT)
+        else:
+            engine = AsyncQuail if QUAIL_ENGINE == 'asyncio' else quail
+            self.quail = engine(self, transport=QUAIL_TRANSPORT, protocol=QUAIL_PROTOCOL, trace=QUAIL_TRACE, probe_schema=QUAIL_PROBE_SCHEMA, publish=QUAIL_PUBLISH)
 
         # Set overall style and create any default styles for Tk Objects #
         self.tk.call('source', 'lib/black.tcl')
@@ -45,6 +63,7 @@ class MainWindow(tk.Tk):
         self.style.theme_use('black')
         self.style.configure('Red.TButton', font = ('TkDefaultFont', 14, 'bold'), foreground = 'white', background = "#a83232")
         self.style.configure('White.TButton', font = ('TkDefaultFont', 14), foreground = 'black', background = "#b6b6b6")
+        self.style.configure('Red.TLabel', font = ('TkDefaultFont', 12, 'bold'), foreground = "#ff4040")
 
         # create constituent items that make up the main window
         self.graphpanes = GraphPanes(self.mainframe, self.quail) # owner of the focus pane (shows two zoomed channels) and the channel pane (shows all channels)
@@ -6,6 +6,8 @@ The menu bar at the top of a MainWindow. Does not own any of the functions calle
 
 import tkinter as tk
 
+MAX_INLINE_TARE = 8 # with more channels than this, the Tare Ch. commands move to their own submenu
+
 class MenuBar(tk.Menu):
     def __init__(self, mainwindow):
         super().__init__(master = mainwindow) # initialize using parent constructor, with the mainwindow as the master
@@ -31,8 +33,10 @@ class MenuBar(tk.Menu):
         # --> Edit Time Width of Plots: opens a dialog that allows user to change width of all plots
         # --> Scale to Recent Data: y-axis scaling only considers the last 25% of data points on the plot
         # --> Scale to All Data: y-axis scaling considers all data on the plot
+        # --> Scale From Zero: the y-axis always includes zero (the default)
+        # --> Scale Min To Max: the y-axis spans the minimum to the maximum of the data considered
         # -------------
-        # --> Tare Ch. # : allows user to tare the selected channel, setting the offset to the most recent plot value
+        # --> Tare Ch. # : allows user to tare the selected channel, setting the offset to the most recent plot value (in a submenu if there are many channels)
         # --> Update Offset Values : opens a dialog that allows user to manually change the y-axis offset values
         # -------------
         # --> Un-tare All Channels: resets all channel offsets to zero, i.e. plots raw y data
@@ -41,9 +45,15 @@ class MenuBar(tk.Menu):
         plotmenu.add_command(label="Edit Time Width of Plots", command = mainwindow.graphpanes.set_plot_width )
         plotmenu.add_command(label="Scale To Recent Data", command= mainwindow.graphpanes.scale_recent )
         plotmenu.add_command(label="Scale To All Data", command= mainwindow.graphpanes.scale_all )
+        plotmenu.add_command(label="Scale From Zero", command= mainwindow.graphpanes.scale_from_zero )
+        plotmenu.add_command(label="Scale Min To Max", command= mainwindow.graphpanes.scale_min_max )
         plotmenu.add_separator()
+        taremenu = plotmenu
+        if mainwindow.quail.num_data_channels > MAX_INLINE_TARE:
+            taremenu = tk.Menu(plotmenu, tearoff=0)
+            plotmenu.add_cascade(label="Tare Channel", menu=taremenu)
         for i in range(mainwindow.quail.num_data_channels):
-            plotmenu.add_command(label="Tare Ch. "+str(i+1)+" = "+mainwindow.graphpanes.ch_names[i], command=lambda a=i: mainwindow.graphpanes.tare_ch(a))
+            taremenu.add_command(label="Tare Ch. "+str(i+1)+" = "+mainwindow.graphpanes.ch_names[i], command=lambda a=i: mainwindow.graphpanes.tare_ch(a))
         plotmenu.add_command(label = "Update Offset Values", command = mainwindow.graphpanes.set_offsets)
         plotmenu.add_separator()
         plotmenu.add_command(label="Un-tare All Channels", command= mainwindow.graphpanes.untare_all )
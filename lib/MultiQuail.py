@@ -0,0 +1,254 @@
+'''
+MultiQuail:
+
+Acquisition from several Quail boards at once. Each board is read by its own quail object (its own serial port, data process
+and parser), and a merger process combines their blocks into one time-ordered stream, which reaches GraphPanes and the record
+file exactly as a single board's stream would. The dashboard uses it in place of quail when MainWindow.QUAIL_BOARDS is set.
+
+Each board stamps its samples with its own clock, so the merger estimates every board's clock offset to the host's monotonic
+clock (time.perf_counter) as the minimum, over the last OFFSET_WINDOW seconds, of (host time a block was received - board time of
+its last sample). Queueing only ever delays a block, so the minimum is the closest estimate of the true offset. Samples are then
+placed on the host clock, measured from when collection started.
+
+Merged rows are released up to a watermark, the oldest "latest host time" among the boards that have delivered data in the last
+MERGE_MAX_DELAY seconds, so a silent or disconnected board holds the others back for at most that long. Each merged row is
+
+    time, board 0 channels, board 1 channels, ..., board N-1 channels, last_command
+
+where a board's channels hold their last received values between its own samples, and last_command is board 0's. The merged
+channel names are prefixed with the board's name (e.g. 'Stand: Load Cell').
+'''
+
+import collections
+import multiprocessing as mp
+import queue
+import threading
+import time
+import numpy as np
+
+from lib.quail_serial import quail, format_lines, DISPLAY_POLICY, DISPLAY_QUEUE_MAXSIZE, RECORD_QUEUE_MAXSIZE, RECORD_FORMAT, \
+    RECORD_FLUSH_INTERVAL, RECORD_FSYNC_INTERVAL, SHM_RING_CAPACITY
+from lib.SharedRingBuffer import SharedRingBuffer
+from lib.ChannelSchema import ChannelSchema
+
+OFFSET_WINDOW = 30.0 # time (sec) over which the minimum board-to-host clock offset is taken
+MERGE_MAX_DELAY = 0.5 # time (sec) after which a board that has sent nothing no longer holds back the merged stream
+MERGE_POLL_INTERVAL = 0.005 # time (sec) the merger sleeps when no board had new data
+
+class ClockOffset:
+    ''' Sliding-window minimum of (host time - board time), kept as a deque of candidate minima in increasing order. '''
+    def __init__(self, window = OFFSET_WINDOW):
+        self.window = window # length (sec, host time) of the sliding window
+        self.candidates = collections.deque() # (host time, offset) pairs that could still become the window's minimum
+
+    def update(self, board_time, host_time):
+        ''' Adds an observation and returns the current offset estimate (add it to a board time to get the host time). '''
+        offset = host_time - board_time
+        while self.candidates and self.candidates[-1][1] >= offset:
+            self.candidates.pop()
+        self.candidates.append((host_time, offset))
+        while self.candidates[0][0] < host_time - self.window:
+            self.candidates.popleft()
+        return self.candidates[0][1]
+
+    def reset(self):
+        self.candidates.clear()
+
+class StreamMerger:
+    ''' Merges blocks of (time, channels, last_command) rows from several boards into wide hold-last rows on the host clock.
+        widths is the number of channels of each board. add() takes each board's blocks as they arrive and merge() returns the
+        merged rows that are ready (or None), see the module docstring. '''
+    def __init__(self, widths, epoch, offset_window = OFFSET_WINDOW, max_delay = MERGE_MAX_DELAY):
+        self.widths = list(widths)
+        self.starts = 1 + np.concatenate(([0], np.cumsum(self.widths)[:-1])) # first merged column of each board's channels
+        self.epoch = epoch # host time (perf_counter) that is time zero of the merged stream
+        self.max_delay = max_delay
+        self.offsets = [ClockOffset(offset_window) for _ in self.widths] # clock offset estimate of each board
+        self.pending = [[] for _ in self.widths] # blocks of each board, already on the host clock, waiting for the watermark
+        self.latest = np.full(len(self.widths), -np.inf) # host time of each board's newest sample
+        self.last_seen = np.full(len(self.widths), -np.inf) # perf_counter time each board last delivered a block
+        self.held = np.zeros(1 + sum(self.widths) + 1) # the last merged row, whose values are held until a board sends new ones
+        self.last_time = -np.inf # time of the last merged row, merged time never goes backwards
+
+    def add(self, board, block, now):
+        ''' Adds a block received from board at host time now. '''
+        offset = self.offsets[board].update(block[-1, 0], now)
+        rows = block.copy()
+        rows[:, 0] += offset - self.epoch
+        self.pending[board].append(rows)
+        self.latest[board] = max(self.latest[board], rows[-1, 0])
+        self.last_seen[board] = now
+
+    def reset(self, board):
+        ''' Forgets a board's clock and pending rows, e.g. after it reconnected to a new serial port. Its held values are kept. '''
+        self.offsets[board].reset()
+        self.pending[board] = []
+        self.latest[board] = -np.inf
+
+    def merge(self, now):
+        ''' Returns the merged rows up to the watermark at host time now, or None if there are none. '''
+        live = now - self.last_seen <= self.max_delay
+        watermark = np.min(self.latest[live]) if live.any() else np.inf # with every board silent, release everything
+        ready_rows = [] # (board, rows) released by the watermark
+        for board, blocks in enumerate(self.pending):
+            if not blocks:
+                continue
+            rows = np.concatenate(blocks, axis = 0)
+            ready = rows[:, 0] <= watermark
+            self.pending[board] = [rows[~ready]] if not ready.all() else []
+            if ready.any():
+                ready_rows.append((board, rows[ready]))
+        if not ready_rows:
+            return None
+
+        times = np.concatenate([rows[:, 0] for _, rows in ready_rows])
+        order = np.argsort(times, kind = 'stable')
+        position = np.empty(len(order), dtype = np.int64)
+        position[order] = np.arange(len(order)) # merged row each ready row lands on
+        merged = np.tile(self.held, (len(order), 1)) # boards without new rows keep holding their values
+        merged[:, 0] = np.maximum.accumulate(np.maximum(times[order], self.last_time))
+        first = 0
+        for board, rows in ready_rows:
+            latest_row = np.full(len(order), -1)
+            latest_row[position[first:first + len(rows)]] = np.arange(len(rows))
+            latest_row = np.maximum.accumulate(latest_row) # each merged row takes the board's last row at or before it
+            have = latest_row >= 0
+            columns = slice(self.starts[board], self.starts[board] + self.widths[board])
+            merged[have, columns] = rows[latest_row[have], 1:-1]
+            if board == 0:
+                merged[have, -1] = rows[latest_row[have], -1]
+            first += len(rows)
+        self.held = merged[-1].copy()
+        self.last_time = merged[-1, 0]
+        return merged
+
+class MultiQuail(quail):
+    ### MultiQuail runs one quail per board (each with its own data process and cmd thread) plus a merger process, data_process,
+    ### which reads the boards' data queues, merges them with a StreamMerger and hands the merged blocks to the GUI and the record
+    ### thread the way a single quail's data process does. Recording and the bounded display path (put_display, display_coalesced)
+    ### are inherited from quail; samples_lost is the sum over the boards.
+    ###
+    ### The merger, not the GUI, reads the boards' data queues, and the merged stream is also what gets recorded, so those queues
+    ### must never be reduced by the boards' display policy: they are unbounded, so a board's put_display always succeeds and
+    ### never coalesces, and only the merged stream going to the GUI is bounded. Should a board coalesce anyway, its count is
+    ### added to the merged display_coalesced, so it shows in the dashboard's status.
+    ###
+    ### boards is a list of dicts, one per board: 'name' (the prefix of its channel names, 'Board <k>' if not given) and any
+    ### keyword arguments for that board's quail (COM_Port, protocol, emulator_options, schema, probe_schema...). Commands go to
+    ### board 0 unless another board is given to write_command.
+
+    def __init__(self, mainwindow, boards, transport='queue', display_policy=DISPLAY_POLICY):
+        if mainwindow is not None:
+            mainwindow.title("Quail Dashboard | " + str(len(boards)) + " boards")
+        self.boards = [] # the quail of each board (GUI process only)
+        self.board_names = [] # name of each board
+        for k, options in enumerate(boards):
+            options = dict(options)
+            self.board_names.append(options.pop('name', 'Board ' + str(k)))
+            board = quail(None, transport='queue', display_policy=display_policy, **options)
+            board.data_queue = mp.Queue() # unbounded and read by the merger, so the stream that gets recorded is never reduced
+            self.boards.append(board)
+
+        # Initialize unpickled variables (anything the merger process doesn't use)
+        self.mainwindow = mainwindow
+        self.serial = None # MultiQuail has no serial port of its own
+        self.filename = None # string name/filepath of file to which recorded data should be stored
+        self.record_writer = None # the RecordWriter used by the current/last recording
+        self.record_flush_interval = RECORD_FLUSH_INTERVAL # passed to the RecordWriter, see RecordWriter.py
+        self.record_fsync_interval = RECORD_FSYNC_INTERVAL # passed to the RecordWriter, see RecordWriter.py
+        self.trace_queue = None # latency tracing is per board, the merged stream is not traced
+
+        # Initialize pickled variables (things the merger process uses)
+        self.board_queues = [board.data_queue for board in self.boards] # data queue of each board
+        self.board_lost = [board.samples_lost for board in self.boards] # samples_lost of each board
+        self.board_coalesced = [board.display_coalesced for board in self.boards] # display_coalesced of each board
+        self.board_widths = [len(board.schema) for board in self.boards] # number of channels of each board
+        self.schema = ChannelSchema([name + ': ' + ch for name, board in zip(self.board_names, self.boards) for ch in board.schema.names],
+                                    [unit for board in self.boards for unit in board.schema.units]) # merged channels, board by board
+        self.num_data_channels = len(self.schema) # number of merged data channels
+        self.record_format = RECORD_FORMAT # format of record files, 'csv' or 'columnar'
+        self.kill = mp.Event() # flag indicating if the merger process is to be terminated (if set, kill process)
+        self.recording = mp.Event() # flag indicating whether to record merged data (if set, record)
+        self.record_queue = mp.Queue(maxsize=RECORD_QUEUE_MAXSIZE) # queue to which the merger pushes and from which the record_thread reads
+        self.record_dropped = mp.Value('l', 0) # number of blocks the merger could not record because the record queue was full
+        self.samples_lost = mp.Value('l', 0) # number of samples rejected or missed by the boards' serial parsers
+        if transport == 'shm':
+            self.data_queue = SharedRingBuffer(SHM_RING_CAPACITY, 1 + self.num_data_channels + 1) # shared-memory ring of merged rows
+        else:
+            self.data_queue = mp.Queue(maxsize=DISPLAY_QUEUE_MAXSIZE) # queue of merged (n, time + channels + last_command) blocks
+        self.transport = transport # 'queue' or 'shm', for the merged stream
+        self.display_policy = display_policy # how merged samples held back from a GUI that has fallen behind are reduced
+        self.display_coalesced = mp.Value('l', 0) # number of merged samples removed from the display path by display_policy
+
+        # Create processes/threads (does not start the process/thread)
+        self.data_process = mp.Process(name = "Quail_MergeThread", target = self.data_worker)
+        self.record_thread = threading.Thread(name = "Quail_RecordThread", target = self.record_worker)
+
+    def __getstate__(self):
+        return self.board_queues, self.board_lost, self.board_coalesced, self.board_widths, self.schema, self.num_data_channels, self.record_format, self.kill, self.recording, self.record_queue, self.record_dropped, self.samples_lost, self.data_queue, self.display_policy, self.display_coalesced
+
+    def __setstate__(self, state):
+        self.board_queues, self.board_lost, self.board_coalesced, self.board_widths, self.schema, self.num_data_channels, self.record_format, self.kill, self.recording, self.record_queue, self.record_dropped, self.samples_lost, self.data_queue, self.display_policy, self.display_coalesced = state
+
+    def start_collection(self):
+        for board in self.boards:
+            board.start_collection() # start each board's data process
+        self.data_process.start() # start the merger process, which calls data_worker
+
+    def stop_collection(self):
+        for board in self.boards:
+            board.kill.set() # stop every board first, the merger keeps draining their data queues so they can exit
+        for board in self.boards:
+            board.stop_collection()
+        super().stop_collection() # then stop the merger, finish recording and free the merged ring
+
+    def data_worker(self):
+        merger = StreamMerger(self.board_widths, time.perf_counter())
+        display_backlog = None # merged samples held back because the GUI has fallen behind, sent ahead of the next block
+        board_coalesced = 0 # samples coalesced by the boards, already added to display_coalesced
+        while not self.kill.is_set(): # while the process has not been killed
+            received = False
+            for board, board_queue in enumerate(self.board_queues):
+                while not board_queue.empty():
+                    try:
+                        block = board_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if not isinstance(block, np.ndarray):
+                        merger.reset(board) # the board changed serial port, its clock starts over
+                        continue
+                    merger.add(board, block, time.perf_counter())
+                    received = True
+
+            merged = merger.merge(time.perf_counter())
+            if merged is not None:
+                display_backlog = self.put_display(merged if display_backlog is None else np.concatenate((display_backlog, merged), axis = 0))
+                if self.recording.is_set():
+                    self.put_record(merged, format_lines(merged) if self.record_format == 'csv' else None)
+                self.samples_lost.value = sum(lost.value for lost in self.board_lost) # only the merger writes it
+                coalesced = sum(count.value for count in self.board_coalesced)
+                self.display_coalesced.value += coalesced - board_coalesced # only the merger writes it
+                board_coalesced = coalesced
+            elif display_backlog is not None:
+                display_backlog = self.put_display(display_backlog) # nothing new to send, retry the held-back samples alone
+            if not received:
+                self.kill.wait(MERGE_POLL_INTERVAL)
+        if hasattr(self.data_queue, 'cancel_join_thread'):
+            self.data_queue.cancel_join_thread() # don't wait on exit for a GUI that has stopped reading
+
+    def connection_status(self):
+        ''' Returns a one-line description of every board's serial connection. '''
+        return ", ".join(name + " " + board.connection_status() for name, board in zip(self.board_names, self.boards))
+
+    def write_command(self, command, board=0):
+        self.boards[board].write_command(command) # sent to board 0 unless told otherwise
+
+    def set_COM_port(self):
+        import tkinter.simpledialog as dialog # imported here so acquisition runs without Tk
+        if len(self.boards) == 1:
+            board = 0
+        else:
+            board = dialog.askinteger("Edit COM Port", "Enter the board to reconnect (" + ", ".join(str(k) + ": " + name for k, name in enumerate(self.board_names)) + "): ",
+                                      minvalue = 0, maxvalue = len(self.boards) - 1)
+        if board is not None:
+            self.boards[board].set_COM_port()
@@ -0,0 +1,107 @@
+'''
+PtyEmulator:
+
+Runs the Quail Emulator behind a Linux pseudo-terminal, so the dashboard connects to it as a real serial device through
+pyserial (instead of the in-process QuailEmulator used for negative COM Ports). This exercises the real tty read/write path,
+including readline timeouts and flush behavior, without hardware.
+
+The emulator's output is written to the pty master as it becomes due; commands the dashboard writes to the device are read back
+from the master and passed to the emulator, so they show up as last_command just as with Quail. If nothing is reading the device
+and the pty buffer fills, the bytes that do not fit are dropped (and counted), as a real serial device would drop them.
+
+Run from the repository root, then enter the printed device path as the dashboard's COM Port (Quail > Edit COM Port):
+
+    python -m lib.PtyEmulator --rate 10
+    python -m lib.PtyEmulator --protocol binary --channels 6 --sample-rate 5000
+    python -m lib.PtyEmulator --channels 32 --waveform step --dropout 0.001 --corrupt 0.001
+'''
+
+import argparse
+import os
+import select
+import time
+import tty
+
+from lib.QuailEmulator import QuailEmulator, WAVEFORMS, SPIN_MARGIN
+
+STREAM_TIMEOUT = 0.05 # maximum time (sec) the runner waits for new emulator output before checking for commands
+
+class PtyEmulator:
+    def __init__(self, protocol = 'csv', rate = 1.0, synthetic = None, spin_margin = SPIN_MARGIN):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave) # no echo or newline translation, like a USB serial device
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave) # device path the dashboard should connect to
+        self.emulator = QuailEmulator(self.port, timeout = STREAM_TIMEOUT, protocol = protocol, rate = rate, synthetic = synthetic,
+                                      spin_margin = spin_margin)
+        self.command_buffer = bytearray() # bytes of a command line that has not been completed yet
+        self.bytes_sent = 0 # bytes written to the pty
+        self.bytes_dropped = 0 # bytes that did not fit in the pty buffer
+        self.commands_received = 0 # command lines read from the pty
+
+    def run(self, duration = None):
+        ''' Streams emulator output into the pty until duration (sec) has passed, or forever if duration is None. '''
+        start = time.perf_counter()
+        while duration is None or time.perf_counter() - start < duration:
+            data = self.emulator.read(max(1, self.emulator.in_waiting)) # blocks for up to STREAM_TIMEOUT waiting for due output
+            if data:
+                self.send(data)
+            self.receive_commands()
+
+    def send(self, data):
+        ''' Writes data to the pty, dropping whatever does not fit in its buffer. '''
+        try:
+            sent = os.write(self.master, data)
+        except BlockingIOError:
+            sent = 0
+        self.bytes_sent += sent
+        self.bytes_dropped += len(data) - sent
+
+    def receive_commands(self):
+        ''' Reads any commands written to the device and passes each complete line to the emulator. '''
+        while select.select([self.master], [], [], 0)[0]:
+            try:
+                self.command_buffer += os.read(self.master, 4096)
+            except BlockingIOError:
+                break
+        while b'\n' in self.command_buffer:
+            end = self.command_buffer.find(b'\n') + 1
+            self.emulator.write(bytes(self.command_buffer[:end]))
+            del self.command_buffer[:end]
+            self.commands_received += 1
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Stream Quail Emulator telemetry through a pseudo-terminal.")
+    parser.add_argument("--protocol", default = 'csv', choices = ['csv', 'binary'])
+    parser.add_argument("--rate", type = float, default = 1.0, help = "replay speed multiplier")
+    parser.add_argument("--channels", type = int, default = None, help = "send synthetic data with this many channels instead of the csv file")
+    parser.add_argument("--sample-rate", type = float, default = 1000.0, help = "synthetic samples per second")
+    parser.add_argument("--waveform", default = 'mixed', choices = WAVEFORMS + ['mixed'], help = "synthetic waveform of every channel ('mixed' cycles through them)")
+    parser.add_argument("--dropout", type = float, default = 0.0, help = "probability that a synthetic sample is never sent")
+    parser.add_argument("--corrupt", type = float, default = 0.0, help = "probability that a synthetic sample is sent corrupted")
+    parser.add_argument("--seed", type = int, default = 0, help = "synthetic data seed")
+    parser.add_argument("--duration", type = float, default = None, help = "stop after this many seconds")
+    args = parser.parse_args()
+
+    synthetic = None
+    if args.channels is not None:
+        synthetic = {'num_channels': args.channels, 'sample_rate': args.sample_rate, 'waveform': args.waveform,
+                     'dropout_rate': args.dropout, 'corrupt_rate': args.corrupt, 'seed': args.seed}
+    elif args.waveform != 'mixed' or args.dropout or args.corrupt:
+        parser.error("--waveform, --dropout and --corrupt apply to synthetic data, give --channels too")
+    emulator = PtyEmulator(protocol = args.protocol, rate = args.rate, synthetic = synthetic)
+    print("Quail Emulator streaming on " + emulator.port, flush = True)
+    try:
+        emulator.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Sent {} bytes, dropped {} bytes, received {} commands".format(emulator.bytes_sent, emulator.bytes_dropped, emulator.commands_received))
+        emulator.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+'''
+QuailDaemon:
+
+Headless acquisition and recording, for unattended soak tests and cold-flow logging on a machine without a display. Connects to
+Quail through quail (or AsyncQuail, with --engine asyncio) exactly as the dashboard does, but imports nothing from Tk or
+matplotlib, so it starts in a fraction of a second. Samples sent to the display path are discarded, except the latest one, which
+is reported by the status request.
+
+The daemon is controlled through a Unix socket (--socket, default SOCKET_PATH). Each request is one line, answered with one
+line of JSON:
+
+    status          : connection state, latest sample, samples lost, recording statistics
+    command <n>     : writes command n to Quail
+    record <name>   : starts recording to Data/<date>/<name>___<date>___<time>.txt (or .qcol) under --directory
+    stop            : stops recording
+    port <COM Port> : reconnects to another COM Port (a number, a device path, or 'auto')
+    shutdown        : stops recording and acquisition and exits (as does SIGINT/SIGTERM)
+
+Run from the repository root, e.g.
+
+    python -m lib.QuailDaemon --record coldflow                       (Quail found by USB VID/PID, see ConnectionManager.py)
+    python -m lib.QuailDaemon --port /dev/ttyACM0 --record coldflow
+    python -m lib.QuailDaemon --send "command 42"
+'''
+
+import argparse
+import json
+import os
+import selectors
+import signal
+import socket
+import time
+import numpy as np
+
+from lib.quail_serial import quail
+
+SOCKET_PATH = '/tmp/quail.sock' # default path of the control socket
+POLL_INTERVAL = 0.05 # maximum time (sec) between drains of the display path
+REPLY_TIMEOUT = 5.0 # maximum time (sec) --send waits for the daemon's reply
+
+class QuailDaemon:
+    def __init__(self, quail, socket_path = SOCKET_PATH, directory = None):
+        self.quail = quail
+        self.directory = directory # folder under which Data/<date> record folders are made (the program's folder if None)
+        self.socket_path = socket_path
+        self.selector = selectors.DefaultSelector()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path) # left behind by a daemon that did not shut down cleanly
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(socket_path)
+        self.server.listen()
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.buffers = {} # pending request bytes of each connected client
+        self.latest = None # the latest sample received (time, channels, last_command)
+        self.samples = 0 # samples received since the daemon started
+        self.running = False
+
+    def run(self):
+        ''' Runs acquisition and serves the control socket until shutdown is requested. '''
+        self.running = True
+        self.quail.start_collection()
+        try:
+            while self.running:
+                for key, _ in self.selector.select(POLL_INTERVAL):
+                    if key.fileobj is self.server:
+                        self.accept()
+                    else:
+                        self.receive(key.fileobj)
+                self.drain()
+        finally:
+            self.close()
+
+    def accept(self):
+        client, _ = self.server.accept()
+        client.setblocking(False)
+        self.buffers[client] = bytearray()
+        self.selector.register(client, selectors.EVENT_READ)
+
+    def receive(self, client):
+        ''' Reads from a client and answers every complete request line. '''
+        try:
+            data = client.recv(4096)
+        except OSError:
+            data = b''
+        if not data:
+            self.disconnect(client)
+            return
+        buffer = self.buffers[client]
+        buffer += data
+        while b'\n' in buffer:
+            end = buffer.find(b'\n') + 1
+            line = bytes(buffer[:end]).decode(errors = 'replace').strip()
+            del buffer[:end]
+            if line:
+                try:
+                    client.sendall((json.dumps(self.handle(line)) + '\n').encode())
+                except OSError:
+                    self.disconnect(client)
+                    return
+
+    def disconnect(self, client):
+        self.selector.unregister(client)
+        del self.buffers[client]
+        client.close()
+
+    def handle(self, line):
+        ''' Carries out one request and returns the reply as a dict. '''
+        request, _, argument = line.partition(' ')
+        argument = argument.strip()
+        if request == 'status':
+            return self.status()
+        if request == 'command':
+            try:
+                self.quail.write_command(int(argument))
+            except ValueError:
+                return {'ok': False, 'error': "command needs an integer, got " + repr(argument)}
+            return {'ok': True}
+        if request == 'record':
+            if self.quail.recording.is_set():
+                return {'ok': False, 'error': "already recording to " + self.quail.filename}
+            self.quail.start_recording(argument or 'daemon', self.directory)
+            return {'ok': True, 'file': self.quail.filename}
+        if request == 'stop':
+            if self.quail.recording.is_set():
+                self.quail.stop_recording()
+            return {'ok': True, 'record_stats': self.quail.record_stats()}
+        if request == 'port':
+            try:
+                port = int(argument)
+            except ValueError:
+                port = argument # a device path, or 'auto'
+            if port == '':
+                return {'ok': False, 'error': "port needs a COM Port"}
+            self.quail.COM_Port = port
+            self.quail.COM_queue.put(port)
+            return {'ok': True}
+        if request == 'shutdown':
+            self.running = False
+            return {'ok': True}
+        return {'ok': False, 'error': "unknown request " + repr(request)}
+
+    def status(self):
+        return {
+            'ok': True,
+            'connection': self.quail.connection_status(),
+            'channels': self.quail.schema.names,
+            'latest': None if self.latest is None else self.latest.tolist(),
+            'samples': self.samples,
+            'samples_lost': self.quail.samples_lost.value,
+            'recording': self.quail.filename if self.quail.recording.is_set() else None,
+            'record_stats': self.quail.record_stats(),
+        }
+
+    def drain(self):
+        ''' Empties the display path, keeping only the latest sample. '''
+        while not self.quail.data_queue.empty():
+            block = self.quail.data_queue.get()
+            if isinstance(block, np.ndarray) and len(block) > 0:
+                self.latest = block[-1]
+                self.samples += len(block)
+
+    def close(self):
+        ''' Stops acquisition (finishing any recording) and removes the control socket. '''
+        self.quail.kill.set()
+        while self.quail.data_process.is_alive(): # the data process cannot exit while blocks it queued are waiting to be read
+            self.drain()
+            self.quail.data_process.join(POLL_INTERVAL)
+        self.quail.stop_collection()
+        for client in list(self.buffers):
+            self.disconnect(client)
+        self.selector.close()
+        self.server.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def stop(self, signum = None, frame = None):
+        ''' Requests shutdown (used as the SIGINT/SIGTERM handler). '''
+        self.running = False
+
+def send(request, socket_path = SOCKET_PATH):
+    ''' Sends one request to a running daemon and returns its reply as a dict. '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(REPLY_TIMEOUT)
+        client.connect(socket_path)
+        client.sendall((request.strip() + '\n').encode())
+        reply = bytearray()
+        while not reply.endswith(b'\n'):
+            data = client.recv(4096)
+            if not data:
+                break
+            reply += data
+    return json.loads(reply)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Acquire and record Quail data without the dashboard, controlled through a Unix socket.")
+    parser.add_argument("--port", default = 'auto', help = "COM Port number, device path, 'auto' (discover Quail by USB VID/PID, the default), or a negative number for the emulator")
+    parser.add_argument("--protocol", default = 'csv', choices = ['csv', 'binary'])
+    parser.add_argument("--engine", default = 'thread', choices = ['thread', 'asyncio'], help = "acquisition engine, see AsyncQuail.py")
+    parser.add_argument("--format", default = None, choices = ['csv', 'columnar'], help = "record file format (default from quail_serial.RECORD_FORMAT)")
+    parser.add_argument("--record", default = None, help = "start recording under this test name right away")
+    parser.add_argument("--directory", default = None, help = "folder under which the Data/<date> record folders are made")
+    parser.add_argument("--probe-schema", action = 'store_true', help = "wait briefly for Quail to announce its channels in a header line")
+    parser.add_argument("--socket", default = SOCKET_PATH, help = "path of the control socket")
+    parser.add_argument("--publish", default = None, metavar = "ADDRESS", help = "publish the data for viewers on this Unix socket path or host:port, see TelemetryServer.py")
+    parser.add_argument("--send", default = None, metavar = "REQUEST", help = "send a request to a running daemon, print its reply and exit")
+    args = parser.parse_args()
+
+    if args.send is not None:
+        print(json.dumps(send(args.send, args.socket)))
+        return
+
+    if args.engine == 'asyncio' and os.name != 'posix':
+        parser.error("--engine asyncio is only supported on POSIX systems (see AsyncQuail.py), use --engine thread")
+
+    start = time.perf_counter()
+    try:
+        port = int(args.port)
+    except ValueError:
+        port = args.port
+    if args.engine == 'asyncio':
+        from lib.AsyncQuail import AsyncQuail as engine
+    else:
+        engine = quail
+    q = engine(None, COM_Port = port, protocol = args.protocol, probe_schema = args.probe_schema, publish = args.publish)
+    if args.format is not None:
+        q.record_format = args.format
+    daemon = QuailDaemon(q, args.socket, args.directory)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    if args.record:
+        q.start_recording(args.record, args.directory)
+    print("Quail daemon ready in {:.2f} s, {}, control socket {}".format(time.perf_counter() - start, q.connection_status(), args.socket), flush = True)
+    daemon.run()
+    print("Quail daemon stopped", flush = True)
+
+if __name__ == '__main__':
+    main()
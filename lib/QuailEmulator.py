@@ -1,53 +1,228 @@
 '''
 QuailEmulator:
 
-A very simple serial emulator that feeds data in a method similar to Quail. Data is pulled from a csv file,
-and the readline command waits until each data line's indicated time has passed before passing it to the function.
+A very simple serial emulator that feeds data in a method similar to Quail. Data is loaded once from a csv file,
+and each data line becomes readable (through read, readline and in_waiting, as with pyserial) once its indicated time has passed.
+The file loops forever, with the time of each loop continuing from the end of the last.
 
-Includes the ability to time out and write commands.
+Includes the ability to time out and write commands. With protocol='binary', each line is sent as a binary frame
+(see lib/telemetry_frames.py) instead of CSV text. The rate argument replays the file faster (or slower) than real time,
+e.g. rate=10 sends ten seconds of data every second. Waiting for the next line sleeps until just before it is due and only
+spins for the last spin_margin seconds (SPIN_MARGIN by default), so pacing is precise without burning a core. spin_margin = 0
+only sleeps, for measurements where the emulator's spinning would be mistaken for the reader's CPU use.
+
+Instead of the csv file, the emulator can send synthetic data for load testing: pass synthetic = a dict of SyntheticTelemetry
+arguments (channel count, sample rate, waveform, dropout and corruption rates, seed) and it generates that stream instead.
+
+With header=True the emulator first announces its channels in a header line (see ChannelSchema.py), as Quail does on boot, and
+dtypes sets the wire dtype of each channel in binary frames (all float32 by default).
 '''
 
 import numpy as np
 import time
-import linecache
+import lib.telemetry_frames as frames
+from lib.ChannelSchema import ChannelSchema
+
+READFILE = 'lib/QuailEmulator_data.csv' # this file contains a header line, then lines of time (sec), ch1, ..., ch6
+SPIN_MARGIN = 0.002 # time (sec) before a deadline at which waiting switches from sleeping to spinning
+
+def encode_frames(seq, times, channels, last_command, dtypes = None):
+    ''' Encodes a block of samples as consecutive binary frames: seq is the sequence number of the first frame, times the
+        (n,) sample times in seconds, channels the (n, num_channels) channel values and last_command the most recent command seen.
+        seq may also be an (n,) array giving each frame's sequence number. dtypes optionally gives each channel's wire dtype
+        (all float32 by default). '''
+    channels = np.atleast_2d(channels)
+    n, num_channels = channels.shape
+    layout = num_channels if dtypes is None else dtypes
+    out = np.zeros(n, dtype=frames.frame_dtype(layout))
+    out['sync'] = frames.SYNC
+    out['length'] = frames.payload_length(layout)
+    out['seq'] = (seq + np.arange(n) if np.isscalar(seq) else np.asarray(seq)) % frames.SEQ_WRAP
+    out['time'] = np.round(np.asarray(times)*frames.TIME_SCALE).astype(np.int64) % frames.TIME_WRAP
+    out['channels'] = frames.pack_channels(channels, out.dtype['channels'])
+    out['command'] = int(last_command) & 0xFF
+    out['crc'] = frames.crc16_rows(out.view(np.uint8).reshape(n, -1)[:, 2:-2])
+    return out.tobytes()
+
+def encode_frame(seq, t, channels, last_command):
+    ''' Encodes one sample as a binary frame: seq is the frame sequence number, t the time in seconds, channels the list of
+        channel values and last_command the most recent command seen. '''
+    return encode_frames(seq, [t], [channels], last_command)
 
-READFILE = 'lib/QuailEmulator_data.csv' # this file contains 
+def wait_until(deadline, spin_margin = SPIN_MARGIN):
+    ''' Blocks until perf_counter() reaches deadline: sleeps for most of the wait, then spins for the last spin_margin. '''
+    remaining = deadline - time.perf_counter()
+    if remaining > spin_margin:
+        time.sleep(remaining - spin_margin)
+    while time.perf_counter() < deadline:
+        pass
+
+WAVEFORMS = ['step', 'ramp', 'noise', 'sine'] # waveforms SyntheticTelemetry can generate ('mixed' cycles through them by channel)
+
+class SyntheticTelemetry:
+    ''' Seeded generator of Quail-like telemetry with a configurable channel count, sample rate and waveform, for load testing.
+        Samples are generated in order by index, so the same seed always produces the same stream however it is read.
+            num_channels : number of data channels (Quail sends 6, load tests go up to 128)
+            sample_rate  : samples per second (10 Hz to 10 kHz)
+            waveform     : one of WAVEFORMS, or 'mixed' to give channel j waveform WAVEFORMS[j % 4]
+            dropout_rate : probability that a sample is never sent, as if lost on the wire
+            corrupt_rate : probability that a sample is sent corrupted (garbled text or a flipped frame byte)
+            seed         : seed for the noise, dropouts and corruption '''
+    def __init__(self, num_channels = 6, sample_rate = 1000.0, waveform = 'mixed', dropout_rate = 0.0, corrupt_rate = 0.0, seed = 0):
+        self.num_channels = num_channels
+        self.sample_rate = float(sample_rate)
+        self.dropout_rate = dropout_rate
+        self.corrupt_rate = corrupt_rate
+        kinds = [waveform]*num_channels if waveform != 'mixed' else [WAVEFORMS[j % len(WAVEFORMS)] for j in range(num_channels)]
+        self.kinds = np.array([WAVEFORMS.index(kind) for kind in kinds]) # waveform of each channel, as an index into WAVEFORMS
+        self.periods = 1.0 + 0.37*np.arange(num_channels) # period (sec) of each channel's waveform, staggered so channels differ
+        self.amplitudes = 10.0*(1 + np.arange(num_channels) % 7) # amplitude of each channel's waveform
+        self.noise_rng = np.random.default_rng([seed, 0]) # separate streams so each kind of randomness is independent of the others
+        self.dropout_rng = np.random.default_rng([seed, 1])
+        self.corrupt_rng = np.random.default_rng([seed, 2])
+
+    def samples(self, first, stop):
+        ''' Returns the times (n,), values (n, num_channels), dropped mask (n,) and corrupted mask (n,) of samples first to stop-1. '''
+        times = np.arange(first, stop)/self.sample_rate
+        phase = (times[:, None]/self.periods) % 1.0
+        waves = np.stack([
+            np.where(phase < 0.5, 1.0, 0.0), # step
+            phase, # ramp
+            0.5 + 0.1*self.noise_rng.standard_normal(phase.shape), # noise
+            0.5 + 0.5*np.sin(2*np.pi*phase), # sine
+        ])
+        values = self.amplitudes*np.take_along_axis(waves, self.kinds[None, None, :].repeat(len(times), axis=1), axis=0)[0]
+        dropped = self.dropout_rng.random(len(times)) < self.dropout_rate
+        corrupted = self.corrupt_rng.random(len(times)) < self.corrupt_rate
+        return times, values, dropped, corrupted
 
 class QuailEmulator:
-    def __init__(self, COM_Port, timeout = -1):
-        self.timeout = timeout
+    def __init__(self, COM_Port, timeout = -1, protocol = 'csv', rate = 1.0, synthetic = None, header = False, dtypes = None, spin_margin = SPIN_MARGIN):
+        self.timeout = timeout # as with pyserial: None blocks forever, otherwise the max time (sec) a read waits (negative does not wait)
+        self.protocol = protocol # 'csv' to send lines of text, 'binary' to send binary frames
+        self.rate = rate # replay speed multiplier
+        self.seq = 0 # sequence number of the next binary frame
         self.start_time = time.perf_counter() # get starting time, in seconds, as reference point
         self.curr_command = 0
-        self.curr_line = 2 # counter that tracks the current line being read from the file, allows us to loop through the file if we reach the end
-                        # first line is a header
-        self.last_time = 0
-        self.time_offset = 0 # an offset used for when you loop through a file
         self.port = COM_Port
+        self.out_buffer = bytearray() # bytes of lines that are due but have not been read yet
+        self.generator = None if synthetic is None else SyntheticTelemetry(**synthetic) # synthetic data source, used in place of the file
+        self.curr_line = 0 # index of the next line to be sent, allows us to loop through the file if we reach the end
+        self.time_offset = 0 # an offset used for when you loop through a file
+        self.dtypes = dtypes # wire dtype of each channel in binary frames, or None for float32
+        self.spin_margin = spin_margin # time (sec) before a line is due at which waiting for it switches from sleeping to spinning
+        if self.generator is not None:
+            if header:
+                self.out_buffer += (ChannelSchema(['CH' + str(j + 1) for j in range(self.generator.num_channels)]).header() + '\r\n').encode()
+            return
+
+        # Load the whole file once; the channel text is kept as written so CSV output matches the file exactly
+        with open(READFILE) as f:
+            lines = f.read().splitlines()
+        if header:
+            self.out_buffer += (lines[0] + ',last_command,zerocheck\r\n').encode()
+        lines = lines[1:] # first line is a header
+        fields = [line.strip("\n\r,b'").split(',', 1) for line in lines if line.strip()]
+        self.file_times = np.array([float(t) for t, _ in fields]) # time (sec) of each line
+        self.file_values = np.array([[float(v) for v in rest.split(',')] for _, rest in fields]) # channel values of each line
+        self.file_text = [rest for _, rest in fields] # channel text of each line
+
+    def _fill(self):
+        ''' Moves every line whose indicated time has passed into the output buffer, as Quail's serial output would. '''
+        elapsed = (time.perf_counter() - self.start_time)*self.rate # time into the data that has been replayed so far
+        if self.generator is not None:
+            stop = int(elapsed*self.generator.sample_rate) + 1 # samples are due at index/sample_rate
+            if stop > self.curr_line:
+                self._emit_synthetic(*self.generator.samples(self.curr_line, stop))
+                self.curr_line = stop
+            return
+        while True:
+            stop = np.searchsorted(self.file_times, elapsed - self.time_offset, side='right')
+            if stop > self.curr_line:
+                self._emit(self.curr_line, stop)
+                self.curr_line = stop
+            if self.curr_line < len(self.file_times):
+                return # the next line is not due yet
+            self.curr_line = 0 # reached EOF, loop back to the first line
+            self.time_offset += self.file_times[-1] # adjust time offset
+
+    def _emit(self, first, stop):
+        ''' Adds lines first to stop-1 of the current loop through the file to the output buffer. '''
+        times = self.file_times[first:stop] + self.time_offset
+        if self.protocol == 'binary':
+            self.out_buffer += encode_frames(self.seq, times, self.file_values[first:stop], self.curr_command, self.dtypes)
+            self.seq += stop - first
+        else:
+            tail = ',' + str(self.curr_command) + ',0\r\n' # add command and zero-check
+            self.out_buffer += ''.join(str(t) + ',' + text + tail for t, text in zip(times.tolist(), self.file_text[first:stop])).encode()
+
+    def _emit_synthetic(self, times, values, dropped, corrupted):
+        ''' Adds generated samples to the output buffer, leaving out dropped samples and garbling corrupted ones. '''
+        seqs = self.seq + np.arange(len(times))
+        self.seq += len(times)
+        keep = ~dropped
+        times, values, corrupted, seqs = times[keep], values[keep], corrupted[keep], seqs[keep]
+        rng = self.generator.corrupt_rng
+        if self.protocol == 'binary':
+            data = np.frombuffer(encode_frames(seqs, times, values, self.curr_command, self.dtypes), dtype=np.uint8).reshape(len(times), -1).copy()
+            rows = np.flatnonzero(corrupted)
+            data[rows, rng.integers(0, data.shape[1], len(rows))] ^= rng.integers(1, 256, len(rows), dtype=np.uint8) # flip one byte per frame
+            self.out_buffer += data.tobytes()
+            return
+        row_format = '%.6f' + ',%.4f'*values.shape[1] + ',' + str(self.curr_command) + ',0\r\n' # add command and zero-check
+        lines = [row_format % tuple(row) for row in np.column_stack((times, values)).tolist()]
+        for k in np.flatnonzero(corrupted):
+            kind = rng.integers(3)
+            if kind == 0:
+                lines[k] = lines[k][:len(lines[k])//2] + '\r\n' # truncated line
+            elif kind == 1:
+                lines[k] = lines[k].replace(',', ',#', 1) # unparseable field
+            else:
+                lines[k] = lines[k][:-3] + '1\r\n' # failed zerocheck
+        self.out_buffer += ''.join(lines).encode()
+
+    def _next_due(self):
+        ''' Returns the perf_counter time at which the next line is due. '''
+        if self.generator is not None:
+            return self.start_time + self.curr_line/self.generator.sample_rate/self.rate
+        return self.start_time + (self.file_times[self.curr_line] + self.time_offset)/self.rate
+
+    def _wait_for(self, is_ready):
+        ''' Fills the output buffer until is_ready() or the timeout is reached, sleeping between lines. '''
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        self._fill()
+        while not is_ready() and (deadline is None or time.perf_counter() < deadline):
+            wait_until(self._next_due() if deadline is None else min(self._next_due(), deadline), self.spin_margin)
+            self._fill()
+
+    def read(self, size = 1):
+        ''' Mimics pyserial's read: blocks until size bytes are available or the timeout is reached, then returns up to size bytes. '''
+        self._wait_for(lambda: len(self.out_buffer) >= size)
+        data = bytes(self.out_buffer[:size])
+        del self.out_buffer[:size]
+        return data
 
     def readline(self):
-        lineread = linecache.getline(READFILE, self.curr_line)
-        if lineread == '': # if reached EOF
-            self.curr_line = 2
-            self.time_offset = self.last_time # adjust time offset
-            lineread = linecache.getline(READFILE, self.curr_line)
-        
-        lineread = lineread.strip("\n\r,b'").split(',')
-        self.last_time = float( lineread[0] ) + self.time_offset
-        lineread[0] = str(self.last_time)
-
-        lineread.append(str(self.curr_command))
-        lineread.append('0') # add command and zero-check
-        
-        ref_time = time.perf_counter()
-        while time.perf_counter() - self.start_time < self.last_time :
-            if time.perf_counter() - ref_time > self.timeout:
-                return '' # if timed out, return without incrementing current time
-            pass # block until it's time to send this line or timeout has been reached
-        self.curr_line += 1
-        return ','.join(lineread)
-    
+        ''' Mimics pyserial's readline: blocks until a full line is available or the timeout is reached. '''
+        self._wait_for(lambda: b'\n' in self.out_buffer)
+        end = self.out_buffer.find(b'\n') + 1
+        if end == 0:
+            return b'' # if timed out, return nothing
+        data = bytes(self.out_buffer[:end])
+        del self.out_buffer[:end]
+        return data
+
+    @property
+    def in_waiting(self):
+        ''' Mimics pyserial's in_waiting: returns the number of bytes of due lines that have not been read yet. '''
+        self._fill()
+        return len(self.out_buffer)
+
     def write(self, command):
         self.curr_command = command.decode().strip('\n').strip('\r') #decode from UTF-8, then strip endline chars
 
     def flush(self):
-        pass # does nothing, as writing is instantaneous
\ No newline at end of file
+        pass # does nothing, as writing is instantaneous
+
+    def close(self):
+        pass # does nothing, the emulator holds no device
@@ -0,0 +1,125 @@
+'''
+RecordWriter:
+
+Writes recorded Quail data to disk from the record queue. Rather than writing one queue item at a time, the writer blocks
+for the first waiting item, drains everything else already queued (up to max_batch items) and writes the batch as one
+string through a large file buffer. The file is flushed every flush_interval seconds and, if fsync_interval is set,
+forced to disk with os.fsync every fsync_interval seconds, so a crash loses at most that much data.
+
+The writer keeps simple statistics (bytes written, bytes written per second, queue backlog) that the GUI can display
+while recording, so a disk that cannot keep up is visible before the record queue fills. If the data process had to drop
+blocks anyway (see quail.put_record), a note saying how many is added to the end of the file.
+'''
+
+import os
+import queue
+import time
+
+WRITE_BUFFER_SIZE = 1 << 20 # size (bytes) of the file's write buffer
+MAX_BATCH = 1024 # maximum number of queue items written in one batch
+POLL_TIMEOUT = 0.1 # maximum time (sec) to block on the queue before checking whether recording has stopped
+RATE_WINDOW = 1.0 # time (sec) over which bytes_per_sec is averaged
+
+class RecordWriter:
+    def __init__(self, filename, record_queue, recording, flush_interval = 1.0, fsync_interval = None, dropped = None):
+        self.filename = filename # path of the file to write
+        self.record_queue = record_queue # queue of strings to write, in order
+        self.recording = recording # Event that is set while recording, the writer exits once it is cleared and the queue is empty
+        self.flush_interval = flush_interval # time (sec) between flushes of the write buffer to the OS
+        self.fsync_interval = fsync_interval # time (sec) between os.fsync calls, or None to leave syncing to the OS
+        self.dropped = dropped # shared count of blocks the data process dropped from this recording, or None
+
+        self.bytes_written = 0 # total bytes written so far
+        self.bytes_per_sec = 0.0 # bytes written per second over the last RATE_WINDOW
+        self._rate_start = time.perf_counter() # start of the current rate window
+        self._rate_bytes = 0 # bytes written in the current rate window
+
+    def run(self):
+        ''' Writes queued data until recording stops and the queue has been drained. Blocks, so call from the record thread. '''
+        with self.open() as f:
+            last_flush = last_fsync = time.perf_counter()
+            while True:
+                try:
+                    batch = [self.record_queue.get(timeout = POLL_TIMEOUT)] # block until there is an item in the queue
+                except queue.Empty:
+                    if not self.recording.is_set():
+                        break # recording has stopped and there's no data left to record in the queue
+                    batch = []
+                while len(batch) < MAX_BATCH: # take everything else that is already waiting
+                    try:
+                        batch.append(self.record_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self.write(f, batch)
+
+                now = time.perf_counter()
+                if now - last_flush >= self.flush_interval:
+                    self.flush(f)
+                    last_flush = now
+                if self.fsync_interval is not None and now - last_fsync >= self.fsync_interval:
+                    self.flush(f)
+                    os.fsync(f.fileno())
+                    last_fsync = now
+            if self.dropped is not None and self.dropped.value > 0:
+                self.note(f, "RECORDING INCOMPLETE: " + str(self.dropped.value) + " blocks were dropped because the record queue was full")
+            self.close(f)
+            if self.fsync_interval is not None:
+                os.fsync(f.fileno())
+
+    def open(self):
+        ''' Opens the record file. Subclasses writing other formats override open, _write, _flush and _close. '''
+        return open(self.filename, "w", buffering = WRITE_BUFFER_SIZE)
+
+    def write(self, f, batch):
+        ''' Writes a batch of queue items to f, counts it in the statistics and returns the number of bytes written. '''
+        return self._count(self._write(f, batch))
+
+    def flush(self, f):
+        ''' Pushes buffered data to the OS, counts it in the statistics and returns the number of bytes written. '''
+        return self._count(self._flush(f))
+
+    def note(self, f, text):
+        ''' Adds a one-line note (e.g. a warning about the data) to the file, counts it and returns the number of bytes written. '''
+        return self._count(self._note(f, text))
+
+    def close(self, f):
+        ''' Finishes the file before it is closed (f itself is closed by the caller) and returns the number of bytes written. '''
+        return self._count(self._close(f))
+
+    def _write(self, f, batch):
+        ''' Writes a batch of queue items (strings of CSV lines) to f and returns the number of bytes written. '''
+        chunk = ''.join(batch)
+        f.write(chunk)
+        num_bytes = len(chunk) if chunk.isascii() else len(chunk.encode(f.encoding, errors = f.errors)) # bytes, not characters
+        return num_bytes + chunk.count('\n')*(len(os.linesep) - 1) # text mode writes os.linesep for every newline
+
+    def _note(self, f, text):
+        ''' Writes a note as a '#' comment line and returns the number of bytes written. '''
+        return self._write(f, ['# ' + text + '\n'])
+
+    def _flush(self, f):
+        ''' Pushes buffered data to the OS and returns the number of bytes written in doing so. '''
+        f.flush()
+        return 0
+
+    def _close(self, f):
+        ''' Finishes the file before it is closed and returns the number of bytes written in doing so. '''
+        return self._flush(f)
+
+    def _count(self, num_bytes):
+        ''' Updates the byte counters and, once per RATE_WINDOW, the write rate. Returns num_bytes. '''
+        self.bytes_written += num_bytes
+        self._rate_bytes += num_bytes
+        elapsed = time.perf_counter() - self._rate_start
+        if elapsed >= RATE_WINDOW:
+            self.bytes_per_sec = self._rate_bytes/elapsed
+            self._rate_start += elapsed
+            self._rate_bytes = 0
+        return num_bytes
+
+    def backlog(self):
+        ''' Returns the number of items waiting in the record queue, or None if the platform cannot report it (macOS). '''
+        try:
+            return self.record_queue.qsize()
+        except NotImplementedError:
+            return None
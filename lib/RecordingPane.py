@@ -10,6 +10,7 @@ import tkinter.ttk as ttk
 import re
 
 DEFAULT_TEST_NAME = "GUI_TEST"
+STATUS_INTERVAL = 1000 # time (ms) between updates of the recording status label
 
 class RecordingPane(ttk.Frame):
     def __init__(self, mainframe, quail):
@@ -27,6 +28,10 @@ class RecordingPane(ttk.Frame):
         self.record_button_var.set("\u25B6 Start Recording")
         self.record_button = ttk.Button(self, textvariable = self.record_button_var, style = "White.TButton", command = self.start_recording)
         self.record_button.grid(row = 0, column = 2, sticky = 'nsew')
+        self.status_var = tk.StringVar() # shows write rate and backlog while recording
+        self.status_label = ttk.Label(self, textvariable = self.status_var)
+        self.status_label.grid(row = 0, column = 3, sticky = 'nsew')
+        self.status_job = None # id of the pending status update, if recording
 
         self.rowconfigure(0, weight = 1)
         self.columnconfigure(1, weight = 1)
@@ -36,9 +41,24 @@ class RecordingPane(ttk.Frame):
         self.testname_entry.configure(state = 'disabled')
         self.record_button_var.set("\u25A0 Stop Recording")
         self.record_button.configure(command = self.stop_recording, style = "Red.TButton")
+        self.update_status()
 
     def stop_recording(self):
+        if self.status_job is not None:
+            self.after_cancel(self.status_job)
+            self.status_job = None
         self.quail.stop_recording()
         self.testname_entry.configure(state = 'enabled')
         self.record_button_var.set("\u25B6 Start Recording")
-        self.record_button.configure(command = self.start_recording, style = "White.TButton")
\ No newline at end of file
+        self.record_button.configure(command = self.start_recording, style = "White.TButton")
+
+    def update_status(self):
+        ''' Shows the recording write rate, record queue backlog and any dropped blocks, then schedules the next update. '''
+        stats = self.quail.record_stats()
+        if stats is not None:
+            status = " {:.1f} kB/s | backlog {}".format(stats['bytes_per_sec']/1000, '?' if stats['backlog'] is None else stats['backlog'])
+            if stats['dropped'] > 0: # the recording has gaps, keep it in front of the operator
+                status += " | RECORDING INCOMPLETE, " + str(stats['dropped']) + " blocks dropped"
+            self.status_var.set(status)
+            self.status_label.configure(style = 'Red.TLabel' if stats['dropped'] > 0 else 'TLabel')
+        self.status_job = self.after(STATUS_INTERVAL, self.update_status)
@@ -0,0 +1,133 @@
+'''
+SampleBuffer:
+
+A fixed-capacity sample history that owns the time column and the channel columns used for plotting. Storage is
+preallocated once at twice the requested capacity; new rows are written after the newest row, and when the end of the
+storage is reached the retained rows are moved back to the start in a single copy. This keeps appends O(1) amortized
+(each row is copied at most once per capacity rows written) while every read is a contiguous numpy view, which is what
+matplotlib and the numpy reductions in the panes want.
+
+The time column is non-decreasing (Quail's clock only moves forward, and the plots are reset when it starts over), so the rows
+in a time window are found by binary search (index_range) instead of by walking the buffer, at a cost that does not grow with
+the number of rows on screen.
+
+For y-axis scaling, every SUMMARY_ROWS rows of storage also keep a per-channel min/max summary, updated as rows are appended.
+extrema() combines the summaries of the blocks fully inside a window with the few rows at its edges, so it reads about
+1/SUMMARY_ROWS of the rows a full scan would.
+'''
+
+import numpy as np
+
+SUMMARY_ROWS = 256 # rows of storage covered by each min/max summary block
+
+class SampleBuffer:
+    def __init__(self, capacity, num_channels):
+        self.capacity = int(capacity) # maximum number of rows retained, older rows are discarded first
+        self.num_channels = num_channels # number of channel columns
+        self._time = np.zeros((2*self.capacity, 1)) # backing storage for the time column
+        self._data = np.zeros((2*self.capacity, num_channels)) # backing storage for the channel columns
+        self._start = 0 # index of the oldest retained row in the backing storage
+        self._end = 0 # index one past the newest retained row in the backing storage
+        num_blocks = -(-2*self.capacity // SUMMARY_ROWS)
+        self._block_min = np.full((num_blocks, num_channels), np.inf) # per-channel minimum of each SUMMARY_ROWS block of storage
+        self._block_max = np.full((num_blocks, num_channels), -np.inf) # per-channel maximum of each block
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def time(self):
+        ''' Contiguous, read-only (n, 1) view of the retained time column, oldest first. '''
+        return self._read_only(self._time[self._start:self._end])
+
+    @property
+    def data(self):
+        ''' Contiguous, read-only (n, num_channels) view of the retained channel columns, oldest first. Data is only changed through
+            append and rescale, which keep the min/max summaries up to date. '''
+        return self._read_only(self._data[self._start:self._end])
+
+    @staticmethod
+    def _read_only(view):
+        view.flags.writeable = False
+        return view
+
+    def append(self, time_block, data_block):
+        ''' Appends a block of rows. time_block may be shaped (n,) or (n, 1); data_block must be (n, num_channels).
+            If the block is longer than the capacity, only its newest rows are kept. '''
+        time_block = np.asarray(time_block).reshape(-1)
+        data_block = np.asarray(data_block).reshape(-1, self.num_channels)
+        n = len(time_block)
+        if n == 0:
+            return
+        if n >= self.capacity: # block alone fills the buffer, keep only the newest rows
+            time_block = time_block[-self.capacity:]
+            data_block = data_block[-self.capacity:]
+            self._start = 0
+            self._end = self.capacity
+            self._time[:self.capacity, 0] = time_block
+            self._data[:self.capacity] = data_block
+            self._summarize(0, self.capacity)
+            return
+        if len(self) + n > self.capacity:
+            self._start = self._end + n - self.capacity # drop the oldest rows to make room
+        if self._end + n > 2*self.capacity: # out of room at the end of storage, move retained rows back to the start
+            kept = self._end - self._start
+            self._time[:kept] = self._time[self._start:self._end]
+            self._data[:kept] = self._data[self._start:self._end]
+            self._start = 0
+            self._end = kept
+            self._summarize(0, kept)
+        self._time[self._end:self._end + n, 0] = time_block
+        self._data[self._end:self._end + n] = data_block
+        self._end += n
+        self._summarize(self._end - n, self._end)
+
+    def _summarize(self, first, last):
+        ''' Recomputes the min/max summaries of the blocks holding storage rows first:last (only rows up to _end count). '''
+        b0, b1 = first//SUMMARY_ROWS, -(-last//SUMMARY_ROWS)
+        rows = self._data[b0*SUMMARY_ROWS:min(b1*SUMMARY_ROWS, self._end)]
+        starts = np.arange(0, len(rows), SUMMARY_ROWS)
+        self._block_min[b0:b0 + len(starts)] = np.minimum.reduceat(rows, starts, axis = 0)
+        self._block_max[b0:b0 + len(starts)] = np.maximum.reduceat(rows, starts, axis = 0)
+
+    def extrema(self, i0 = 0, i1 = None):
+        ''' Returns the per-channel (min, max) over rows i0:i1 of data, as two (num_channels,) arrays. The range must not be empty. '''
+        a = self._start + i0
+        b = self._end if i1 is None else self._start + i1
+        first_block, last_block = -(-a//SUMMARY_ROWS), b//SUMMARY_ROWS # blocks lying entirely inside the range
+        if first_block >= last_block:
+            rows = self._data[a:b]
+            return rows.min(axis = 0), rows.max(axis = 0)
+        low = self._block_min[first_block:last_block].min(axis = 0)
+        high = self._block_max[first_block:last_block].max(axis = 0)
+        for edge in (self._data[a:first_block*SUMMARY_ROWS], self._data[last_block*SUMMARY_ROWS:b]):
+            if len(edge):
+                low = np.minimum(low, edge.min(axis = 0))
+                high = np.maximum(high, edge.max(axis = 0))
+        return low, high
+
+    def index_range(self, t0 = -np.inf, t1 = np.inf):
+        ''' Returns (i0, i1) such that rows i0:i1 of time and data are the rows with t0 <= time <= t1. '''
+        times = self._time[self._start:self._end, 0]
+        return int(np.searchsorted(times, t0, side = 'left')), int(np.searchsorted(times, t1, side = 'right'))
+
+    def discard_before(self, t):
+        ''' Drops the rows older than t, always keeping the newest row. '''
+        self.discard(min(self.index_range(t)[0], len(self) - 1))
+
+    def discard(self, n):
+        ''' Drops the n oldest rows. '''
+        self._start = min(self._start + max(int(n), 0), self._end)
+
+    def rescale(self, scales, offsets):
+        ''' Replaces the retained data with data*scales + offsets (broadcast per channel, e.g. a unit conversion), and refreshes the
+            min/max summaries to match. '''
+        retained = self._data[self._start:self._end]
+        retained *= scales
+        retained += offsets
+        self._summarize(self._start, self._end)
+
+    def clear(self):
+        ''' Drops all rows. '''
+        self._start = 0
+        self._end = 0
@@ -0,0 +1,110 @@
+'''
+SharedRingBuffer:
+
+A single-producer, single-consumer ring of float rows that lives in a multiprocessing.shared_memory block, so the
+data process can hand samples to the GUI without pickling them or pushing them through a pipe. The block starts with
+a small int64 header followed by the (capacity, row_width) float64 data region:
+
+    [ write_count, read_count, seq, reset_count, reset_at ]
+
+write_count and read_count count rows ever written/read (the ring position is the count modulo capacity), seq counts
+published blocks and reset_count/reset_at mark where the producer asked the consumer to clear old data. The producer
+never waits on the consumer: if the consumer falls more than a full ring behind, the oldest rows are overwritten and
+counted as overruns when the consumer next reads. put_nowait instead refuses (raising queue.Full, as a full
+multiprocessing.Queue does) to write rows that would overwrite unread ones.
+
+The object mimics the parts of multiprocessing.Queue that the data process and GraphPanes use (put, get, empty), so it
+can stand in for quail's data_queue. Putting a non-array object (quail puts 0) signals a reset, which the consumer
+receives from get() as that same 0 before any newer rows.
+'''
+
+import queue
+import numpy as np
+from multiprocessing import shared_memory
+
+HEADER_LEN = 5 # number of int64 header fields
+WRITE, READ, SEQ, RESET_COUNT, RESET_AT = range(HEADER_LEN) # header field indices
+
+class SharedRingBuffer:
+    def __init__(self, capacity, row_width, name = None):
+        self.capacity = int(capacity) # number of rows the ring holds
+        self.row_width = int(row_width) # number of float64 values per row
+        self.owner = name is None # the creating process is responsible for unlinking the shared memory
+        size = 8*(HEADER_LEN + self.capacity*self.row_width)
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create = True, size = size)
+        else:
+            self.shm = shared_memory.SharedMemory(name = name) # child processes share the owner's resource tracker, so this does not re-register the block
+        self._attach()
+        if self.owner:
+            self.header[:] = 0
+
+    def _attach(self):
+        self.header = np.ndarray((HEADER_LEN,), dtype = np.int64, buffer = self.shm.buf)
+        self.rows = np.ndarray((self.capacity, self.row_width), dtype = np.float64, buffer = self.shm.buf, offset = 8*HEADER_LEN)
+        self.last_reset = self.header[RESET_COUNT] # consumer-side copy of the last reset_count seen
+        self.overruns = 0 # consumer-side count of rows overwritten before they could be read
+
+    def __getstate__(self):
+        return self.shm.name, self.capacity, self.row_width
+
+    def __setstate__(self, state):
+        name, capacity, row_width = state
+        self.__init__(capacity, row_width, name = name)
+
+    def put(self, block):
+        ''' Producer side. Writes a (n, row_width) block of rows into the ring, or signals a reset if block is not an array. '''
+        if not isinstance(block, np.ndarray):
+            self.header[RESET_AT] = self.header[WRITE]
+            self.header[RESET_COUNT] += 1
+            return
+        block = block.reshape(-1, self.row_width)[-self.capacity:]
+        n = len(block)
+        start = int(self.header[WRITE]) % self.capacity
+        first = min(n, self.capacity - start) # rows written before wrapping around to the start of the ring
+        self.rows[start:start + first] = block[:first]
+        self.rows[:n - first] = block[first:]
+        self.header[WRITE] += n # publish the rows only after they have been written
+        self.header[SEQ] += 1
+
+    def put_nowait(self, block):
+        ''' Producer side. Like put, but raises queue.Full rather than overwrite rows the consumer has not read yet. '''
+        if isinstance(block, np.ndarray) and self.header[WRITE] - self.header[READ] + len(block.reshape(-1, self.row_width)) > self.capacity:
+            raise queue.Full
+        self.put(block)
+
+    def empty(self):
+        ''' Consumer side. Returns True if there are no unread rows and no pending reset. '''
+        return self.header[WRITE] == self.header[READ] and self.header[RESET_COUNT] == self.last_reset
+
+    def get(self):
+        ''' Consumer side. Returns 0 if a reset is pending, otherwise a copy of every unread row as one (n, row_width) array. '''
+        if self.header[RESET_COUNT] != self.last_reset:
+            self.last_reset = self.header[RESET_COUNT]
+            self.header[READ] = max(self.header[READ], self.header[RESET_AT]) # rows before the reset belong to the old connection
+            return 0
+        write = int(self.header[WRITE])
+        read = int(self.header[READ])
+        if write - read > self.capacity: # the producer lapped us, skip to the oldest row still in the ring
+            self.overruns += write - read - self.capacity
+            read = write - self.capacity
+        start = read % self.capacity
+        stop = start + (write - read)
+        if stop <= self.capacity:
+            block = self.rows[start:stop].copy()
+        else:
+            block = np.concatenate((self.rows[start:], self.rows[:stop - self.capacity]), axis = 0)
+        lapped = int(self.header[WRITE]) - self.capacity - read # rows overwritten by the producer while we were copying
+        if lapped > 0:
+            self.overruns += lapped
+            block = block[lapped:]
+        self.header[READ] = write
+        return block
+
+    def close(self):
+        ''' Releases this process's mapping, and frees the shared memory if this process created it. '''
+        self.header = None
+        self.rows = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
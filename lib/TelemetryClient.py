@@ -0,0 +1,197 @@
+'''
+TelemetryClient:
+
+A viewer of the blocks published by another dashboard's or QuailDaemon's data process (see TelemetryServer.py), for use in place
+of quail (MainWindow.QUAIL_SUBSCRIBE). Its data process reads the published stream from the socket instead of Quail's serial port
+and hands the blocks to GraphPanes through the same bounded display path, so the dashboard runs unchanged, and a viewer can make
+its own recording of what it receives.
+
+The viewer is read-only: commands are only ever written by the process that owns the serial port, so write_command refuses them.
+Samples the publisher dropped from this viewer's buffer are added to display_coalesced. If the publisher goes away, the viewer
+keeps reconnecting every RECONNECT_INTERVAL seconds, and clears its plots when it is back.
+
+The publisher's header sizes the viewer's plots, so the viewer cannot start without it: a viewer started before its publisher
+retries every RECONNECT_INTERVAL for up to STARTUP_TIMEOUT seconds, then fails with a ConnectionError saying what it waited for.
+'''
+
+import json
+import multiprocessing as mp
+import select
+import socket
+import threading
+import time
+import numpy as np
+
+import lib.TelemetryServer as server
+from lib.quail_serial import quail, format_lines, DISPLAY_POLICY, DISPLAY_QUEUE_MAXSIZE, RECORD_QUEUE_MAXSIZE, RECORD_FORMAT, \
+    RECORD_FLUSH_INTERVAL, RECORD_FSYNC_INTERVAL, SHM_RING_CAPACITY, WORKER_POLL_TIMEOUT
+from lib.SharedRingBuffer import SharedRingBuffer
+from lib.ChannelSchema import ChannelSchema
+
+RECONNECT_INTERVAL = 1.0 # time (sec) between attempts to reach a publisher that is not there
+CONNECT_TIMEOUT = 5.0 # maximum time (sec) to wait for the publisher's header when connecting
+STARTUP_TIMEOUT = 30.0 # maximum time (sec) a new viewer waits for its publisher to appear
+RECV_SIZE = 1 << 20 # maximum number of bytes read from the socket at once
+STATES = ['disconnected', 'connected'] # values of the shared connection state, by index
+
+def subscribe(address, policy = server.DEFAULT_POLICY, history = server.HISTORY_SECONDS):
+    ''' Connects to a publisher and sends the subscription request. Returns the socket and the header message's fields, along with
+        any bytes received after the header. Raises OSError if the publisher cannot be reached or sends no header in time. '''
+    family, address = server.parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(address)
+        sock.sendall((json.dumps({'policy': policy, 'history': history}) + '\n').encode())
+        received = bytearray()
+        while True:
+            data = sock.recv(RECV_SIZE)
+            if not data:
+                raise ConnectionError("publisher closed the connection before sending its header")
+            received += data
+            messages = server.decode(received)
+            if messages:
+                break
+        kind, payload = messages[0]
+        if kind != server.MSG_HEADER:
+            raise ConnectionError("publisher did not start with a header")
+        rest = bytearray().join(server.encode(kind, payload) for kind, payload in messages[1:]) + received # put back what follows the header
+        sock.settimeout(None)
+        return sock, json.loads(payload), rest
+    except OSError:
+        sock.close()
+        raise
+    except ValueError as error: # the header was not valid JSON
+        sock.close()
+        raise ConnectionError("publisher sent an invalid header") from error
+
+def wait_for_publisher(address, policy = server.DEFAULT_POLICY, history = server.HISTORY_SECONDS, timeout = STARTUP_TIMEOUT):
+    ''' Subscribes like subscribe(), retrying every RECONNECT_INTERVAL while the publisher cannot be reached. Raises ConnectionError
+        if it still cannot be reached after timeout seconds. '''
+    deadline = time.perf_counter() + timeout
+    waiting = False # True once the first attempt has failed
+    while True:
+        try:
+            return subscribe(address, policy, history)
+        except OSError as error:
+            if time.perf_counter() + RECONNECT_INTERVAL > deadline:
+                raise ConnectionError("no Quail publisher at " + address + " after " + str(timeout) + " s (" + str(error) +
+                                      "), start the publishing dashboard or QuailDaemon --publish first") from error
+            if not waiting:
+                print("Waiting up to " + str(timeout) + " s for a Quail publisher at " + address + " (" + str(error) + ")")
+                waiting = True
+            time.sleep(RECONNECT_INTERVAL)
+
+class TelemetryClient(quail):
+    def __init__(self, mainwindow, address, policy=server.DEFAULT_POLICY, history=server.HISTORY_SECONDS, transport='queue', display_policy=DISPLAY_POLICY):
+        self.address = address # publisher's address, see TelemetryServer.parse_address
+        self.policy = policy # drop policy asked of the publisher
+        self.history = history # seconds of history asked for when (re)connecting
+        self.sock, header, self.received = wait_for_publisher(address, policy, history) # the publisher's schema sizes everything below
+        if mainwindow is not None:
+            mainwindow.title("Quail Dashboard | Viewing " + address)
+
+        # Initialize unpickled variables (anything the data process doesn't use)
+        self.mainwindow = mainwindow
+        self.serial = None # a viewer has no serial port
+        self.filename = None # string name/filepath of file to which recorded data should be stored
+        self.record_writer = None # the RecordWriter used by the current/last recording
+        self.record_flush_interval = RECORD_FLUSH_INTERVAL # passed to the RecordWriter, see RecordWriter.py
+        self.record_fsync_interval = RECORD_FSYNC_INTERVAL # passed to the RecordWriter, see RecordWriter.py
+        self.trace_queue = None # latency is traced by the publisher, not the viewer
+
+        # Initialize pickled variables (things the data process uses)
+        self.schema = ChannelSchema(header['names'], header['units']) # the publisher's channels
+        self.num_data_channels = len(self.schema) # number of data channels
+        self.record_format = RECORD_FORMAT # format of record files, 'csv' or 'columnar'
+        self.kill = mp.Event() # flag indicating if the data process is to be terminated (if set, kill process)
+        self.recording = mp.Event() # flag indicating whether to record data recieved (if set, record)
+        self.record_queue = mp.Queue(maxsize=RECORD_QUEUE_MAXSIZE) # queue to which the data process pushes and from which the record_thread reads
+        self.record_dropped = mp.Value('l', 0) # number of blocks the data process could not record because the record queue was full
+        self.samples_lost = mp.Value('l', 0) # the publisher's serial losses are not sent, so this stays zero
+        if transport == 'shm':
+            self.data_queue = SharedRingBuffer(SHM_RING_CAPACITY, 1 + self.num_data_channels + 1) # shared-memory ring of received rows
+        else:
+            self.data_queue = mp.Queue(maxsize=DISPLAY_QUEUE_MAXSIZE) # queue of received (n, time + channels + last_command) blocks
+        self.transport = transport # 'queue' or 'shm', see quail
+        self.display_policy = display_policy # how samples held back from a GUI that has fallen behind are reduced
+        self.display_coalesced = mp.Value('l', 0) # samples removed from the display path, here or by the publisher's drop policy
+        self.state = mp.Value('i', STATES.index('connected')) # index into STATES
+
+        # Create processes/threads (does not start the process/thread)
+        self.data_process = mp.Process(name = "Quail_ViewerThread", target = self.data_worker)
+        self.record_thread = threading.Thread(name = "Quail_RecordThread", target = self.record_worker)
+
+    def __getstate__(self):
+        return self.address, self.policy, self.history, self.sock, self.received, self.schema, self.num_data_channels, self.record_format, self.kill, self.recording, self.record_queue, self.record_dropped, self.samples_lost, self.data_queue, self.display_policy, self.display_coalesced, self.state
+
+    def __setstate__(self, state):
+        self.address, self.policy, self.history, self.sock, self.received, self.schema, self.num_data_channels, self.record_format, self.kill, self.recording, self.record_queue, self.record_dropped, self.samples_lost, self.data_queue, self.display_policy, self.display_coalesced, self.state = state
+
+    def stop_collection(self):
+        super().stop_collection()
+        if self.sock is not None:
+            self.sock.close() # the data process has its own copy, this one was only kept to hand over
+
+    def data_worker(self):
+        sock, received = self.sock, self.received # connection made in the GUI process, with anything received after the header
+        width = 1 + self.num_data_channels + 1
+        display_backlog = None # samples held back because the GUI has fallen behind, sent ahead of the next block
+        while not self.kill.is_set():
+            if sock is None: # reconnect, then start over with a cleared plot
+                try:
+                    sock, header, received = subscribe(self.address, self.policy, self.history)
+                except OSError:
+                    self.kill.wait(RECONNECT_INTERVAL)
+                    continue
+                if header['width'] != width:
+                    print("Publisher at " + self.address + " now sends " + str(header['width'] - 2) + " channels, not " + str(width - 2))
+                    sock.close()
+                    sock = None
+                    self.kill.wait(RECONNECT_INTERVAL)
+                    continue
+                self.state.value = STATES.index('connected')
+                display_backlog = None
+                self.request_reset() # the GUI should clear old data
+
+            messages = server.decode(received) # the header may have arrived with complete messages behind it
+            if not messages and select.select([sock], [], [], WORKER_POLL_TIMEOUT)[0]:
+                try:
+                    data = sock.recv(RECV_SIZE)
+                except OSError:
+                    data = b''
+                if not data: # the publisher has gone away
+                    sock.close()
+                    sock = None
+                    self.state.value = STATES.index('disconnected')
+                    continue
+                received += data
+                messages = server.decode(received)
+
+            blocks = []
+            for kind, payload in messages:
+                if kind == server.MSG_BLOCK:
+                    blocks.append(np.frombuffer(payload, dtype = '<f8').reshape(-1, width))
+                elif kind == server.MSG_DROPPED:
+                    self.display_coalesced.value += server.DROPPED.unpack(payload)[0]
+                elif kind == server.MSG_RESET:
+                    blocks, display_backlog = [], None
+                    self.request_reset()
+            if blocks:
+                block = np.concatenate(blocks, axis = 0)
+                display_backlog = self.put_display(block if display_backlog is None else np.concatenate((display_backlog, block), axis = 0))
+                if self.recording.is_set():
+                    self.put_record(block, format_lines(block) if self.record_format == 'csv' else None)
+            elif display_backlog is not None or self.reset_pending:
+                display_backlog = self.put_display(display_backlog) # nothing new to send, retry the held-back samples alone
+        if sock is not None:
+            sock.close()
+
+    def connection_status(self):
+        return ("viewing " if STATES[self.state.value] == 'connected' else "waiting for ") + self.address
+
+    def write_command(self, command):
+        print("Viewer of " + self.address + " is read-only, command " + str(command) + " not sent")
+
+    def set_COM_port(self):
+        print("Viewer of " + self.address + " has no COM Port, change it on the publishing dashboard")
@@ -0,0 +1,275 @@
+'''
+TelemetryServer:
+
+Publishes the blocks parsed by a data process to any number of local subscribers over a Unix-domain or TCP socket, so extra
+viewers (a second dashboard, see TelemetryClient.py, or an analysis notebook) can share the one process that owns Quail's serial
+port. quail starts one in its data process when given a publish address.
+
+publish() never blocks acquisition: every subscriber has its own buffer of at most max_blocks blocks, filled by publish() and
+emptied by a server thread that writes to the subscriber's socket without blocking. When a subscriber's buffer is full, its drop
+policy decides what happens:
+
+    oldest     : the oldest buffered block is dropped to make room (the subscriber sees the newest data, with gaps)
+    newest     : the new block is dropped (the subscriber sees older data without gaps, until it catches up)
+    disconnect : the subscriber is disconnected
+
+Dropped samples are reported to the subscriber ahead of its next block. The server also keeps the last history seconds of blocks,
+which a new subscriber receives first so it starts with a full plot.
+
+Protocol: a subscriber connects and sends one JSON line, {"policy": "oldest", "history": 10.0} (both optional, anything missing or
+invalid falls back to the default). The server then sends messages of a 1-byte type and a 4-byte little-endian payload length,
+followed by the payload:
+
+    H : header, JSON {"names", "units", "width"}, sent first
+    B : block of rows (time, channels..., last_command) as little-endian float64, width values per row
+    R : reset, the publisher connected to a new serial port and earlier data should be cleared
+    D : number of samples dropped from this subscriber's buffer since the last D (little-endian uint64)
+'''
+
+import collections
+import json
+import os
+import selectors
+import socket
+import struct
+import threading
+
+MSG_HEADER = b'H' # message types, see above
+MSG_BLOCK = b'B'
+MSG_RESET = b'R'
+MSG_DROPPED = b'D'
+PREFIX = struct.Struct('<cI') # message type and payload length
+DROPPED = struct.Struct('<Q') # payload of a D message
+POLICIES = ['oldest', 'newest', 'disconnect'] # drop policies a subscriber may ask for
+DEFAULT_POLICY = 'oldest' # drop policy of subscribers that do not ask for one
+HISTORY_SECONDS = 10.0 # seconds of data kept for, and sent to, new subscribers
+SUBSCRIBER_MAX_BLOCKS = 256 # maximum number of blocks buffered for each subscriber
+MAX_REQUEST_LENGTH = 4096 # maximum length of a subscription request line
+SEND_SIZE = 1 << 16 # maximum number of bytes written to a subscriber at once
+
+def parse_address(address):
+    ''' Returns (socket family, address) for a publish address: 'host:port' (or ':port' for localhost) is TCP, anything else is the
+        path of a Unix-domain socket. '''
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit() and '/' not in address:
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+def encode(kind, payload = b''):
+    ''' Returns a message of the given type and payload, see above. '''
+    return PREFIX.pack(kind, len(payload)) + payload
+
+def decode(buffer):
+    ''' Removes the complete messages at the start of a bytearray and returns them as a list of (type, payload). '''
+    messages = []
+    start = 0
+    while len(buffer) - start >= PREFIX.size:
+        kind, length = PREFIX.unpack_from(buffer, start)
+        end = start + PREFIX.size + length
+        if len(buffer) < end:
+            break
+        messages.append((kind, bytes(buffer[start + PREFIX.size:end])))
+        start = end
+    del buffer[:start]
+    return messages
+
+class Subscriber:
+    def __init__(self, sock):
+        self.sock = sock
+        self.request = bytearray() # subscription request received so far
+        self.subscribed = False # True once the request has been answered
+        self.policy = DEFAULT_POLICY # drop policy, see above
+        self.pending = collections.deque() # (number of rows, message) of the blocks waiting to be sent
+        self.outgoing = bytearray() # bytes of the messages being sent
+        self.dropped = 0 # samples dropped since the last D message
+        self.closing = False # True once the subscriber is to be disconnected
+
+class TelemetryServer:
+    def __init__(self, address, schema, history = HISTORY_SECONDS, max_blocks = SUBSCRIBER_MAX_BLOCKS):
+        self.address = address # publish address, see parse_address
+        self.header = encode(MSG_HEADER, json.dumps({'names': schema.names, 'units': schema.units, 'width': 1 + len(schema) + 1}).encode())
+        self.history_seconds = history
+        self.max_blocks = max_blocks
+        self.history = collections.deque() # (time of last row, number of rows, message) of the last history seconds of blocks
+        self.subscribers = {} # socket -> Subscriber
+        self.lock = threading.Lock() # guards history and the subscribers' buffers, shared by publish() and the server thread
+        self.running = False
+
+    def start(self):
+        ''' Opens the listening socket and starts the server thread. '''
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.unlink(address) # left behind by a publisher that did not shut down cleanly
+        self.server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen()
+        self.server.setblocking(False)
+        self.wake_reader, self.wake_writer = socket.socketpair() # publish() writes a byte here to wake the server thread
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+        self.running = True
+        self.thread = threading.Thread(name = "Quail_PublishThread", target = self.run, daemon = True)
+        self.thread.start()
+
+    def publish(self, block):
+        ''' Hands a block of rows (time, channels, last_command) to every subscriber. Never blocks on a subscriber. '''
+        message = encode(MSG_BLOCK, block.astype('<f8', copy = False).tobytes())
+        with self.lock:
+            self.history.append((block[-1, 0], len(block), message))
+            while self.history[0][0] < block[-1, 0] - self.history_seconds:
+                self.history.popleft()
+            for subscriber in list(self.subscribers.values()):
+                if subscriber.subscribed:
+                    self.enqueue(subscriber, len(block), message)
+        self.wake()
+
+    def reset(self):
+        ''' Tells every subscriber to clear its data (the publisher connected to a new serial port). '''
+        with self.lock:
+            self.history.clear()
+            for subscriber in self.subscribers.values():
+                if subscriber.subscribed:
+                    subscriber.pending.append((0, encode(MSG_RESET)))
+        self.wake()
+
+    def enqueue(self, subscriber, rows, message):
+        ''' Adds a block to a subscriber's buffer, applying its drop policy if the buffer is full (call with the lock held). '''
+        if len(subscriber.pending) >= self.max_blocks:
+            if subscriber.policy == 'disconnect':
+                subscriber.closing = True # dropped by the server thread
+                subscriber.pending.clear()
+                return
+            if subscriber.policy == 'newest':
+                subscriber.dropped += rows
+                return
+            subscriber.dropped += subscriber.pending.popleft()[0]
+        subscriber.pending.append((rows, message))
+
+    def wake(self):
+        try:
+            self.wake_writer.send(b'\0')
+        except BlockingIOError:
+            pass # the server thread already has a wake-up waiting
+
+    def run(self):
+        ''' Server thread: accepts subscribers, reads their requests and writes their buffered blocks. '''
+        while self.running:
+            with self.lock:
+                for subscriber in [subscriber for subscriber in self.subscribers.values() if subscriber.closing]:
+                    self.selector.unregister(subscriber.sock)
+                    self.drop(subscriber)
+                for subscriber in self.subscribers.values():
+                    waiting = subscriber.outgoing or subscriber.pending
+                    self.selector.modify(subscriber.sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if waiting else 0))
+            for key, mask in self.selector.select():
+                if key.fileobj is self.server:
+                    self.accept()
+                elif key.fileobj is self.wake_reader:
+                    try:
+                        while self.wake_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    subscriber = self.subscribers.get(key.fileobj)
+                    if subscriber is not None and mask & selectors.EVENT_READ:
+                        self.receive(subscriber)
+                    if subscriber is not None and subscriber.sock in self.subscribers and mask & selectors.EVENT_WRITE:
+                        self.send(subscriber)
+
+    def accept(self):
+        try:
+            sock, _ = self.server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        with self.lock:
+            self.subscribers[sock] = Subscriber(sock)
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def receive(self, subscriber):
+        ''' Reads a subscriber's request; once it is complete, queues the header and the requested history. '''
+        try:
+            data = subscriber.sock.recv(MAX_REQUEST_LENGTH)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            with self.lock:
+                self.selector.unregister(subscriber.sock)
+                self.drop(subscriber)
+            return
+        if subscriber.subscribed:
+            return # nothing more is expected from a subscriber
+        subscriber.request += data
+        if b'\n' not in subscriber.request:
+            if len(subscriber.request) > MAX_REQUEST_LENGTH:
+                with self.lock:
+                    self.selector.unregister(subscriber.sock)
+                    self.drop(subscriber)
+            return
+        try:
+            request = json.loads(subscriber.request[:subscriber.request.find(b'\n')] or b'{}')
+        except (ValueError, RecursionError):
+            request = {}
+        if not isinstance(request, dict):
+            request = {} # e.g. a bare number or list, use the defaults
+        policy = request.get('policy', DEFAULT_POLICY)
+        try:
+            history = float(request.get('history', self.history_seconds))
+        except (TypeError, ValueError):
+            history = self.history_seconds
+        with self.lock:
+            subscriber.policy = policy if policy in POLICIES else DEFAULT_POLICY
+            subscriber.outgoing += self.header
+            if self.history and history > 0:
+                for rows, message in [(rows, message) for last_time, rows, message in self.history if last_time >= self.history[-1][0] - history][-self.max_blocks:]:
+                    subscriber.pending.append((rows, message))
+            subscriber.subscribed = True
+
+    def send(self, subscriber):
+        ''' Writes as much of a subscriber's buffered messages as its socket takes without blocking. '''
+        with self.lock:
+            while len(subscriber.outgoing) < SEND_SIZE and subscriber.pending:
+                if subscriber.dropped:
+                    subscriber.outgoing += encode(MSG_DROPPED, DROPPED.pack(subscriber.dropped))
+                    subscriber.dropped = 0
+                subscriber.outgoing += subscriber.pending.popleft()[1]
+        try:
+            sent = subscriber.sock.send(subscriber.outgoing)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            with self.lock:
+                self.selector.unregister(subscriber.sock)
+                self.drop(subscriber)
+            return
+        del subscriber.outgoing[:sent]
+
+    def drop(self, subscriber):
+        ''' Forgets a subscriber and closes its socket (call with the lock held, after unregistering it). '''
+        self.subscribers.pop(subscriber.sock, None)
+        subscriber.sock.close()
+
+    def close(self):
+        ''' Stops the server thread and closes every socket. '''
+        self.running = False
+        self.wake()
+        self.thread.join()
+        with self.lock:
+            for subscriber in list(self.subscribers.values()):
+                self.selector.unregister(subscriber.sock)
+                self.drop(subscriber)
+        self.selector.close()
+        self.server.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.unlink(address)
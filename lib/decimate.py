@@ -0,0 +1,69 @@
+'''
+decimate:
+
+Reduces blocks of Quail rows (time, channels..., last_command) to fewer rows for display, without Python loops over rows
+or channels. Used by the data process to shrink the display backlog when the GUI falls behind (see quail.put_display), and
+by the plots to draw no more points than the axes have pixels (see GraphPanes.plot_rows); recorded data is never decimated.
+
+    latest(rows, max_rows) : keeps only the newest max_rows rows
+    minmax(rows, max_rows) : keeps the newest half of max_rows at full resolution and replaces everything older with a
+                             min row and a max row per bucket, so every channel's envelope (including short spikes) survives
+    m4(times, values, bin_width) : picks the first, min, max and last row of each channel in every pixel column (M4 decimation),
+                                   which rasterizes to the same line as every row does
+'''
+
+import numpy as np
+
+POLICIES = ['latest', 'minmax'] # display policies understood by reduce
+
+def latest(rows, max_rows):
+    ''' Returns the newest max_rows rows. '''
+    return rows[-max_rows:]
+
+def minmax(rows, max_rows):
+    ''' Returns at most max_rows rows: the newest max_rows//2 rows unchanged, preceded by min/max pairs covering the older rows.
+        Each pair spans one bucket of consecutive older rows: the first row holds every channel's minimum over the bucket (at the
+        bucket's first time), the second every channel's maximum (at its last time). last_command is taken from the bucket's last row. '''
+    if len(rows) <= max_rows:
+        return rows
+    recent = max_rows//2
+    older = rows[:len(rows) - recent]
+    num_buckets = min((max_rows - recent)//2, len(older))
+    starts = np.linspace(0, len(older), num_buckets + 1).astype(np.int64)
+    first, last = starts[:-1], starts[1:] - 1
+    pairs = np.empty((num_buckets, 2, rows.shape[1]))
+    pairs[:, 0, 0] = older[first, 0]
+    pairs[:, 1, 0] = older[last, 0]
+    pairs[:, 0, 1:-1] = np.minimum.reduceat(older[:, 1:-1], first, axis = 0)
+    pairs[:, 1, 1:-1] = np.maximum.reduceat(older[:, 1:-1], first, axis = 0)
+    pairs[:, :, -1] = older[last, -1][:, None]
+    return np.concatenate((pairs.reshape(-1, rows.shape[1]), rows[len(rows) - recent:]), axis = 0)
+
+def m4(times, values, bin_width):
+    ''' Returns the indices of the rows to draw for each column of values, shaped (m, num_columns): the first, min, max and last
+        row in every bin_width of time (one pixel column), in time order. times must be sorted. Bins are aligned to multiples of
+        bin_width, so they do not shift as the plot scrolls. If there are no more than 4 rows per bin, every row is returned. '''
+    n = len(times)
+    bins = np.floor(times / bin_width).astype(np.int64)
+    starts = np.flatnonzero(np.diff(bins, prepend = bins[0] - 1)) if n else np.zeros(0, dtype = np.int64)
+    if n <= 4*len(starts):
+        return np.broadcast_to(np.arange(n)[:, None], (n, values.shape[1]))
+    ends = np.append(starts[1:], n) - 1
+    bucket = np.repeat(np.arange(len(starts)), ends - starts + 1) # bin number of every row
+    index = np.arange(n)[:, None]
+    extremes = []
+    for extreme in (np.minimum, np.maximum):
+        hits = values == extreme.reduceat(values, starts, axis = 0)[bucket] # rows holding their bin's min (or max)
+        first_hit = np.minimum.reduceat(np.where(hits, index, n), starts, axis = 0)
+        extremes.append(np.minimum(first_hit, ends[:, None])) # a bin of NaNs has no hit, fall back to its last row
+    picks = np.stack((np.broadcast_to(starts[:, None], extremes[0].shape), extremes[0], extremes[1], np.broadcast_to(ends[:, None], extremes[0].shape)), axis = 1)
+    picks.sort(axis = 1) # min and max in time order
+    return picks.reshape(-1, values.shape[1])
+
+def reduce(rows, max_rows, policy):
+    ''' Reduces rows to at most max_rows rows with the given policy (one of POLICIES). '''
+    if len(rows) <= max_rows:
+        return rows
+    if policy == 'minmax':
+        return minmax(rows, max_rows)
+    return latest(rows, max_rows)
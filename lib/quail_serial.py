@@ -4,7 +4,11 @@ Module for talking to quail.  Sends and receives information.
 
 Current structure assumes data sent over serial in the following CSV format:
 
-time, CH1, CH2, CH3, CH4, CH5, CH6, last_command, zerocheck
+time, CH1, CH2, ..., CHn, last_command, zerocheck
+
+where the channels are described by a channel schema (see lib/ChannelSchema.py, six pressure/load channels by default)
+
+or, with protocol='binary', as the CRC-checked binary frames described in lib/telemetry_frames.py.
 
 Luke Upton + Max Newport
 Oct 2020
@@ -16,16 +20,190 @@ Oct 2020
 import serial
 import threading
 import multiprocessing as mp
-import tkinter.simpledialog as dialog
+import queue
 import numpy as np
 import sys, os
+import time
 from datetime import datetime
-from lib.QuailEmulator import QuailEmulator
+from lib.ConnectionManager import ConnectionManager, port_name, is_emulator_port
+from lib.SharedRingBuffer import SharedRingBuffer
+from lib.TelemetryServer import TelemetryServer
+from lib.RecordWriter import RecordWriter
+from lib.ColumnarRecording import ColumnarRecordWriter, column_names
+import lib.ChannelSchema as ChannelSchema
+import lib.telemetry_frames as frames
+import lib.decimate as decimate
 
 QUAIL_TIMEOUT = 0.1 # duration of time before readline() gives up
-QUAIL_NUM_ELEMENTS = 1 + 6 + 1 + 1 # number of comma-delimited items expected on serial line (time, 6 data channels, last command, zerocheck)
+BLOCK_MAX_ROWS = 256 # maximum number of samples gathered into one block before it is sent to the GUI
+BLOCK_MAX_AGE = 0.01 # maximum time (sec) the oldest sample in a block may wait before the block is sent to the GUI
+WORKER_POLL_TIMEOUT = 0.1 # maximum time (sec) the cmd worker blocks on its queue before re-checking for shutdown
+RECORD_QUEUE_MAXSIZE = 4096 # maximum number of blocks waiting to be written to the record file
+RECORD_PUT_TIMEOUT = 2.0 # maximum time (sec) the data process waits for room in a full record queue before it drops a block
+RECORD_FLUSH_INTERVAL = 1.0 # time (sec) between flushes of the record file's write buffer
+RECORD_FSYNC_INTERVAL = None # time (sec) between os.fsync calls on the record file, or None to leave syncing to the OS
+RECORD_FORMAT = 'csv' # format of record files: 'csv' (raw serial text, .txt) or 'columnar' (typed, indexed columns, .qcol - see ColumnarRecording.py)
+SHM_RING_CAPACITY = 2**16 # number of samples held by the shared-memory ring when the 'shm' transport is used
+DISPLAY_QUEUE_MAXSIZE = 64 # maximum number of blocks waiting in the data queue for the GUI ('queue' transport)
+DISPLAY_BACKLOG_ROWS = 4096 # maximum number of samples the data process holds back for the GUI while the data queue is full
+DISPLAY_POLICY = 'minmax' # how the held-back samples are reduced: 'latest' (drop the oldest) or 'minmax' (min/max-decimate the oldest), see decimate.py
+
+class LineParser:
+    ''' Bulk parser for Quail's CSV serial output. Raw bytes read from the serial port are fed in as they arrive; complete lines are
+        split out and converted to floats in one vectorized step, and any partial line at the end of a read is carried over to the next
+        feed. Lines that are rejected are counted by reason in self.rejected:
+            field_count : the line did not have num_elements comma-delimited items
+            parse       : an item could not be converted to a float
+            zerocheck   : the last item on the line was not zero
+        Header lines (see ChannelSchema.is_header) are not data and are not counted; the last one seen is kept in self.header. '''
+    def __init__(self, num_elements, columns = None):
+        self.num_elements = num_elements # number of comma-delimited items expected on each line, including the zerocheck
+        self.columns = columns # indices of the items kept from each line (zerocheck removed), or None to keep them all, see ChannelSchema.columns
+        self.pending = bytearray() # bytes received after the last complete line, reused between reads
+        self.rejected = {'field_count': 0, 'parse': 0, 'zerocheck': 0} # number of lines rejected, by reason
+        self.header = None # the last header line received, if any
+        self.num_outputs = num_elements - 1 if columns is None else len(columns) # number of columns of each returned sample
+
+    def _count_headers(self, lines):
+        ''' Returns the number of header lines among lines that were not data, remembering the last one. '''
+        headers = [line for line in lines if ChannelSchema.is_header(line)]
+        if headers:
+            self.header = headers[-1]
+        return len(headers)
+
+    def feed(self, chunk):
+        ''' Adds a chunk of raw serial bytes. Returns an (n, num_outputs) array of the accepted samples (zerocheck removed, columns
+            picked), along with the raw accepted lines joined into one newline-terminated string for recording. '''
+        self.pending += chunk
+        end = self.pending.rfind(b'\n') + 1
+        if end == 0:
+            return np.empty((0, self.num_outputs)), '' # no complete line yet
+        lines = bytes(self.pending[:end]).split(b'\n')
+        del self.pending[:end]
+
+        lines = [line.strip(b"\r, ") for line in lines]
+        lines = [line for line in lines if line]
+        good = [line for line in lines if line.count(b',') == self.num_elements - 1]
+        if len(good) < len(lines):
+            headers = self._count_headers([line for line in lines if line.count(b',') != self.num_elements - 1])
+            self.rejected['field_count'] += len(lines) - len(good) - headers
+        if not good:
+            return np.empty((0, self.num_outputs)), ''
+        try:
+            values = np.array(b','.join(good).split(b',')).astype(np.float64).reshape(-1, self.num_elements)
+        except ValueError: # at least one line is garbled, fall back to converting line by line to find which
+            parsed = []
+            for line in good:
+                try:
+                    parsed.append(np.array(line.split(b',')).astype(np.float64))
+                except ValueError:
+                    parsed.append(None)
+            self.rejected['parse'] += sum(row is None for row in parsed) - self._count_headers([line for line, row in zip(good, parsed) if row is None])
+            good = [line for line, row in zip(good, parsed) if row is not None]
+            values = np.asarray([row for row in parsed if row is not None]).reshape(-1, self.num_elements)
+
+        zero_ok = values[:, -1] == 0 # confirm the last item on each line is zero before keeping data
+        self.rejected['zerocheck'] += len(values) - np.count_nonzero(zero_ok)
+        if not zero_ok.all():
+            good = [line for line, ok in zip(good, zero_ok) if ok]
+            values = values[zero_ok]
+        raw = (b'\n'.join(good) + b'\n').decode(errors = 'replace') if good else ''
+        if self.columns is not None:
+            return values[:, self.columns], raw
+        return values[:, :-1], raw
+
+    def lost(self):
+        ''' Returns the number of samples lost so far (every rejected line is a lost sample). '''
+        return sum(self.rejected.values())
+
+    def report(self):
+        ''' Returns a one-line summary of the rejected line counts. '''
+        return "Rejected lines: " + ", ".join(reason + " = " + str(count) for reason, count in self.rejected.items())
+
+class FrameParser:
+    ''' Bulk parser for Quail's binary frames (see lib/telemetry_frames.py), with the same feed/report interface as LineParser.
+        Every sync word in the received bytes is checked at once: candidate frames are gathered into a 2D byte array, their length
+        fields and CRCs are verified column by column for all frames together, and the valid ones are viewed through the frame dtype.
+        Bytes after the last complete frame are carried over to the next feed. Problems are counted by reason in self.rejected:
+            crc     : a frame with the right sync word and length failed its CRC
+            resync  : bytes that were skipped because they did not belong to a valid frame
+            dropped : frames missing from the sequence numbers
+        channels is the number of float32 channels in each frame, or a list of their wire dtypes (see ChannelSchema.wire_dtypes). '''
+    def __init__(self, channels, columns = None):
+        self.dtype = frames.frame_dtype(channels)
+        self.num_channels = self.dtype['channels'].shape[0] if self.dtype['channels'].names is None else len(self.dtype['channels'].names) # number of data channels carried in each frame
+        self.columns = columns # indices of the columns (time, channels, last_command) kept from each frame, or None to keep them all
+        self.num_outputs = self.num_channels + 2 if columns is None else len(columns) # number of columns of each returned sample
+        self.frame_size = self.dtype.itemsize
+        self.length = frames.payload_length(channels) # expected value of each frame's length field
+        self.pending = bytearray() # bytes received after the last complete frame, reused between reads
+        self.last_seq = None # sequence number of the last accepted frame
+        self.last_time = None # raw time of the last accepted frame, used to unwrap the 32-bit time
+        self.time_wraps = 0 # number of times the frame time has wrapped
+        self.rejected = {'crc': 0, 'resync': 0, 'dropped': 0} # number of frames/bytes rejected, by reason
+
+    def feed(self, chunk):
+        ''' Adds a chunk of raw serial bytes. Returns an (n, num_outputs) array of the accepted samples (time, channels, last_command,
+            columns picked). Binary frames have no raw text to record, so None is returned in place of LineParser's raw lines. '''
+        self.pending += chunk
+        buf = np.frombuffer(bytes(self.pending), dtype=np.uint8)
+        num_complete = len(buf) - self.frame_size + 1 # number of positions at which a complete frame could start
+        if num_complete <= 0:
+            return np.empty((0, self.num_outputs)), None
+        starts = np.flatnonzero((buf[:num_complete] == frames.SYNC_BYTES[0]) & (buf[1:num_complete + 1] == frames.SYNC_BYTES[1]))
+        starts = starts[(buf[starts + 2] | (buf[starts + 3].astype(np.uint16) << 8)) == self.length] # little-endian uint16 length field
+        candidates = buf[starts[:, None] + np.arange(self.frame_size)]
+        crc_ok = frames.crc16_rows(candidates[:, 2:-2]) == candidates[:, -2:].copy().view('<u2')[:, 0]
+        self.rejected['crc'] += len(starts) - np.count_nonzero(crc_ok)
+        starts, candidates = starts[crc_ok], candidates[crc_ok]
+        if len(starts) > 1 and np.any(np.diff(starts) < self.frame_size): # a valid-looking frame inside another one, keep the first
+            keep = [0]
+            for k in range(1, len(starts)):
+                if starts[k] - starts[keep[-1]] >= self.frame_size:
+                    keep.append(k)
+            starts, candidates = starts[keep], candidates[keep]
+
+        # Carry over everything after the last frame that could be complete, and count skipped bytes
+        consumed = max(num_complete, starts[-1] + self.frame_size if len(starts) else 0)
+        self.rejected['resync'] += int(min(consumed, len(buf)) - len(starts)*self.frame_size)
+        del self.pending[:consumed]
+        if len(starts) == 0:
+            return np.empty((0, self.num_outputs)), None
+
+        decoded = candidates.reshape(-1).view(self.dtype)
+        seq = decoded['seq'].astype(np.int64)
+        prev_seq = np.concatenate(([seq[0] - 1 if self.last_seq is None else self.last_seq], seq[:-1]))
+        gaps = (seq - prev_seq - 1) % frames.SEQ_WRAP
+        self.rejected['dropped'] += int(np.sum(gaps[gaps < frames.SEQ_WRAP//2])) # larger gaps mean the sequence restarted, not lost frames
+        self.last_seq = seq[-1]
+        raw_time = decoded['time'].astype(np.int64)
+        prev_time = np.concatenate(([raw_time[0] if self.last_time is None else self.last_time], raw_time[:-1]))
+        wraps = self.time_wraps + np.cumsum(prev_time - raw_time > frames.TIME_WRAP//2) # only a large backwards jump is a wrap
+        self.time_wraps = wraps[-1]
+        self.last_time = raw_time[-1]
+
+        values = np.empty((len(decoded), self.num_channels + 2))
+        values[:, 0] = (raw_time + wraps*frames.TIME_WRAP)/frames.TIME_SCALE
+        values[:, 1:-1] = frames.unpack_channels(decoded['channels'])
+        values[:, -1] = decoded['command']
+        if self.columns is not None:
+            return values[:, self.columns], None
+        return values, None
+
+    def lost(self):
+        ''' Returns the number of samples lost so far: frames that failed their CRC or never arrived (resync counts bytes, not frames). '''
+        return self.rejected['crc'] + self.rejected['dropped']
+
+    def report(self):
+        ''' Returns a one-line summary of the rejected frame counts. '''
+        return "Rejected frames: " + ", ".join(reason + " = " + str(count) for reason, count in self.rejected.items())
+
+def format_lines(values):
+    ''' Formats an (n, time + channels + last_command) array of samples as CSV lines in Quail's serial format, for recording. '''
+    return ''.join(','.join(repr(float(v)) for v in row[:-1]) + ',' + str(int(row[-1])) + ',0\n' for row in values)
 
 class quail:
+    reset_pending = False # True while the data process owes the GUI a reset it could not queue yet, see request_reset
     ### The Quail class has three primary objects that interact with the serial port:
     ###
     ### data_process : the data process is inherits the multiprocessing Process class, allowing it to be run in parallel
@@ -35,131 +213,312 @@ class quail:
     ###
     ### command_thread : the command thread runs on the data process stream as a thread. Python's GIL ensures that two threads on the same process
     ### never execute simultaneously, so no conflict can occur over serial port usage with blocking read/writes. This thread starts and terminates with
-    ### the data process.
+    ### the data process. It blocks on the command queue (waking every WORKER_POLL_TIMEOUT to check the kill flag) rather than polling it.
     ###
     ### record_thread : the record thread runs on the same processor as the primary GUI, and (when activated) offloads data from the recording queue
     ### and writes it to a user-specified data file. Making this a thread allows GUI updating and recording to happen "simultaneously" (during time
-    ### between GUI updates, the recording thread can work).
+    ### between GUI updates, the recording thread can work). The thread runs a RecordWriter, which blocks on the queue and writes in batches.
+    ### The record queue is bounded: if the disk falls behind, the data process waits for room (up to RECORD_PUT_TIMEOUT per block) rather than
+    ### lose recorded data, with the serial port's buffer absorbing the stall. Only a disk that stays stuck makes it drop record blocks, which
+    ### is loud: each drop is logged, counted in record_dropped (shown by RecordingPane) and noted at the end of the record file.
+    ###
+    ### The transport argument selects how data reaches the GUI: 'queue' pickles each block through a multiprocessing Queue, while 'shm'
+    ### writes rows in place into a SharedRingBuffer that the GUI reads directly. Both are used through the same put/get/empty calls.
+    ###
+    ### The display path is bounded: if the GUI stops reading (e.g. while a modal dialog is open), the data queue/ring fills and the data
+    ### process holds back at most DISPLAY_BACKLOG_ROWS samples, reduced by display_policy ('latest' or 'minmax'). The number of samples
+    ### removed this way is counted in display_coalesced. Recording is unaffected, every sample still goes to the record queue.
+    ### The reset sent to clear the plots after a reconnect (a non-array item) never blocks either: if the queue is full it stays
+    ### pending (reset_pending) and goes ahead of the next rows sent, which are held back until it has been sent.
+    ###
+    ### The protocol argument selects the serial format Quail sends: 'csv' lines or 'binary' frames.
+    ###
+    ### The serial port is opened by a ConnectionManager (see ConnectionManager.py), which retries a failed connection with exponential
+    ### backoff, can discover the port by USB VID/PID (COM_Port='auto') and reconnects when an open port fails (e.g. is unplugged).
+    ### Its state and retry count are shared with the GUI through connection_status.
+    ###
+    ### mainwindow may be None to run without a GUI (the window title is then not updated). emulator_options is a dict of extra keyword
+    ### arguments passed to the QuailEmulator when connecting to it (e.g. {'rate': 10} to replay its data ten times faster).
+    ###
+    ### With trace=True, the data process also sends the read and enqueue times of every block over trace_queue, for the GUI's
+    ### LatencyTracer (see LatencyTrace.py).
+    ###
+    ### The channels Quail sends are described by a ChannelSchema (see ChannelSchema.py), which sizes the parsers and the data transport.
+    ### schema may be given; otherwise, with probe_schema=True, quail waits briefly for Quail to announce its channels in a header line,
+    ### and falls back to the channel definition file (lib/Quail_Channel_Defs.csv).
+    ###
+    ### With a publish address (a Unix socket path, or 'host:port'), the data process also publishes every block to local subscribers
+    ### through a TelemetryServer (see TelemetryServer.py), so other viewers (TelemetryClient.py) can share this serial reader.
 
-    def __init__(self, mainwindow, COM_Port=11, baud_rate =115200):
-        # Establish connection
-        if COM_Port < 0: # an un-realistic COM_Port request connects you to the Quail Emulator
-            self.serial = QuailEmulator('COM{}'.format(COM_Port), timeout=QUAIL_TIMEOUT)
-            mainwindow.title("Quail Dashboard | Connected to Quail Emulator...")
-        else:
-            mainwindow.title("Quail Dashboard | COM{}".format(COM_Port))
-            try:
-                self.serial = serial.Serial('COM{}'.format(COM_Port), timeout=QUAIL_TIMEOUT)
-            except:
-                self.serial = None
+    def __init__(self, mainwindow, COM_Port=11, baud_rate =115200, transport='queue', protocol='csv', emulator_options=None, trace=False, display_policy=DISPLAY_POLICY,
+                 schema=None, probe_schema=False, publish=None):
+        # Establish connection (a failed attempt is retried by the data process, see ConnectionManager)
+        self.connection = ConnectionManager(QUAIL_TIMEOUT, protocol=protocol, emulator_options=emulator_options) # opens the serial port and tracks its state
+        self.serial = self.connection.connect(COM_Port)
+        if mainwindow is not None:
+            if is_emulator_port(COM_Port): # an un-realistic COM_Port request connects you to the Quail Emulator
+                mainwindow.title("Quail Dashboard | Connected to Quail Emulator...")
+            else:
+                mainwindow.title("Quail Dashboard | " + port_name(COM_Port))
 
         # Initialize unpickled variables (anything the data and cmd processes don't use)
         self.mainwindow = mainwindow
         self.filename = None # string name/filepath of file to which recorded data should be stored
+        self.record_writer = None # the RecordWriter used by the current/last recording
+        self.record_flush_interval = RECORD_FLUSH_INTERVAL # passed to the RecordWriter, see RecordWriter.py
+        self.record_fsync_interval = RECORD_FSYNC_INTERVAL # passed to the RecordWriter, see RecordWriter.py
 
         # Initialize pickled variables (things that the data and cmd process use that are passed to the new process on start)
-        self.num_data_channels = 6 # number of data channels
-        self.COM_Port = COM_Port # COM Port used for serial connection, made process-safe via the Value object
-        self.kill = mp.Queue(maxsize=1) # flag indicating if the data process is to be terminated (if full, kill process)
-        self.recording = mp.Queue(maxsize=1) # flag indicating whether to record data recieved, (if full, record)
+        if schema is None and probe_schema and self.serial is not None:
+            schema = ChannelSchema.probe(self.serial) # None if Quail did not announce its channels
+        self.schema = schema if schema is not None else ChannelSchema.load() # names, units, dtypes and wire positions of the data channels
+        self.num_data_channels = len(self.schema) # number of data channels
+        self.COM_Port = COM_Port # COM Port used for serial connection (an integer n for COMn, or a device path string), see port_name
+        self.protocol = protocol # serial format sent by Quail, 'csv' or 'binary'
+        self.emulator_options = emulator_options or {} # extra keyword arguments for the QuailEmulator
+        self.record_format = RECORD_FORMAT # format of record files, 'csv' or 'columnar'
+        self.kill = mp.Event() # flag indicating if the data process is to be terminated (if set, kill process)
+        self.recording = mp.Event() # flag indicating whether to record data recieved (if set, record)
         self.COM_queue = mp.Queue(maxsize=1) # flag indicating whether to change serial connection (if full, try to connect at new COM value)   
-        self.record_queue = mp.Queue() # internally-used queue to which the data_process pushes and from which the record_thread reads
-        self.data_queue = mp.Queue() # queue to which ducer/sensor data is pushed
+        self.record_queue = mp.Queue(maxsize=RECORD_QUEUE_MAXSIZE) # internally-used queue to which the data_process pushes and from which the record_thread reads
+        self.record_dropped = mp.Value('l', 0) # number of blocks the data process could not record because the record queue was full
+        self.samples_lost = mp.Value('l', 0) # number of samples rejected or missed by the serial parsers since collection started
+        if transport == 'shm':
+            self.data_queue = SharedRingBuffer(SHM_RING_CAPACITY, 1 + self.num_data_channels + 1) # shared-memory ring to which ducer/sensor data is written in place
+        else:
+            self.data_queue = mp.Queue(maxsize=DISPLAY_QUEUE_MAXSIZE) # queue to which ducer/sensor data is pushed, one (n, time + channels + last_command) array per block
+        self.transport = transport # 'queue' or 'shm', see above
+        self.display_policy = display_policy # how samples held back from a GUI that has fallen behind are reduced, see above
+        self.display_coalesced = mp.Value('l', 0) # number of samples removed from the display path by display_policy
         self.command_queue = mp.Queue() # queue from which commands are read (GUI pushes commands here)
+        self.trace_queue = mp.Queue() if trace else None # queue of (last sample time, read time, enqueue time) per block, if tracing latency
+        self.publish_address = publish # address the data process publishes blocks on, or None
 
         # Create processes/threads (does not start the process/thread)
         self.data_process = mp.Process(name = "Quail_DataThread", target = self.data_worker)
         self.record_thread = threading.Thread(name = "Quail_RecordThread", target = self.record_worker)
 
     def __getstate__(self):
-        return self.serial, self.num_data_channels, self.COM_Port, self.kill, self.recording, self.COM_queue, self.record_queue, self.data_queue, self.command_queue
+        return self.serial, self.connection, self.schema, self.num_data_channels, self.COM_Port, self.protocol, self.emulator_options, self.record_format, self.kill, self.recording, self.COM_queue, self.record_queue, self.record_dropped, self.samples_lost, self.data_queue, self.display_policy, self.display_coalesced, self.command_queue, self.trace_queue, self.publish_address
 
     def __setstate__(self, state):
-        self.serial, self.num_data_channels, self.COM_Port, self.kill, self.recording, self.COM_queue, self.record_queue, self.data_queue, self.command_queue = state
+        self.serial, self.connection, self.schema, self.num_data_channels, self.COM_Port, self.protocol, self.emulator_options, self.record_format, self.kill, self.recording, self.COM_queue, self.record_queue, self.record_dropped, self.samples_lost, self.data_queue, self.display_policy, self.display_coalesced, self.command_queue, self.trace_queue, self.publish_address = state
 
     def start_collection(self):
         self.data_process.start() # start the data collection process, which calls data_worker
 
     def stop_collection(self):
-        if self.kill.empty():
-            self.kill.put(0) # set the kill flag so that the data collection process and cmd thread terminate after completing the current loop
+        self.kill.set() # set the kill flag so that the data collection process and cmd thread terminate after completing the current loop
         self.data_process.join() # wait for the data collection process to terminate
-        self.kill.get() # clear the kill queue
-        if self.recording.full():
+        self.kill.clear() # clear the kill flag
+        if self.recording.is_set():
             self.stop_recording() # stop recording if necessary
+        if self.transport == 'shm':
+            self.data_queue.close() # free the shared memory, the data process is no longer writing to it
+
+    def start_recording(self, filename, directory=None):
+        self.filename = self.record_filename(filename, directory) # set file name to the desired path/name
+        self.record_dropped.value = 0 # the data process only counts drops while recording, so nothing else is writing it
+        self.recording.set() # turn on recording indicator for data collection process
+        self.record_thread.start() # start record thread, calling record_worker
 
-    def start_recording(self, filename):
-        ## Validate filename and add time stamp to path ##
+    def record_filename(self, filename, directory=None):
+        ''' Returns the time-stamped path of a new record file named after filename, in <directory>/Data/<date> (directory
+            defaults to the program's folder), creating the folder if needed. '''
         now=datetime.now()
         d_string = now.strftime("%d_%m_%Y")
         t_string = now.strftime("%H_%M_%S")
-        file_base = sys.path[0]
+        file_base = sys.path[0] if directory is None else directory
         add_on = "/Data/"+d_string
         if not os.path.exists(file_base+add_on):
             try: 
-                os.makedirs(sys.path[0] + add_on)
+                os.makedirs(file_base + add_on)
                 file_base = file_base + add_on
             except OSError:
                 pass
         else:
             file_base = file_base + add_on
 
-        ## Initialize vars and begin recording ##
-        self.filename = file_base + "/" + filename + "___" + d_string + "___" + t_string + ".txt" # set file name to the desired path/name
-        self.recording.put(0) # turn on recording indicator for data collection process
-        self.record_thread.start() # start record thread, calling record_worker
+        extension = ".qcol" if self.record_format == 'columnar' else ".txt"
+        return file_base + "/" + filename + "___" + d_string + "___" + t_string + extension
     
     def stop_recording(self):
-        self.recording.get() # stop adding new data to the record queue
+        self.recording.clear() # stop adding new data to the record queue
         self.record_thread.join() # stop the record_thread, allowing it to write any data that remains in the queue before returning
         self.record_thread = threading.Thread(name = "Quail_RecordThread", target = self.record_worker) # re-instantiate the thread so it can be started again
 
     def record_worker(self):
         if self.filename is not None: # ensure that the filename has been set
-            with open(self.filename, "w") as f: # open the write-to file
-                while self.recording.full() or not(self.record_queue.empty()): # if recording data or if there's data left to record in the queue
-                    if not(self.record_queue.empty()):
-                        f.write( self.record_queue.get() ) # if there is an item in the queue, remove it and write it 
+            if self.record_format == 'columnar':
+                self.record_writer = ColumnarRecordWriter(self.filename, self.record_queue, self.recording, column_names(self.schema.names),
+                                                          flush_interval=self.record_flush_interval, fsync_interval=self.record_fsync_interval,
+                                                          dropped=self.record_dropped)
+            else:
+                self.record_writer = RecordWriter(self.filename, self.record_queue, self.recording, flush_interval=self.record_flush_interval,
+                                                  fsync_interval=self.record_fsync_interval, dropped=self.record_dropped)
+            self.record_writer.run() # write batches from the record queue until recording stops and the queue is empty
+
+    def record_stats(self):
+        ''' Returns the current recording statistics: bytes written, bytes written per second, record queue backlog (None if
+            unknown) and number of blocks dropped because the record queue was full. Returns None if nothing has been recorded. '''
+        if self.record_writer is None:
+            return None
+        return {'bytes_written': self.record_writer.bytes_written, 'bytes_per_sec': self.record_writer.bytes_per_sec,
+                'backlog': self.record_writer.backlog(), 'dropped': self.record_dropped.value}
 
     def data_worker(self):
         self.cmd_thread = threading.Thread(name = "Quail_CmdThread", target = self.cmd_worker)
         self.cmd_thread.start() # start the cmd thread
-        while self.kill.empty(): # while the process has not been killed
-            if self.serial is None or self.COM_queue.full():
-                if self.COM_queue.full():
-                    self.COM_Port = self.COM_queue.get()
-                if self.COM_Port < 0: # an un-realistic COM_Port request connects you to the Quail Emulator
-                    self.serial = QuailEmulator('COM{}'.format(self.COM_Port), timeout=QUAIL_TIMEOUT)
-                else:
-                    try:
-                        self.serial = serial.Serial('COM{}'.format(self.COM_Port), timeout=QUAIL_TIMEOUT)
-                    except:
-                        self.serial = None
-                        continue # if connection failed, don't try to read
-                self.data_queue.put(0) # put non-list object to indicate that GUI should clear old data (new serial port)
-
-            # Query device for string containing measurement values
-            val_string = str(self.serial.readline())
-
-            val_string = val_string.strip("\n\r,b'").split(',') # break the value string apart
-            if len(val_string) != QUAIL_NUM_ELEMENTS:
-                continue # if string recieved has fewer elements than expected, toss it out
-            val_array = [float(val) for val in val_string] # convert measurements to float
-            
-            if val_array.pop() == 0: # confirm the last item in the serial string is zero before keeping data
-                self.data_queue.put(val_array) # add array of data to data_queue
-                if self.recording.full():
-                    self.record_queue.put(','.join(val_string)+'\n') # add raw comma-delimited string to record queue
+        parser = self.new_parser() # splits the raw serial bytes into lines/frames and converts them to samples
+        publisher = self.start_publisher() # TelemetryServer fanning blocks out to other viewers, or None
+        block = [] # arrays of parsed samples waiting to be sent to the GUI as one block
+        block_lines = [] # raw lines of the samples in block, sent to the record queue as one string
+        block_rows = 0 # number of samples in block
+        block_start = 0 # perf_counter time when the oldest sample in block was read
+        lost_before = 0 # samples lost by parsers replaced after a serial port change
+        display_backlog = None # samples held back because the GUI has fallen behind, sent ahead of the next block
+        while not self.kill.is_set(): # while the process has not been killed
+            if self.COM_queue.full():
+                self.COM_Port = self.COM_queue.get()
+                if self.serial is not None:
+                    self.connection.lost(self.serial) # close the old serial port
+                    self.serial = None
+                self.connection.reset() # connect to the new port right away
+            if self.serial is None:
+                self.serial = self.connection.connect(self.COM_Port)
+                if self.serial is None:
+                    self.kill.wait(min(self.connection.wait_time(), WORKER_POLL_TIMEOUT)) # back off, still checking for shutdown and a new COM Port
+                    continue # if connection failed, don't try to read
+                if any(parser.rejected.values()): # a flapping link reconnects often, only report the old port's losses
+                    print(parser.report())
+                lost_before += parser.lost()
+                parser = self.new_parser() # drop any partial line from the old serial port
+                block, block_lines, block_rows = [], [], 0 # samples from the old serial port are no longer wanted
+                display_backlog = None
+                self.request_reset() # the GUI should clear old data (new serial port)
+                if publisher is not None:
+                    publisher.reset()
+
+            # Read everything waiting on the serial port (blocking for up to QUAIL_TIMEOUT if nothing is waiting) and parse it
+            try:
+                chunk = self.serial.read(max(1, self.serial.in_waiting))
+                waiting = self.serial.in_waiting
+            except (serial.SerialException, OSError): # the port went away (e.g. Quail was unplugged), reconnect
+                self.connection.lost(self.serial)
+                self.serial = None
+                continue
+            read_time = time.perf_counter()
+            val_array, val_lines = parser.feed(chunk)
+            if len(val_array) > 0:
+                if block_rows == 0:
+                    block_start = read_time
+                block.append(val_array)
+                if val_lines is None and self.recording.is_set() and self.record_format == 'csv':
+                    val_lines = format_lines(val_array) # binary frames carry no text, so format the samples for the record file
+                block_lines.append(val_lines or '')
+                block_rows += len(val_array)
+
+            # Send the block once it is full, once its oldest sample is too old, or once the serial port has been caught up on
+            if block_rows > 0 and (block_rows >= BLOCK_MAX_ROWS or time.perf_counter() - block_start >= BLOCK_MAX_AGE or waiting == 0):
+                block = np.concatenate(block, axis = 0)
+                if self.trace_queue is not None:
+                    self.trace_queue.put((block[-1, 0], block_start, time.perf_counter())) # sent ahead of the block, so the GUI has it on dequeue
+                display_backlog = self.put_display(block if display_backlog is None else np.concatenate((display_backlog, block), axis = 0))
+                if self.recording.is_set():
+                    self.put_record(block, ''.join(block_lines))
+                if publisher is not None:
+                    publisher.publish(block)
+                block, block_lines, block_rows = [], [], 0
+                self.samples_lost.value = lost_before + parser.lost() # only the data process writes it, so no lock is needed
+            elif (display_backlog is not None or self.reset_pending) and block_rows == 0:
+                display_backlog = self.put_display(display_backlog) # nothing new to send, retry the held-back samples (or reset) alone
+        print(parser.report())
+        if publisher is not None:
+            publisher.close()
         self.cmd_thread.join() # wait for the cmd_thread to finish writing any commands in the queue, then terminate it
 
+    def start_publisher(self):
+        ''' Starts and returns the TelemetryServer publishing on publish_address, or returns None if there is none. '''
+        if self.publish_address is None:
+            return None
+        publisher = TelemetryServer(self.publish_address, self.schema)
+        publisher.start()
+        return publisher
+
+    def request_reset(self):
+        ''' Asks the GUI to clear its plots, without blocking: the reset (a non-array item) is queued now if there is room, otherwise
+            it stays pending and put_display sends it ahead of the next rows. '''
+        self.reset_pending = True
+        self.put_display(None)
+
+    def put_display(self, rows):
+        ''' Hands rows to the GUI without ever blocking the data process, after any pending reset. If the data queue is full,
+            returns the rows to be held back and retried with the next block, reduced to DISPLAY_BACKLOG_ROWS by display_policy;
+            otherwise returns None. rows may be None to only send a pending reset. '''
+        if self.reset_pending:
+            try:
+                self.data_queue.put_nowait(0) # put non-list object to indicate that GUI should clear old data
+                self.reset_pending = False
+            except queue.Full:
+                pass
+        if rows is None:
+            return None
+        if not self.reset_pending: # rows must not reach the GUI ahead of the reset that clears the plots
+            try:
+                self.data_queue.put_nowait(rows)
+                return None
+            except queue.Full:
+                pass
+        reduced = decimate.reduce(rows, DISPLAY_BACKLOG_ROWS, self.display_policy)
+        if len(reduced) < len(rows):
+            self.display_coalesced.value += len(rows) - len(reduced) # only the data process writes it
+        return reduced
+
+    def put_record(self, block, lines):
+        ''' Hands a block to the record thread: the block itself for columnar recording, otherwise its comma-delimited lines. If the
+            record queue is full, waits up to RECORD_PUT_TIMEOUT for room; only then is the block dropped, logged and counted in
+            record_dropped. '''
+        try:
+            if self.record_format == 'columnar':
+                self.record_queue.put(block, timeout=RECORD_PUT_TIMEOUT) # add the block itself to the record queue, it is stored column by column
+            else:
+                self.record_queue.put(lines, timeout=RECORD_PUT_TIMEOUT) # add raw comma-delimited strings to record queue
+        except queue.Full: # the disk has not taken anything for RECORD_PUT_TIMEOUT, give up on this block rather than stall for good
+            with self.record_dropped.get_lock():
+                self.record_dropped.value += 1
+            print("Record queue full for " + str(RECORD_PUT_TIMEOUT) + " s, dropped " + str(len(block)) + " samples from the recording (" +
+                  str(self.record_dropped.value) + " blocks dropped so far)")
+
+    def new_parser(self):
+        ''' Returns a parser for the serial format Quail is sending. '''
+        if self.protocol == 'binary':
+            return FrameParser(self.schema.wire_dtypes, self.schema.columns())
+        return LineParser(1 + self.schema.wire_width + 1 + 1, self.schema.columns()) # time, wire channels, last_command, zerocheck
+
     def cmd_worker(self):
-        while self.kill.empty() or (self.serial is not None and not(self.command_queue.empty()) ): # while the process is active or while there are commands left to write
-            if not self.command_queue.empty() and self.serial is not None : # if self.serial is None, Quail is not connected
-                command = self.command_queue.get() # get the command to be written
-                self.serial.write((str(command) + '\r\n').encode()) #convert unicode string to utf-8 and send through serial
-                self.serial.flush() #waits for output to be written to ensure the message gets through
-            
-            
+        while True: # runs while the process is active or while there are commands left to write
+            try:
+                command = self.command_queue.get(timeout=WORKER_POLL_TIMEOUT) # block until there is a command to be written
+            except queue.Empty:
+                if self.kill.is_set():
+                    break
+                continue
+            while self.serial is None: # if self.serial is None, Quail is not connected, so hold the command until it is
+                if self.kill.wait(WORKER_POLL_TIMEOUT):
+                    return
+            while True:
+                try:
+                    self.serial.write((str(command) + '\r\n').encode()) #convert unicode string to utf-8 and send through serial
+                    self.serial.flush() #waits for output to be written to ensure the message gets through
+                    break
+                except (serial.SerialException, OSError, AttributeError): # the port failed or is being reconnected, retry once it is back
+                    if self.kill.wait(WORKER_POLL_TIMEOUT):
+                        return
+
+    def connection_status(self):
+        ''' Returns a one-line description of the serial connection, e.g. 'connected to COM11' (see ConnectionManager). '''
+        return self.connection.status_text()
+
     def write_command(self, command):
         try:
             self.command_queue.put(int(command) )
@@ -170,15 +529,23 @@ class quail:
                 print("Quail recieved a non-integer command")
 
     def set_COM_port(self):
-        newCOM = dialog.askinteger("Edit COM Port", "Enter new COM Port: ")
-        if newCOM is not None and newCOM != self.COM_Port: # if this is a new COM Port
+        import tkinter.simpledialog as dialog # imported here so acquisition runs without Tk (see QuailDaemon.py)
+        newCOM = dialog.askstring("Edit COM Port", "Enter new COM Port number, device path (e.g. /dev/ttyACM0) or 'auto': ")
+        if newCOM is not None:
+            newCOM = newCOM.strip()
+            try:
+                newCOM = int(newCOM) # a number selects COM<number> (or the emulator, if negative)
+            except ValueError:
+                pass # anything else is used as a device path
+        if newCOM is not None and newCOM != '' and newCOM != self.COM_Port: # if this is a new COM Port
             self.COM_Port =  newCOM # update COM_Port value 
             self.COM_queue.put(newCOM) # push to queue so data_process knows to renew serial connection at new port
 
-            if newCOM < 0: 
-                self.mainwindow.title("Quail Dashboard | Running Quail Emulator... " )
-            else:
-                self.mainwindow.title("Quail Dashboard | COM{}".format(newCOM))
+            if self.mainwindow is not None:
+                if is_emulator_port(newCOM):
+                    self.mainwindow.title("Quail Dashboard | Running Quail Emulator... " )
+                else:
+                    self.mainwindow.title("Quail Dashboard | " + port_name(newCOM))
             
             
 
@@ -0,0 +1,86 @@
+#############
+''' Telemetry Frames Module :
+Definitions shared by the binary telemetry encoder (QuailEmulator) and decoder (quail_serial.FrameParser). A binary frame is
+a packed, little-endian record:
+
+    sync (uint16, 0x5AA5) | length (uint16) | seq (uint16) | time (uint32, microseconds) | CH1..CHn (float32) | last_command (uint8) | crc (uint16)
+
+The channels are float32 unless a channel schema gives other dtypes (see ChannelSchema.py), in which case each channel field has
+its own dtype, in wire order. Functions taking `channels` accept either a channel count (all float32) or a list of channel dtypes.
+
+length is the number of bytes between the length field and the crc (seq through last_command), which lets a decoder reject frames
+sent with a different channel count. It is 16 bits wide, so a frame can carry up to MAX_CHANNELS float32 channels. An 8-bit
+length would stop at 62 channels.
+
+seq increments by one per frame (wrapping at 65536) so dropped frames can be counted, and the time wraps at 2^32 microseconds
+(~71 min), which the decoder unwraps. crc is the CRC-16/CCITT-FALSE of every byte from length through last_command.
+'''
+#############
+import struct
+import numpy as np
+from numpy.lib import recfunctions
+
+SYNC = 0x5AA5 # sync word that starts every frame (sent as the bytes A5 5A)
+SYNC_BYTES = struct.pack('<H', SYNC)
+TIME_SCALE = 1e6 # frame time ticks per second
+TIME_WRAP = 2**32 # frame time wraps at this many ticks
+SEQ_WRAP = 2**16 # frame sequence number wraps at this value
+MAX_CHANNELS = (2**16 - 1 - 2 - 4 - 1)//4 # most float32 channels whose frame length fits the length field
+
+def channels_dtype(channels):
+    ''' Returns the dtype of a frame's channel fields: a subarray if every channel has the same dtype, else one field per channel. '''
+    if np.isscalar(channels):
+        channels = ['<f4']*int(channels)
+    if len(set(channels)) == 1:
+        return np.dtype((channels[0], (len(channels),)))
+    return np.dtype([('c' + str(k), dtype) for k, dtype in enumerate(channels)])
+
+def frame_dtype(channels):
+    ''' Returns the numpy dtype of one frame carrying the given channels (a channel count, or a list of channel dtypes). '''
+    return np.dtype([('sync', '<u2'), ('length', '<u2'), ('seq', '<u2'), ('time', '<u4'),
+                     ('channels', channels_dtype(channels)), ('command', 'u1'), ('crc', '<u2')])
+
+def frame_struct(num_channels):
+    ''' Returns the struct.Struct of one frame carrying num_channels float32 data channels, excluding the trailing crc. '''
+    return struct.Struct('<HHHI' + str(num_channels) + 'fB')
+
+def payload_length(channels):
+    ''' Returns the value of the length field for a frame carrying the given channels. '''
+    return frame_dtype(channels).itemsize - 2 - 2 - 2 # everything except the sync, length and crc fields
+
+def unpack_channels(field):
+    ''' Returns the 'channels' field of an array of frames as an (n, num_channels) float64 array. '''
+    if field.dtype.names is None:
+        return field.astype(np.float64)
+    return recfunctions.structured_to_unstructured(field, dtype = np.float64)
+
+def pack_channels(values, dtype):
+    ''' Returns an (n, num_channels) array of channel values converted to a frame's 'channels' field dtype (see channels_dtype). '''
+    if dtype.names is None:
+        return values
+    return recfunctions.unstructured_to_structured(np.asarray(values), dtype = dtype)
+
+''' CRC-16/CCITT-FALSE lookup table (polynomial 0x1021). '''
+def _make_crc_table():
+    table = np.zeros(256, dtype=np.uint16)
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table[byte] = crc & 0xFFFF
+    return table
+CRC_TABLE = _make_crc_table()
+
+def crc16(data):
+    ''' Returns the CRC-16/CCITT-FALSE of a bytes-like object. '''
+    crc = 0xFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ int(CRC_TABLE[(crc >> 8) ^ byte])
+    return crc
+
+def crc16_rows(rows):
+    ''' Returns the CRC-16/CCITT-FALSE of each row of a 2D uint8 array, computed for all rows at once (one step per column). '''
+    crc = np.full(len(rows), 0xFFFF, dtype=np.uint16)
+    for j in range(rows.shape[1]):
+        crc = ((crc << 8) & 0xFFFF).astype(np.uint16) ^ CRC_TABLE[(crc >> 8) ^ rows[:, j]]
+    return crc
@@ -42,6 +42,11 @@ metric_mult = {
     "n": 1E-9
 }
 
+''' The affine cache stores every (from_unit, to_unit) pair that has been compiled by affine() as a (scale, offset) pair, so that a
+    conversion is a multiply-add instead of a search of the unit lib. All conversions defined above are affine.
+'''
+affine_cache = {}
+
 def get_available_units():
     ''' Returns a list of all available units defined in the units lib '''
     unit_list = []
@@ -144,6 +149,28 @@ def convert(value, from_unit, to_unit):
     
     return np.multiply(value, mult) # apply the multiplier and return
 
+def affine(from_unit, to_unit):
+    ''' Returns (scale, offset) such that convert(value, from_unit, to_unit) == value*scale + offset. Each pair of units is compiled
+        once and then taken from the affine cache. Raises a KeyError if the units passed are incompatible or invalid. '''
+    key = (from_unit, to_unit)
+    if key not in affine_cache:
+        if from_unit.casefold() == to_unit.casefold():
+            affine_cache[key] = (1.0, 0.0)
+        else:
+            offset = float(convert(0.0, from_unit, to_unit))
+            affine_cache[key] = (float(convert(1.0, from_unit, to_unit)) - offset, offset)
+    return affine_cache[key]
+
+def compile_conversions(from_units, to_units):
+    ''' Returns (scales, offsets), two (1, number of units) arrays such that block*scales + offsets converts every column j of
+        an (n, number of units) block from from_units[j] to to_units[j] in one broadcast multiply-add. '''
+    pairs = np.array([affine(from_unit, to_unit) for from_unit, to_unit in zip(from_units, to_units)], dtype = float).reshape(-1, 2)
+    return pairs[:, 0].reshape(1, -1), pairs[:, 1].reshape(1, -1)
+
+def clear_cache():
+    ''' Empties the affine cache, so every pair of units is compiled again (needed if unit_lib or unit_offset are edited). '''
+    affine_cache.clear()
+
 
 ### FUNCTIONALITY TESTING ###
 # print( 0 == convert(-273.15, 'C', 'K'))